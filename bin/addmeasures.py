@@ -1,14 +1,17 @@
 import csv
-import sys
-import math
-import operator
 import itertools
-import datetime
-import rolling_measures
+import multiprocessing
+import sys
+import numpy
 import global_measures
+from pelagos_processing import measures
 
 args = {
-    "window": 60*60
+    "window": 60*60,
+    "jobs": 1,
+    "measures": ','.join(measures.DEFAULT_MEASURES + ['distance_to_port']),
+    "rasters": "",
+    "ports": ""
 }
 files = []
 for arg in sys.argv[1:]:
@@ -22,95 +25,136 @@ for arg in sys.argv[1:]:
     else:
         files.append(arg)
 
-args['window'] = float(args['window'])
-
-def mangle(rows):
-    for row in rows:
-        for key, value in row.iteritems():
-            if key == 'mmsi':
-                pass
-            elif key == 'timestamp':
-                row[key] = datetime.datetime.fromtimestamp(int(row[key]))
-            else:
-                row[key] = float(value)
+# A comma separated list of windows in seconds are all computed in one pass.  With more than one window
+# the per-window columns get the window as a suffix, e.g. --window=3600,86400 gives pos_3600 and pos_86400
+args['window'] = [float(window) for window in str(args['window']).split(',')]
+# Vessels are measured in a pool of this many processes
+args['jobs'] = int(args['jobs'])
+# Only these measures are computed, along with whatever they depend on - see pelagos_processing.measures
+args['measures'] = [name for name in args['measures'].split(',') if name]
+# Extra covariates sampled at every point as name=raster,name=raster - all rasters are sampled together,
+# with points projected once per CRS
+args['rasters'] = [tuple(raster.split('=', 1)) for raster in args['rasters'].split(',') if raster]
+# With --ports=<any OGR datasource> distance_to_port is measured to the nearest port feature
+# instead of being read from the distance from port raster
+if 'distance_to_port' in args['measures'] and not args['ports']:
+    args['rasters'].insert(0, ('distance_to_port', 'distance-from-port-2km/distance-from-port.tif'))
 
-        # Normalize
-        row['score'] = row['score'] / 5.0
-        row['hdg'] = row['hdg'] / 360.0
-        row['cog'] = row['cog'] / 360.0
-        row['sog'] = 1.0 - min(1.0, row['sog'] / 17.0)
-
-        yield row
+inkeys = ['mmsi','longitude','latitude','timestamp','score','navstat','hdg','rot','cog','sog']
 
 
-def unmangle(row):
+def load(infile):
+    """Reads the whole file once and returns (mmsi list, {key: float array})"""
+    with open(infile) as f:
+        rows = list(csv.reader(f))
+    if rows:
+        columns = zip(*rows)
+    else:
+        columns = [()] * len(inkeys)
+    mmsi = list(columns[0])
+    values = {key: numpy.array(column, dtype=numpy.float64)
+              for key, column in zip(inkeys[1:], columns[1:])}
+    return mmsi, values
+
+def mangle(values):
+    # Normalize
+    values['score'] = values['score'] / 5.0
+    values['hdg'] = values['hdg'] / 360.0
+    values['cog'] = values['cog'] / 360.0
+    values['sog'] = 1.0 - numpy.minimum(1.0, values['sog'] / 17.0)
+    return values
+
+def unmangle(values):
+    """Converts arrays to lists of strings the same way str() formats a float row by row"""
     res = {}
-    for key, value in row.iteritems():
-        if isinstance(value, datetime.datetime):
-            value = value.strftime("%s")
-        elif isinstance(value, datetime.timedelta):
-            value = str(value.total_seconds())
-        elif isinstance(value, (float, int)):
-            value = str(value)
-        res[key] = value
+    for key, value in values.iteritems():
+        if key == 'mmsi':
+            res[key] = value
+        elif key == 'timestamp':
+            res[key] = [str(int(v)) for v in value.tolist()]
+        else:
+            res[key] = [str(v) for v in value.tolist()]
     return res
 
-distances_to_port = global_measures.PixelReader('distance-from-port-2km/distance-from-port.tif')
-
-inkeys = ['mmsi','longitude','latitude','timestamp','score','navstat','hdg','rot','cog','sog']
-outkeys = ["distance_to_port", "new_score"]
+def vessel_partitions(mmsi):
+    """Returns an array of row indices for each vessel, in order of first appearance and with rows in input order"""
+    if not mmsi:
+        return []
+    ids, first, inverse = numpy.unique(mmsi, return_index=True, return_inverse=True)
+    rows = numpy.argsort(inverse, kind='mergesort')
+    partitions = numpy.split(rows, numpy.cumsum(numpy.bincount(inverse))[:-1])
+    return [partitions[i] for i in numpy.argsort(first)]
+
+def window_suffix(window):
+    if len(args['window']) == 1:
+        return ''
+    elif window == int(window):
+        return '_%d' % window
+    else:
+        return '_%s' % window
 
-windowSize = datetime.timedelta(seconds=args['window'])
+def measure_partition(job):
+    values, plan = job
+    return plan.evaluate(values)
 
 def addMeasures(infile, outfile):
-    with open(infile) as startIn:
-        with open(infile) as endIn:
-            with open(outfile, "w") as out:
-                stats = rolling_measures.Stats({
-                        "cogstddev": rolling_measures.Stat("cog", rolling_measures.StdDev),
-                        "sogstddev": rolling_measures.Stat("sog", rolling_measures.StdDev),
-                        "cogavg": rolling_measures.Stat("cog", rolling_measures.Avg),
-                        "sogavg": rolling_measures.Stat("sog", rolling_measures.Avg),
-                        "latitudeavg": rolling_measures.Stat("latitude", rolling_measures.Avg),
-                        "longitudeavg": rolling_measures.Stat("longitude", rolling_measures.Avg),
-                        "pos": rolling_measures.StatSum(rolling_measures.Stat("latitude", rolling_measures.StdDev),
-                                                        rolling_measures.Stat("longitude", rolling_measures.StdDev))
-                        })
-
-                diffkeys = ['longitude','latitude','timestamp','hdg','rot','cog','sog']
-                diffdiffkeys = [key + "_diff" for key in diffkeys]
-
-                startIn = iter(mangle(csv.DictReader(startIn, inkeys)))
-                endIn = iter(mangle(csv.DictReader(endIn, inkeys)))
-
-                out = csv.DictWriter(out, inkeys + diffdiffkeys + stats.fieldmap.keys() + outkeys, 'ignore')
-                out.writeheader()
-
-                start = None
-                last = None
-                for end in endIn:
-                    if last is None: last = end
-                    end.update({key + "_diff": abs(end[key] - last[key]) for key in diffkeys})
-
-                    end['distance_to_port'] = distances_to_port.read(end['longitude'], end['latitude']) / 1852.0 # Convert from meters to nautical miles 
-
-                    stats.add(end)
-                    while not start or end['timestamp'] - start['timestamp'] > windowSize:
-                        if start:
-                            stats.remove(start)
-                        start = startIn.next()
-                    s = stats.get()
-                    # Knots...
-                    s['pos'] = (s['pos'] * 60) / (windowSize.total_seconds() / 60 / 60)
-                    # Normalize to "normal" vessel speed
-                    s['pos'] /= 17.0
-                    s['pos'] = min(1.0, s['pos'])
-                    end.update(s)
-
-                    end['new_score'] = (end['cogstddev'] + end['sogstddev'] + end['sogavg']) / 3.0
-                    
-                    out.writerow(unmangle(end))
-                    last = end
+    mmsi, values = load(infile)
+    values = mangle(values)
+
+    covariates = [name for name, raster in args['rasters']]
+    useports = args['ports'] and 'distance_to_port' in args['measures']
+    if useports:
+        covariates.append('distance_to_port')
+    plan = measures.Plan([name for name in args['measures'] if name not in covariates], args['window'])
+    outkeys = {(name, window): name if window is None else name + window_suffix(window)
+               for name, window in plan.outputs}
+    # Columns that don't depend on a window first, then each window's columns
+    fieldnames = [outkeys[(name, window)] for name, window in plan.outputs if window is None]
+    for window in args['window']:
+        fieldnames += [outkeys[(name, w)] for name, w in plan.outputs if w == window]
+
+    # Each vessel is measured on its own so windows never span two vessels, and the
+    # results are scattered back to the rows they came from to keep the input order
+    partitions = vessel_partitions(mmsi)
+    jobs = (({key: values[key][rows] for key in plan.columns}, plan) for rows in partitions)
+    if args['jobs'] > 1:
+        pool = multiprocessing.Pool(args['jobs'])
+        results = pool.imap(measure_partition, jobs, max(1, len(partitions) // (args['jobs'] * 4)))
+    else:
+        pool = None
+        results = (measure_partition(job) for job in jobs)
+
+    output = {key: numpy.zeros(len(mmsi)) for key in fieldnames}
+    try:
+        for rows, res in itertools.izip(partitions, results):
+            for key, value in res.iteritems():
+                output[outkeys[key]][rows] = value
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    values.update(output)
+
+    # Rasters are sampled once per point no matter how many windows are computed
+    if args['rasters']:
+        rasters = global_measures.RasterStack(args['rasters'])
+        values.update(rasters.read_many(values['longitude'], values['latitude']))
+        rasters.close()
+    if useports:
+        ports = global_measures.NearestFeatureIndex.from_file(args['ports'])
+        values['distance_to_port'] = ports.distance(values['longitude'], values['latitude'])
+    if 'distance_to_port' in values:
+        values['distance_to_port'] /= 1852.0 # Convert from meters to nautical miles
+    fieldnames += covariates
+
+    values['mmsi'] = mmsi
+    values = unmangle(values)
+
+    fieldnames = inkeys + fieldnames
+    with open(outfile, "w") as out:
+        out = csv.writer(out)
+        out.writerow(fieldnames)
+        out.writerows(zip(*[values[key] for key in fieldnames]))
 
 
 try:
@@ -5,9 +5,12 @@ from __future__ import division
 from __future__ import unicode_literals
 
 import argparse
+import math
+import multiprocessing
 from os.path import basename
 import sys
 
+import numpy
 
 try:
     from osgeo import gdal
@@ -16,6 +19,7 @@ try:
 except ImportError:
     import gdal
     import ogr
+    import osr
 gdal.UseExceptions()
 ogr.UseExceptions()
 
@@ -27,6 +31,350 @@ ogr.UseExceptions()
 __version__ = '0.1-dev'
 __program_name__ = basename(__file__)
 
+# Per-process state for pool workers, set up once by init_worker()
+_worker = {}
+
+
+# =========================================================================== #
+#   Define tile_windows() function
+# =========================================================================== #
+
+def tile_windows(x_size, y_size, tile_size):
+
+    """
+    Split a raster into tiles, in row-major order
+
+    :param x_size: raster width in pixels
+    :type x_size: int
+    :param y_size: raster height in pixels
+    :type y_size: int
+    :param tile_size: tile width and height in pixels
+    :type tile_size: int
+    :return: (xoff, yoff, width, height) for every tile
+    :rtype: list
+    """
+
+    return [(xoff, yoff, min(tile_size, x_size - xoff), min(tile_size, y_size - yoff))
+            for yoff in range(0, y_size, tile_size) for xoff in range(0, x_size, tile_size)]
+
+
+# =========================================================================== #
+#   Define affected_windows() function
+# =========================================================================== #
+
+def affected_windows(diff_vector, geotransform, projection, raster_size, tile_size, halo):
+
+    """
+    Find the tiles within a halo of any feature in a vector.  Features are
+    reprojected to the raster's SRS first.
+
+    :param diff_vector: path to a vector containing the added and removed features
+    :type diff_vector: str
+    :param geotransform: geotransform of the full raster
+    :type geotransform: tuple
+    :param projection: WKT of the full raster
+    :type projection: str
+    :param raster_size: (width, height) of the full raster
+    :type raster_size: tuple
+    :param tile_size: tile width and height in pixels
+    :type tile_size: int
+    :param halo: number of pixels around each feature's envelope that may have changed
+    :type halo: int
+    :return: (xoff, yoff, width, height) for every affected tile, in row-major order
+    :rtype: list
+    """
+
+    raster_srs = osr.SpatialReference()
+    raster_srs.ImportFromWkt(projection)
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        raster_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    tiles = set()
+    diff_ds = ogr.Open(diff_vector, 0)
+    for layer in diff_ds:
+        layer_srs = layer.GetSpatialRef()
+        if layer_srs is None or layer_srs.IsSame(raster_srs):
+            transform = None
+        else:
+            transform = osr.CoordinateTransformation(layer_srs, raster_srs)
+        for feature in layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            if transform is not None:
+                geometry = geometry.Clone()
+                geometry.Transform(transform)
+            min_x, max_x, min_y, max_y = geometry.GetEnvelope()
+            x0 = max(0, int(math.floor((min_x - geotransform[0]) / geotransform[1])) - halo)
+            x1 = min(raster_size[0] - 1, int(math.floor((max_x - geotransform[0]) / geotransform[1])) + halo)
+            y0 = max(0, int(math.floor((max_y - geotransform[3]) / geotransform[5])) - halo)
+            y1 = min(raster_size[1] - 1, int(math.floor((min_y - geotransform[3]) / geotransform[5])) + halo)
+            for tile_y in range(y0 // tile_size, y1 // tile_size + 1):
+                for tile_x in range(x0 // tile_size, x1 // tile_size + 1):
+                    tiles.add((tile_x * tile_size, tile_y * tile_size))
+    diff_ds = None
+
+    return [window for window in tile_windows(raster_size[0], raster_size[1], tile_size) if window[:2] in tiles]
+
+
+# =========================================================================== #
+#   Define compute_tile() function
+# =========================================================================== #
+
+def compute_tile(layers, window, halo, geotransform, projection, raster_size, nodata, rize_options,
+                 proximity_options):
+
+    """
+    Rasterize and compute proximity for one tile plus a halo of pixels around
+    it, so features outside the tile but within the max distance still count
+
+    :param layers: OGR layers to rasterize
+    :type layers: list
+    :param window: (xoff, yoff, width, height) of the tile in the full raster
+    :type window: tuple
+    :param halo: number of pixels to pad the tile with on every side
+    :type halo: int
+    :param geotransform: geotransform of the full raster
+    :type geotransform: tuple
+    :param projection: WKT of the full raster
+    :type projection: str
+    :param raster_size: (width, height) of the full raster
+    :type raster_size: tuple
+    :return: proximity values for the tile
+    :rtype: numpy.ndarray
+    """
+
+    xoff, yoff, width, height = window
+    x0 = max(0, xoff - halo)
+    y0 = max(0, yoff - halo)
+    x1 = min(raster_size[0], xoff + width + halo)
+    y1 = min(raster_size[1], yoff + height + halo)
+    tile_geotransform = (geotransform[0] + x0 * geotransform[1], geotransform[1], 0,
+                         geotransform[3] + y0 * geotransform[5], 0, geotransform[5])
+
+    mem_driver = gdal.GetDriverByName(str('MEM'))
+    rize_ds = mem_driver.Create(str('rasterization_tile_ds'), x1 - x0, y1 - y0, 1, gdal.GDT_Byte)
+    rize_ds.SetGeoTransform(tile_geotransform)
+    rize_ds.SetProjection(projection)
+    rize_ds.GetRasterBand(1).SetNoDataValue(nodata)
+
+    # Only hand the rasterizer features that touch the padded tile
+    min_x = tile_geotransform[0]
+    max_x = tile_geotransform[0] + (x1 - x0) * geotransform[1]
+    max_y = tile_geotransform[3]
+    min_y = tile_geotransform[3] + (y1 - y0) * geotransform[5]
+    for layer in layers:
+        layer.SetSpatialFilterRect(min_x, min_y, max_x, max_y)
+        gdal.RasterizeLayer(rize_ds, [1], layer, options=rize_options, burn_values=[1])
+        layer.SetSpatialFilter(None)
+
+    prox_ds = mem_driver.Create(str('proximity_tile_ds'), x1 - x0, y1 - y0, 1, gdal.GDT_Float32)
+    prox_ds.SetGeoTransform(tile_geotransform)
+    prox_ds.SetProjection(projection)
+    prox_band = prox_ds.GetRasterBand(1)
+    prox_band.SetNoDataValue(nodata)
+    gdal.ComputeProximity(rize_ds.GetRasterBand(1), prox_band, options=proximity_options)
+
+    values = prox_band.ReadAsArray(xoff - x0, yoff - y0, width, height)
+    prox_band = None
+    prox_ds = None
+    rize_ds = None
+
+    return values
+
+
+# =========================================================================== #
+#   Define init_worker() function
+# =========================================================================== #
+
+def init_worker(input_vector, layer_names, *tile_args):
+
+    """
+    Open the input vector once per process and keep everything compute_tile()
+    needs besides the tile window
+
+    :param input_vector: path to the input vector
+    :type input_vector: str
+    :param layer_names: names of the layers to rasterize
+    :type layer_names: list
+    :param tile_args: compute_tile() arguments following the window
+    :type tile_args: tuple
+    """
+
+    vds = ogr.Open(input_vector, 0)
+    _worker['vds'] = vds
+    _worker['layers'] = [vds.GetLayerByName(str(name)) for name in layer_names]
+    _worker['tile_args'] = tile_args
+
+
+# =========================================================================== #
+#   Define tile_worker() function
+# =========================================================================== #
+
+def tile_worker(window):
+
+    """
+    Compute one tile in a process set up by init_worker()
+
+    :param window: (xoff, yoff, width, height) of the tile in the full raster
+    :type window: tuple
+    :return: the window and its proximity values
+    :rtype: tuple
+    """
+
+    return window, compute_tile(_worker['layers'], window, *_worker['tile_args'])
+
+
+# =========================================================================== #
+#   Define overview_worker() function
+# =========================================================================== #
+
+def overview_worker(task):
+
+    """
+    Compute one tile of a nearest neighbour overview from the full resolution
+    raster.  Overview pixel i takes the full resolution pixel at
+    int(0.5 + i * ratio), the same pixel GDAL's nearest overview resampling
+    picks, so the result doesn't depend on how the overview is tiled.
+
+    :param task: (raster path, overview index, overview (width, height), overview window)
+    :type task: tuple
+    :return: the overview index, the window and its values
+    :rtype: tuple
+    """
+
+    path, ovr_idx, ovr_size, window = task
+    if _worker.get('overview_path') != path:
+        _worker['overview_ds'] = gdal.Open(str(path), 0)
+        _worker['overview_path'] = path
+    band = _worker['overview_ds'].GetRasterBand(1)
+
+    xoff, yoff, width, height = window
+    cols = numpy.minimum(band.XSize - 1, (0.5 + numpy.arange(xoff, xoff + width) * (band.XSize / ovr_size[0])).astype(int))
+    rows = numpy.minimum(band.YSize - 1, (0.5 + numpy.arange(yoff, yoff + height) * (band.YSize / ovr_size[1])).astype(int))
+
+    # Read one full resolution line at a time so deep overviews don't pull in whole blocks of rows they skip
+    x0 = int(cols[0])
+    span = int(cols[-1]) - x0 + 1
+    values = numpy.empty((height, width), dtype=numpy.float32)
+    for idx, row in enumerate(rows):
+        values[idx] = band.ReadAsArray(x0, int(row), span, 1)[0, cols - x0]
+
+    return ovr_idx, window, values
+
+
+# =========================================================================== #
+#   Define write_overviews() function
+# =========================================================================== #
+
+def write_overviews(rds, tasks, jobs):
+
+    """
+    Run overview_worker() tasks, in a process pool if jobs > 1, and write the
+    results to the output dataset from this process only
+
+    :param rds: output dataset, open for writing and flushed
+    :type rds: gdal.Dataset
+    :param tasks: overview_worker() tasks
+    :type tasks: list
+    :param jobs: number of processes
+    :type jobs: int
+    """
+
+    band = rds.GetRasterBand(1)
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(overview_worker, tasks)
+    else:
+        pool = None
+        results = (overview_worker(task) for task in tasks)
+    try:
+        for idx, (ovr_idx, window, values) in enumerate(results):
+            band.GetOverview(ovr_idx).WriteArray(values, window[0], window[1])
+            gdal.TermProgress((idx + 1) / len(tasks), None, None)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _worker.clear()
+    band.FlushCache()
+
+
+# =========================================================================== #
+#   Define build_overviews() function
+# =========================================================================== #
+
+def build_overviews(rds, path, levels, tile_size, jobs):
+
+    """
+    Build nearest neighbour overviews in a process pool.  Every level is
+    sampled straight from the full resolution raster, so all levels and all
+    tiles within a level are independent.  Workers read the flushed output and
+    only this process writes.
+
+    :param rds: output dataset, open for writing
+    :type rds: gdal.Dataset
+    :param path: path to the output dataset
+    :type path: str
+    :param levels: overview levels
+    :type levels: list
+    :param tile_size: overview tile width and height in pixels
+    :type tile_size: int
+    :param jobs: number of processes
+    :type jobs: int
+    """
+
+    # Create empty overviews to fill in
+    rds.BuildOverviews(resampling=str('NONE'), overviewlist=levels)
+    rds.FlushCache()
+    band = rds.GetRasterBand(1)
+
+    tasks = []
+    for ovr_idx in range(band.GetOverviewCount()):
+        ovr = band.GetOverview(ovr_idx)
+        for window in tile_windows(ovr.XSize, ovr.YSize, tile_size):
+            tasks.append((path, ovr_idx, (ovr.XSize, ovr.YSize), window))
+
+    write_overviews(rds, tasks, jobs)
+
+
+# =========================================================================== #
+#   Define update_overviews() function
+# =========================================================================== #
+
+def update_overviews(rds, path, windows, jobs):
+
+    """
+    Recompute the existing nearest neighbour overviews under a set of full
+    resolution windows
+
+    :param rds: output dataset, open for writing
+    :type rds: gdal.Dataset
+    :param path: path to the output dataset
+    :type path: str
+    :param windows: (xoff, yoff, width, height) windows that changed
+    :type windows: list
+    :param jobs: number of processes
+    :type jobs: int
+    """
+
+    rds.FlushCache()
+    band = rds.GetRasterBand(1)
+
+    tasks = []
+    for ovr_idx in range(band.GetOverviewCount()):
+        ovr = band.GetOverview(ovr_idx)
+        scale_x = band.XSize / ovr.XSize
+        scale_y = band.YSize / ovr.YSize
+        for xoff, yoff, width, height in windows:
+            x0 = int(math.floor(xoff / scale_x))
+            y0 = int(math.floor(yoff / scale_y))
+            x1 = min(ovr.XSize, int(math.ceil((xoff + width) / scale_x)))
+            y1 = min(ovr.YSize, int(math.ceil((yoff + height) / scale_y)))
+            tasks.append((path, ovr_idx, (ovr.XSize, ovr.YSize), (x0, y0, x1 - x0, y1 - y0)))
+
+    write_overviews(rds, tasks, jobs)
+
 
 # =========================================================================== #
 #   Define main() function
@@ -88,8 +436,8 @@ def main(args):
     parser.add_argument(
         '-md', '--max-distance',
         dest='max_distance',
-        type=int,
-        action='append',
+        type=float,
+        action='store',
         help='Maximum search distance for non-nodata pixels when computing distance'
     )
     parser.add_argument(
@@ -138,7 +486,33 @@ def main(args):
         dest='overview_resampling',
         choices=('nearest', 'average', 'gauss', 'cubic', 'average_mp', 'average_magphase', 'mode'),
         default='nearest',
-        help='Overview resampling method'
+        help='Overview resampling method - only nearest overviews are built by --jobs or updated by --update tile by '
+             'tile, the others are rebuilt by GDAL'
+    )
+    parser.add_argument(
+        '-ts', '--tile-size',
+        dest='tile_size',
+        type=int,
+        action='store',
+        metavar='pixels',
+        help='Compute proximity in square tiles of this many pixels, padded by --max-distance, to bound memory use'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs',
+        type=int,
+        default=1,
+        action='store',
+        help='Number of processes computing tiles and overviews - requires --tile-size'
+    )
+    parser.add_argument(
+        '-u', '--update',
+        dest='update_diff',
+        type=str,
+        action='store',
+        metavar='diff_vector',
+        help='Update the existing output raster, recomputing only the tiles within --max-distance of the features '
+             'in this vector of added and removed features - src_vector must hold the full updated features'
     )
     parser.add_argument(
         '--overwrite',
@@ -185,14 +559,55 @@ def main(args):
         pass
 
     # Check output raster
-    try:
-        ds = gdal.Open(pargs.output_raster, 0)
-        if ds is not None and not pargs.overwrite_mode:
+    if pargs.update_diff is None:
+        try:
+            ds = gdal.Open(pargs.output_raster, 0)
+            if ds is not None and not pargs.overwrite_mode:
+                ds = None
+                bail = True
+                print("ERROR: Overwrite=%s and output raster exists: %s" % (pargs.overwrite_mode, pargs.output_raster))
+        except RuntimeError:
+            pass
+
+    # Check update mode - the existing raster is updated in place, so it has to be there
+    else:
+        try:
+            ds = gdal.Open(pargs.output_raster, 0)
+        except RuntimeError:
             ds = None
+        if ds is None:
             bail = True
-            print("ERROR: Overwrite=%s and output raster exists: %s" % (pargs.overwrite_mode, pargs.output_raster))
-    except RuntimeError:
-        pass
+            print("ERROR: Can't access output raster to update: %s" % pargs.output_raster)
+        ds = None
+        try:
+            ds = ogr.Open(pargs.update_diff, 0)
+        except RuntimeError:
+            ds = None
+        if ds is None:
+            bail = True
+            print("ERROR: Can't access diff vector: %s" % pargs.update_diff)
+        ds = None
+        if pargs.tile_size is None:
+            bail = True
+            print("ERROR: --update requires --tile-size")
+        if pargs.overviews:
+            bail = True
+            print("ERROR: --update refreshes the existing overviews and can't be combined with --overview")
+
+    # Tiles are only independent if the distance search stops somewhere
+    if pargs.tile_size is not None:
+        if pargs.tile_size <= 0:
+            bail = True
+            print("ERROR: Invalid tile size - must be > 0: %s" % pargs.tile_size)
+        if not pargs.max_distance:
+            bail = True
+            print("ERROR: --tile-size requires --max-distance")
+    if pargs.jobs < 1:
+        bail = True
+        print("ERROR: Invalid number of jobs - must be >= 1: %s" % pargs.jobs)
+    elif pargs.jobs > 1 and pargs.tile_size is None:
+        bail = True
+        print("ERROR: --jobs requires --tile-size")
 
     if bail:
         return 1
@@ -203,8 +618,10 @@ def main(args):
 
     vds = ogr.Open(pargs.input_vector)
 
-    # Get full extent of all vector layers being processed and make sure all layers are in the same spatial reference
-    print("Computing input vector extent ...")
+    # Make sure all layers are in the same spatial reference and, unless the grid comes from the raster being
+    # updated, get the full extent of all vector layers being processed
+    if pargs.update_diff is None:
+        print("Computing input vector extent ...")
     vds_srs = None
     vds_extent = []
     for layer in vds:
@@ -219,73 +636,74 @@ def main(args):
                 return 1
 
             # Update extent
-            min_x, max_x, min_y, max_y = layer.GetExtent()
-            if len(vds_extent) is 0:
-                vds_extent = [min_x, min_y, max_x, max_y]
-            else:
-                if min_x < vds_extent[0]:
-                    vds_extent[0] = min_x
-                if min_y < vds_extent[1]:
-                    vds_extent[1] = min_y
-                if max_x > vds_extent[2]:
-                    vds_extent[2] = max_x
-                if max_y > vds_extent[3]:
-                    vds_extent[3] = max_y
-
-    # Construct an in-memory raster that will store the rasterized vectors
-    print("Building an in-memory raster for rasterization ...")
-    vds_geotransform = (vds_extent[0], pargs.target_resolution[0], 0, vds_extent[3], 0, -pargs.target_resolution[1])
-    x_res = int((vds_extent[2] - vds_extent[0]) / pargs.target_resolution[0])
-    y_res = int((vds_extent[3] - vds_extent[1]) / pargs.target_resolution[1])
-    rize_ds = gdal.GetDriverByName(str('MEM')).Create(str('rasterization_memory_ds'), x_res, y_res, 1, gdal.GDT_Byte)
-    rize_ds.SetGeoTransform(vds_geotransform)
-    rize_ds.SetProjection(vds_srs.ExportToWkt())
-    band = rize_ds.GetRasterBand(1)
-    band.SetNoDataValue(pargs.nodata)
-    band = None
-
-    # Create output datasource
-    rdriver = gdal.GetDriverByName(str(pargs.driver_name))
-    if rdriver is None:
-        vds = None
-        rize_ds = None
-        print("ERROR: Invalid driver: '%s'" % pargs.driver_name)
-        return 1
-    rds = rdriver.Create(
-        str(pargs.output_raster), rize_ds.RasterXSize, rize_ds.RasterYSize, 1, gdal.GDT_Float32,
-        options=pargs.creation_options
-    )
-    if rds is None:
-        vds = None
-        rize_ds = None
-        print("ERROR: Could not create output raster: %s" % pargs.output_raster)
-        return 1
-    rdriver = None
+            if pargs.update_diff is None:
+                min_x, max_x, min_y, max_y = layer.GetExtent()
+                if len(vds_extent) is 0:
+                    vds_extent = [min_x, min_y, max_x, max_y]
+                else:
+                    if min_x < vds_extent[0]:
+                        vds_extent[0] = min_x
+                    if min_y < vds_extent[1]:
+                        vds_extent[1] = min_y
+                    if max_x > vds_extent[2]:
+                        vds_extent[2] = max_x
+                    if max_y > vds_extent[3]:
+                        vds_extent[3] = max_y
+
+    if pargs.update_diff is None:
+
+        vds_geotransform = (vds_extent[0], pargs.target_resolution[0], 0, vds_extent[3], 0, -pargs.target_resolution[1])
+        projection = vds_srs.ExportToWkt()
+        x_res = int((vds_extent[2] - vds_extent[0]) / pargs.target_resolution[0])
+        y_res = int((vds_extent[3] - vds_extent[1]) / pargs.target_resolution[1])
+
+        # Create output datasource
+        rdriver = gdal.GetDriverByName(str(pargs.driver_name))
+        if rdriver is None:
+            vds = None
+            print("ERROR: Invalid driver: '%s'" % pargs.driver_name)
+            return 1
+        rds = rdriver.Create(
+            str(pargs.output_raster), x_res, y_res, 1, gdal.GDT_Float32,
+            options=pargs.creation_options
+        )
+        if rds is None:
+            vds = None
+            print("ERROR: Could not create output raster: %s" % pargs.output_raster)
+            return 1
+        rdriver = None
+
+        rds.SetGeoTransform(vds_geotransform)
+        rds.SetProjection(projection)
+        output_band = rds.GetRasterBand(1)
+        output_band.SetNoDataValue(pargs.nodata)
 
+    else:
 
-    rds.SetGeoTransform(vds_geotransform)
-    rds.SetProjection(vds_srs.ExportToWkt())
-
-    # --------------------------------------------------------------------------- #
-    #   Rasterize input layers
-    # --------------------------------------------------------------------------- #
-
+        # Keep the existing grid - features added outside of it are only counted where they are within
+        # --max-distance of it
+        print("Opening output raster for update ...")
+        rds = gdal.Open(str(pargs.output_raster), gdal.GA_Update)
+        vds_geotransform = rds.GetGeoTransform()
+        projection = rds.GetProjection()
+        x_res = rds.RasterXSize
+        y_res = rds.RasterYSize
+        if [abs(vds_geotransform[1]), abs(vds_geotransform[5])] != pargs.target_resolution:
+            vds = None
+            rds = None
+            print("ERROR: Target resolution doesn't match the raster being updated: %s %s" % (
+                abs(vds_geotransform[1]), abs(vds_geotransform[5])))
+            return 1
+        output_band = rds.GetRasterBand(1)
+
+    # Rasterization and proximity options
     if pargs.all_touched:
         rize_options = ['ALL_TOUCHED=TRUE']
     else:
         rize_options = []
     rize_options.append('MERGE_ALG=REPLACE')
     rize_options = [str(opt) for opt in rize_options]
-    for layer in vds:
-        if pargs.layers_to_process is None or layer.GetName() in pargs.layers_to_process:
-            print("Rasterizing layer '%s' ..." % layer.GetName())
-            gdal.RasterizeLayer(rize_ds, [1], layer, options=rize_options, burn_values=[1], callback=gdal.TermProgress)
 
-    # --------------------------------------------------------------------------- #
-    #   Compute proximity
-    # --------------------------------------------------------------------------- #
-
-    # Assemble options for proximity calculation
     proximity_options = []
     if pargs.max_distance:
         proximity_options.append('MAXDIST=%s' % pargs.max_distance)
@@ -297,19 +715,105 @@ def main(args):
     proximity_options.append('NODATA=0')
     proximity_options = [str(opt) for opt in proximity_options]
 
-    # Compute proximity
-    print("Computing proximity ...")
-    output_band = rds.GetRasterBand(1)
-    output_band.SetNoDataValue(pargs.nodata)
-    gdal.ComputeProximity(rize_ds.GetRasterBand(1), output_band, options=proximity_options, callback=gdal.TermProgress)
+    layers = [layer for layer in vds
+              if pargs.layers_to_process is None or layer.GetName() in pargs.layers_to_process]
+
+    if pargs.tile_size is None:
+
+        # --------------------------------------------------------------------------- #
+        #   Rasterize input layers
+        # --------------------------------------------------------------------------- #
+
+        # Construct an in-memory raster that will store the rasterized vectors
+        print("Building an in-memory raster for rasterization ...")
+        rize_ds = gdal.GetDriverByName(str('MEM')).Create(str('rasterization_memory_ds'), x_res, y_res, 1, gdal.GDT_Byte)
+        rize_ds.SetGeoTransform(vds_geotransform)
+        rize_ds.SetProjection(projection)
+        band = rize_ds.GetRasterBand(1)
+        band.SetNoDataValue(pargs.nodata)
+        band = None
+
+        for layer in layers:
+            print("Rasterizing layer '%s' ..." % layer.GetName())
+            gdal.RasterizeLayer(rize_ds, [1], layer, options=rize_options, burn_values=[1], callback=gdal.TermProgress)
+
+        # --------------------------------------------------------------------------- #
+        #   Compute proximity
+        # --------------------------------------------------------------------------- #
+
+        print("Computing proximity ...")
+        gdal.ComputeProximity(rize_ds.GetRasterBand(1), output_band, options=proximity_options, callback=gdal.TermProgress)
+        rize_ds = None
+
+    else:
+
+        # --------------------------------------------------------------------------- #
+        #   Rasterize and compute proximity tile by tile
+        # --------------------------------------------------------------------------- #
+
+        # Pad each tile by the max distance in pixels so features just outside it are still found
+        if pargs.distance_units == 'GEO':
+            halo = int(math.ceil(pargs.max_distance / min(pargs.target_resolution))) + 1
+        else:
+            halo = int(math.ceil(pargs.max_distance)) + 1
+
+        # Tiles are handed out and written back in row-major order, so the output doesn't depend on
+        # the number of jobs, and only this process ever writes to the output
+        if pargs.update_diff is None:
+            windows = tile_windows(x_res, y_res, pargs.tile_size)
+        else:
+            print("Finding tiles affected by %s ..." % pargs.update_diff)
+            windows = affected_windows(pargs.update_diff, vds_geotransform, projection, (x_res, y_res), pargs.tile_size,
+                                       halo)
+        print("Computing proximity in %s tiles with a %s pixel halo using %s job(s) ..." % (
+            len(windows), halo, pargs.jobs))
+        tile_args = (
+            pargs.input_vector, [layer.GetName() for layer in layers], halo, vds_geotransform,
+            projection, (x_res, y_res), pargs.nodata, rize_options, proximity_options)
+        if pargs.jobs > 1:
+            pool = multiprocessing.Pool(pargs.jobs, init_worker, tile_args)
+            results = pool.imap(tile_worker, windows)
+        else:
+            pool = None
+            init_worker(*tile_args)
+            results = (tile_worker(window) for window in windows)
+        try:
+            for idx, (window, values) in enumerate(results):
+                output_band.WriteArray(values, window[0], window[1])
+                gdal.TermProgress((idx + 1) / len(windows), None, None)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            _worker.clear()
+        output_band.FlushCache()
 
     # --------------------------------------------------------------------------- #
     #   Generate overviews
     # --------------------------------------------------------------------------- #
 
-    if pargs.overviews:
+    if pargs.update_diff is not None:
+        if output_band.GetOverviewCount() > 0 and windows:
+            print("Updating overviews ...")
+            # Only nearest neighbour overview pixels depend on nothing but the full resolution pixel under them
+            if pargs.overview_resampling == 'nearest':
+                update_overviews(rds, pargs.output_raster, windows, pargs.jobs)
+            else:
+                levels = [int(round(x_res / output_band.GetOverview(i).XSize))
+                          for i in range(output_band.GetOverviewCount())]
+                rds.BuildOverviews(resampling=str(pargs.overview_resampling), overviewlist=levels, callback=gdal.TermProgress)
+
+    elif pargs.overviews:
         print("Generating overview: %s" % ', '.join([str(o) for o in pargs.overviews]))
-        rds.BuildOverviews(resampling=str(pargs.overview_resampling), overviewlist=pargs.overviews, callback=gdal.TermProgress)
+        built = False
+        if pargs.jobs > 1 and pargs.overview_resampling == 'nearest':
+            try:
+                build_overviews(rds, pargs.output_raster, pargs.overviews, pargs.tile_size, pargs.jobs)
+                built = True
+            except RuntimeError as e:
+                print("WARNING: Could not build overviews in parallel, building them serially: %s" % e)
+        if not built:
+            rds.BuildOverviews(resampling=str(pargs.overview_resampling), overviewlist=pargs.overviews, callback=gdal.TermProgress)
 
     # Cleanup
     band = None
@@ -4,12 +4,15 @@ import math
 import operator
 import itertools
 import datetime
+import collections
 import rolling_measures
 import pyproj
 geod = pyproj.Geod(ellps="WGS84")
 
 args = {
-    "window": 60*60
+    "window": 60*60,
+    "max-open-files": 256,
+    "cell-size": 1.0
 }
 files = []
 for arg in sys.argv[1:]:
@@ -24,6 +27,10 @@ for arg in sys.argv[1:]:
         files.append(arg)
 
 args['window'] = float(args['window'])
+# At most this many bin files are open at once, the least recently written is closed to make room
+args['max-open-files'] = int(args['max-open-files'])
+# Size in degrees of the grid cells open bins are indexed by
+args['cell-size'] = float(args['cell-size'])
 
 def mangle(rows):
     for row in rows:
@@ -44,22 +51,148 @@ def mangle(rows):
         yield row
 
 
+epoch = datetime.datetime(1970, 1, 1)
+
+def seconds(timestamp):
+    return (timestamp - epoch).total_seconds()
+
+
+class HandlePool(object):
+    """Keeps at most max_open files open for writing, closing the least recently
+    used one when another is needed.  Files are truncated the first time they are
+    opened and appended to when they are reopened."""
+
+    def __init__(self, max_open):
+        self.max_open = max_open
+        self.handles = collections.OrderedDict()
+        self.opened = set()
+
+    def writer(self, path):
+        if path in self.handles:
+            handle = self.handles.pop(path)
+        else:
+            while len(self.handles) >= self.max_open:
+                self.handles.popitem(last=False)[1][0].close()
+            f = open(path, "a" if path in self.opened else "w")
+            self.opened.add(path)
+            handle = (f, csv.writer(f))
+        self.handles[path] = handle
+        return handle[1]
+
+    def close(self, path):
+        if path in self.handles:
+            self.handles.pop(path)[0].close()
+
+    def close_all(self):
+        while self.handles:
+            self.handles.popitem(last=False)[1][0].close()
+
+
+class BinIndex(object):
+    """Open bins indexed by the hour and grid cell of their last row.  A bin can
+    only take a row if it could have travelled there at discontinuity_speed since
+    its last row, so for each hour only the cells within that distance are
+    searched, and hours older than discontinuity_time are closed wholesale."""
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.columns = int(math.ceil(360.0 / cell_size))
+        self.hours = {}
+        # Latest timestamp ever indexed in each hour, to skip looking for later bins in the hour of a row
+        self.latest = {}
+
+    def key(self, row):
+        hour = int(seconds(row['timestamp']) // 3600)
+        cell = (int((row['latitude'] + 90) // self.cell_size),
+                int((row['longitude'] + 180) // self.cell_size) % self.columns)
+        return hour, cell
+
+    def add(self, bin):
+        hour, cell = bin.key = self.key(bin.row)
+        self.hours.setdefault(hour, {}).setdefault(cell, set()).add(bin)
+        self.latest[hour] = max(self.latest.get(hour, bin.row['timestamp']), bin.row['timestamp'])
+
+    def remove(self, bin):
+        hour, cell = bin.key
+        cells = self.hours[hour]
+        cells[cell].discard(bin)
+        if not cells[cell]:
+            del cells[cell]
+            if not cells:
+                del self.hours[hour]
+                del self.latest[hour]
+
+    def expire(self, row):
+        """Removes and returns the bins whose last row is more than discontinuity_time before row"""
+        limit = seconds(row['timestamp']) - discontinuity_time * 60 * 60
+        expired = []
+        for hour in [hour for hour in self.hours if (hour + 1) * 3600 <= limit]:
+            del self.latest[hour]
+            for cell in self.hours.pop(hour).itervalues():
+                expired.extend(cell)
+        return expired
+
+    def candidates(self, row):
+        """Returns the bins that might take row, in the order they were opened"""
+        now = seconds(row['timestamp'])
+        hour, (y, x) = self.key(row)
+        found = set()
+        for binhour, cells in self.hours.iteritems():
+            hours = (now - binhour * 3600) / 3600.0
+            if hours < 0:
+                # Bins with rows after this one take it regardless of distance
+                for cell in cells.itervalues():
+                    found.update(cell)
+                continue
+
+            # Including those in the same hour as this row
+            if binhour == hour and self.latest[hour] > row['timestamp']:
+                for cell in cells.itervalues():
+                    found.update(bin for bin in cell if bin.row['timestamp'] > row['timestamp'])
+
+            # Slightly generous so ellipsoidal distances never fall outside the box
+            radius = discontinuity_speed * hours * 1.01 / 60.0
+            dy = int(radius // self.cell_size) + 1
+            # hav(distance) >= cos(lat1) * cos(lat2) * hav(dlon), with both latitudes at most maxlat
+            maxlat = min(90.0, abs(row['latitude']) + radius)
+            coslat = math.cos(math.radians(maxlat))
+            spread = math.sin(math.radians(min(radius, 180.0)) / 2) / coslat if coslat > 0 else 1.0
+            if spread >= 1.0:
+                dx = self.columns
+            else:
+                dx = int(2 * math.degrees(math.asin(spread)) // self.cell_size) + 1
+
+            if len(cells) <= (2 * dy + 1) * min(2 * dx + 1, self.columns):
+                for (celly, cellx), cell in cells.iteritems():
+                    distx = abs(cellx - x) % self.columns
+                    if abs(celly - y) <= dy and min(distx, self.columns - distx) <= dx:
+                        found.update(cell)
+            else:
+                for celly in xrange(y - dy, y + dy + 1):
+                    for cellx in set((x + i) % self.columns for i in xrange(-dx, dx + 1)):
+                        found.update(cells.get((celly, cellx), ()))
+
+        return sorted(found, key=operator.attrgetter('binid'))
+
+
 class Bin(object):
-    bins = []
     filename = files[0].replace(".csv", "")
     binid = 0
+    handles = HandlePool(args['max-open-files'])
+    index = BinIndex(args['cell-size'])
 
     def __init__(self):
         cls = type(self)
-        self.file = open("%s.path-%s.csv" % (cls.filename, cls.binid), "w")
+        self.binid = cls.binid
+        self.path = "%s.path-%s.csv" % (cls.filename, cls.binid)
         cls.binid += 1
-        self.writer = csv.DictWriter(self.file, inkeys, 'ignore')
         self.row = None
-        self.bins.append(self)
 
     def close(self):
-        self.file.close()
-        self.bins.remove(self)
+        self.handles.close(self.path)
+
+    def write(self, row):
+        self.handles.writer(self.path).writerow([row.get(key, '') for key in inkeys])
 
     def add_to_bin(self, row):
         if self.row is not None:
@@ -68,6 +201,7 @@ class Bin(object):
             timespan = (row['timestamp'] - self.row['timestamp']).total_seconds() / (60 * 60)
 
             if timespan > discontinuity_time:
+                self.index.remove(self)
                 self.close()
                 return False
 
@@ -76,28 +210,33 @@ class Bin(object):
                 or (timespan == 0.0
                     and distance > 0)):
                 return False
+
+            self.index.remove(self)
         self.row = row
-        self.writer.writerow(row)
+        self.index.add(self)
+        self.write(row)
         return True
 
     @classmethod
     def add(cls, row):
-        for bin in cls.bins:
+        for bin in cls.index.expire(row):
+            bin.close()
+        for bin in cls.index.candidates(row):
             if bin.add_to_bin(row):
                 return
         Bin().add_to_bin(row)
 
+    @classmethod
+    def close_all(cls):
+        cls.handles.close_all()
+
 inkeys = ['mmsi','longitude','latitude','timestamp','score','navstat','hdg','rot','cog','sog']
 
 discontinuity_time = 72
 discontinuity_speed = 100 # knots
 
-bins = []
-current_bin = None
-
 with open(files[0]) as infile:
     infile = iter(mangle(csv.DictReader(infile, inkeys)))
     for row in infile:
         Bin.add(row)
-for bin in Bin.bins:
-    bin.close()
+Bin.close_all()
@@ -0,0 +1,368 @@
+import gdal
+import ogr
+import osr
+import struct
+import shapely
+import pyproj
+import numpy
+import os.path
+import collections
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+dir = os.path.abspath(os.path.split(__file__)[0])
+
+strctypes = {
+    gdal.GDT_Byte: "c",
+    gdal.GDT_Float32: "f",
+    gdal.GDT_Float64: "d",
+    gdal.GDT_Int16: "h",
+    gdal.GDT_Int32: "i",
+    gdal.GDT_UInt16: "H",
+    gdal.GDT_UInt32: "I"
+}
+
+
+gdal.UseExceptions()
+
+# Mean earth radius in meters, used for distances on the sphere
+EARTH_RADIUS = 6371008.8
+
+def wktToProj(proj):
+    conv = osr.SpatialReference()
+    conv.ImportFromWkt(proj)
+    return conv.ExportToProj4()
+
+def invertGeoTransform(trans):
+    t = trans
+    det = t[1]*t[5] - t[2]*t[4]
+    return ((t[2]*t[3] - t[0]*t[5]) / det, t[5] / det, -t[2] / det,
+            (t[0]*t[4] - t[1]*t[3]) / det, -t[4] / det, t[1] / det)
+
+class PixelReader(object):
+    def __init__(self, filename, mmap=False, cache_bytes=None, band=1):
+        if not filename.startswith("/"):
+            relative = os.path.abspath(os.path.join(dir, filename))
+            if os.path.exists(relative):
+                filename = relative
+            else:
+                filename = os.path.abspath(filename)
+        self.filename = filename
+        self.dataset = gdal.Open(self.filename) 
+        self.proj4 = wktToProj(self.dataset.GetProjection())
+        self.proj = pyproj.Proj(self.proj4)
+        self.trans = self.dataset.GetGeoTransform()
+        self.inverse = invertGeoTransform(self.trans)
+
+        self.rasterBand = self.dataset.GetRasterBand(band)
+        self.noDataValue = self.rasterBand.GetNoDataValue()
+
+        # read_many() gathers from the whole band, either read into memory or,
+        # with mmap=True, mapped by GDAL and paged in as it's touched
+        self.mmap = mmap
+        self._band = None
+
+        # With a cache_bytes budget, rasters too large for memory are instead read
+        # one native block at a time into a least recently used cache.  Every
+        # block lookup counts as a hit or a miss.
+        self.cache_bytes = cache_bytes
+        self.blockSize = self.rasterBand.GetBlockSize()
+        self.blocksPerRow = -(-self.dataset.RasterXSize // self.blockSize[0])
+        self.cache = collections.OrderedDict()
+        self.cached_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def transform(self, x, y):
+        # Inverse of (x, y) = (t0 + p*t1 + l*t2, t3 + p*t4 + l*t5), works on scalars and arrays
+        i = self.inverse
+        p = i[0] + x*i[1] + y*i[2]
+        l = i[3] + x*i[4] + y*i[5]
+        return p, l
+
+    def read(self, lon, lat):
+        px, py = self.transform(*self.proj(lon, lat))
+        px = int(px)
+        py = int(py)
+
+        if self.cache_bytes is not None:
+            val = self.read_pixels(numpy.array([px]), numpy.array([py]))[0]
+            if numpy.isnan(val): val = None
+            return val
+
+        structval = self.rasterBand.ReadRaster(px, py, 1, 1, buf_type=self.rasterBand.DataType)
+        val = struct.unpack(strctypes[self.rasterBand.DataType], structval)[0]
+        if val == self.noDataValue: val = None
+        return val
+
+    @property
+    def band(self):
+        if self._band is None:
+            if self.mmap:
+                self._band = self.rasterBand.GetVirtualMemAutoArray(gdal.GF_Read)
+            else:
+                self._band = self.rasterBand.ReadAsArray()
+        return self._band
+
+    def block(self, key):
+        """Returns the block with index key = row * blocksPerRow + column, reading it if it isn't cached"""
+        block = self.cache.pop(key, None)
+        if block is not None:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            xoff = (key % self.blocksPerRow) * self.blockSize[0]
+            yoff = (key // self.blocksPerRow) * self.blockSize[1]
+            block = self.rasterBand.ReadAsArray(
+                xoff, yoff,
+                min(self.blockSize[0], self.dataset.RasterXSize - xoff),
+                min(self.blockSize[1], self.dataset.RasterYSize - yoff))
+            self.cached_bytes += block.nbytes
+            while self.cache and self.cached_bytes > self.cache_bytes:
+                self.cached_bytes -= self.cache.popitem(last=False)[1].nbytes
+        self.cache[key] = block
+        return block
+
+    def clear_cache(self):
+        self.cache.clear()
+        self.cached_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def project(self, lons, lats):
+        """Projects arrays of points to the raster's CRS"""
+        return self.proj(numpy.asarray(lons, dtype=numpy.float64), numpy.asarray(lats, dtype=numpy.float64))
+
+    def xy_pixels(self, x, y):
+        """Returns the (column, row) pixel indices of arrays of projected points"""
+        px, py = self.transform(x, y)
+        return numpy.floor(px).astype(numpy.int64), numpy.floor(py).astype(numpy.int64)
+
+    def pixels(self, lons, lats):
+        """Returns the (column, row) pixel indices of arrays of points"""
+        return self.xy_pixels(*self.project(lons, lats))
+
+    def read_pixels(self, px, py, masked=False):
+        """Gathers the values at arrays of pixel indices.  Pixels outside the
+        raster or set to nodata are NaN, or masked if masked=True."""
+        inside = (px >= 0) & (px < self.dataset.RasterXSize) & (py >= 0) & (py < self.dataset.RasterYSize)
+        values = numpy.zeros(len(px), dtype=numpy.float64)
+        if self.cache_bytes is None:
+            values[inside] = self.band[py[inside], px[inside]]
+        else:
+            # Group the points by block so each block is looked up once per batch
+            index = numpy.nonzero(inside)[0]
+            keys = (py[index] // self.blockSize[1]) * self.blocksPerRow + px[index] // self.blockSize[0]
+            order = numpy.argsort(keys, kind='mergesort')
+            index, keys = index[order], keys[order]
+            bounds = numpy.nonzero(numpy.diff(keys))[0] + 1
+            for group in numpy.split(numpy.arange(len(index)), bounds) if len(index) else []:
+                key = keys[group[0]]
+                rows = index[group]
+                block = self.block(key)
+                values[rows] = block[py[rows] - (key // self.blocksPerRow) * self.blockSize[1],
+                                     px[rows] - (key % self.blocksPerRow) * self.blockSize[0]]
+        mask = ~inside
+        if self.noDataValue is not None:
+            mask |= values == self.noDataValue
+        if masked:
+            return numpy.ma.masked_array(values, mask)
+        values[mask] = numpy.nan
+        return values
+
+    def read_many(self, lons, lats, masked=False):
+        """Reads the values at arrays of points, projecting them all in one call"""
+        px, py = self.pixels(lons, lats)
+        return self.read_pixels(px, py, masked)
+
+    def close(self):
+        self._band = None
+        self.clear_cache()
+        self.dataset = None
+
+class RasterStack(object):
+    """Samples several rasters at the same points.  Rasters are grouped by CRS and
+    grid so each batch of points is projected once per CRS and converted to pixel
+    indices once per grid, however many rasters share them.
+
+    rasters maps column names to a filename or a (filename, band) tuple, and can be
+    a dict or a list of (name, raster) pairs to keep the column order.  Any other
+    keyword arguments are passed on to every PixelReader."""
+
+    def __init__(self, rasters, **kwargs):
+        if isinstance(rasters, dict):
+            rasters = sorted(rasters.items())
+        self.names = []
+        self.readers = {}
+        self.groups = collections.OrderedDict()
+        for name, raster in rasters:
+            if isinstance(raster, (tuple, list)):
+                filename, band = raster
+            else:
+                filename, band = raster, 1
+            reader = PixelReader(filename, band=band, **kwargs)
+            self.names.append(name)
+            self.readers[name] = reader
+            grid = (tuple(reader.trans), reader.dataset.RasterXSize, reader.dataset.RasterYSize)
+            self.groups.setdefault(reader.proj4, collections.OrderedDict()).setdefault(grid, []).append(name)
+
+    def read_many(self, lons, lats, masked=False):
+        """Returns an OrderedDict of {name: values} for arrays of points"""
+        columns = {}
+        for proj4, grids in self.groups.iteritems():
+            first = self.readers[grids.values()[0][0]]
+            x, y = first.project(lons, lats)
+            for grid, names in grids.iteritems():
+                px, py = self.readers[names[0]].xy_pixels(x, y)
+                for name in names:
+                    columns[name] = self.readers[name].read_pixels(px, py, masked)
+        return collections.OrderedDict((name, columns[name]) for name in self.names)
+
+    def close(self):
+        for reader in self.readers.itervalues():
+            reader.close()
+
+def unitVectors(lons, lats):
+    """Converts arrays of degrees to points on the unit sphere, shape (n, 3)"""
+    lons = numpy.radians(numpy.asarray(lons, dtype=numpy.float64))
+    lats = numpy.radians(numpy.asarray(lats, dtype=numpy.float64))
+    coslat = numpy.cos(lats)
+    return numpy.column_stack((coslat * numpy.cos(lons), coslat * numpy.sin(lons), numpy.sin(lats)))
+
+def angleBetween(a, b):
+    """Angles in radians between rows of unit vectors"""
+    return numpy.arctan2(numpy.sqrt((numpy.cross(a, b) ** 2).sum(axis=1)), (a * b).sum(axis=1))
+
+class NearestFeatureIndex(object):
+    """Great circle distance from points to the nearest of a set of features,
+    measured to their vertices and the segments between them on a spherical earth.
+
+    Segments are sampled at least every max_spacing meters and the samples are
+    put in a KD-tree on the unit sphere.  The tree finds candidate segments near
+    each query point and the exact distance to those segments is computed, so the
+    result doesn't depend on the sampling.  segments is an array of shape (n, 2, 2)
+    holding ((lon, lat), (lon, lat)) pairs in degrees, and a point feature is a
+    segment with both ends at the same place."""
+
+    def __init__(self, segments, max_spacing=10000.0, candidates=8):
+        if cKDTree is None:
+            raise ImportError("NearestFeatureIndex requires scipy")
+        segments = numpy.asarray(segments, dtype=numpy.float64).reshape(-1, 2, 2)
+        if not len(segments):
+            raise ValueError("NearestFeatureIndex needs at least one feature")
+
+        self.start = unitVectors(segments[:, 0, 0], segments[:, 0, 1])
+        self.end = unitVectors(segments[:, 1, 0], segments[:, 1, 1])
+        normal = numpy.cross(self.start, self.end)
+        length = numpy.sqrt((normal ** 2).sum(axis=1))
+        self.isArc = length > 1e-12
+        self.normal = numpy.zeros_like(normal)
+        self.normal[self.isArc] = normal[self.isArc] / length[self.isArc, None]
+
+        # Sample every segment evenly along its great circle with at most `spacing` radians between samples
+        self.spacing = max_spacing / EARTH_RADIUS
+        angles = numpy.where(self.isArc, angleBetween(self.start, self.end), 0.0)
+        counts = numpy.ceil(angles / self.spacing).astype(numpy.int64) + 1
+        # Antipodal ends have no single great circle between them and are only measured to, so sample both
+        counts[~self.isArc & (self.start != self.end).any(axis=1)] = 2
+        self.sampleSegment = numpy.repeat(numpy.arange(len(segments)), counts)
+        offsets = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        fraction = offsets / numpy.maximum(counts - 1, 1).astype(numpy.float64)[self.sampleSegment]
+        theta = (fraction * angles[self.sampleSegment])[:, None]
+        start = self.start[self.sampleSegment]
+        # Unit vector at right angles to start, in the plane of the great circle and towards end
+        towards = numpy.cross(self.normal[self.sampleSegment], start)
+        samples = start * numpy.cos(theta) + towards * numpy.sin(theta)
+        ends = ~self.isArc[self.sampleSegment] & (fraction > 0)
+        samples[ends] = self.end[self.sampleSegment[ends]]
+        self.tree = cKDTree(samples)
+        self.candidates = min(candidates, len(samples))
+
+    @classmethod
+    def from_layer(cls, layer, **kwargs):
+        """Builds an index from every geometry in an OGR layer, reprojected to WGS84"""
+        wgs84 = osr.SpatialReference()
+        wgs84.ImportFromEPSG(4326)
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            # GDAL 3 would otherwise transform to (lat, lon)
+            wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        srs = layer.GetSpatialRef()
+        transform = None
+        if srs is not None and not srs.IsSame(wgs84):
+            transform = osr.CoordinateTransformation(srs, wgs84)
+
+        segments = []
+        def addGeometry(geometry):
+            if geometry.GetGeometryCount():
+                for i in range(geometry.GetGeometryCount()):
+                    addGeometry(geometry.GetGeometryRef(i))
+            else:
+                points = [geometry.GetPoint_2D(i) for i in range(geometry.GetPointCount())]
+                if len(points) == 1:
+                    segments.append((points[0], points[0]))
+                segments.extend(zip(points[:-1], points[1:]))
+
+        layer.ResetReading()
+        for feature in layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            if transform is not None:
+                geometry = geometry.Clone()
+                geometry.Transform(transform)
+            addGeometry(geometry)
+        layer.ResetReading()
+        return cls(segments, **kwargs)
+
+    @classmethod
+    def from_file(cls, filename, layer=0, **kwargs):
+        """Builds an index from a layer, by name or index, of any OGR datasource"""
+        datasource = ogr.Open(filename)
+        if datasource is None:
+            raise IOError("Could not open %s" % filename)
+        if isinstance(layer, basestring):
+            layer = datasource.GetLayerByName(layer)
+        else:
+            layer = datasource.GetLayer(layer)
+        return cls.from_layer(layer, **kwargs)
+
+    def segment_distance(self, points, segments):
+        """Angles in radians from unit vector points to the segments with the given indices"""
+        start = self.start[segments]
+        end = self.end[segments]
+        normal = self.normal[segments]
+        angles = numpy.minimum(angleBetween(points, start), angleBetween(points, end))
+
+        # Where the closest point on the great circle falls between the ends, the distance is to the arc
+        across = (points * normal).sum(axis=1)
+        closest = points - across[:, None] * normal
+        between = (self.isArc[segments]
+                   & ((numpy.cross(start, closest) * normal).sum(axis=1) >= 0)
+                   & ((numpy.cross(closest, end) * normal).sum(axis=1) >= 0))
+        angles[between] = numpy.minimum(angles[between], numpy.arcsin(numpy.minimum(1.0, numpy.abs(across[between]))))
+        return angles
+
+    def distance(self, lons, lats):
+        """Distance in meters from arrays of points to the nearest feature"""
+        points = unitVectors(lons, lats)
+        if not len(points):
+            return numpy.zeros(0)
+        k = self.candidates
+        chords, samples = self.tree.query(points, k)
+        chords = chords.reshape(len(points), k)
+        samples = samples.reshape(len(points), k)
+
+        angles = self.segment_distance(numpy.repeat(points, k, axis=0), self.sampleSegment[samples.ravel()])
+        best = angles.reshape(len(points), k).min(axis=1)
+
+        # Any closer segment has a sample within best + spacing / 2 of the point.  If that's further than the
+        # k-th nearest sample all such samples were already checked, otherwise search everything in range.
+        radius = numpy.minimum(numpy.pi, best + self.spacing / 2)
+        chordRadius = 2 * numpy.sin(radius / 2)
+        for i in numpy.nonzero(chords[:, -1] <= chordRadius)[0]:
+            nearby = numpy.unique(self.sampleSegment[self.tree.query_ball_point(points[i], chordRadius[i])])
+            best[i] = min(best[i], self.segment_distance(points[[i] * len(nearby)], nearby).min())
+
+        return best * EARTH_RADIUS
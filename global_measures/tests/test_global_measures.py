@@ -0,0 +1,240 @@
+import unittest2
+import json
+import os
+import shutil
+import tempfile
+
+import numpy
+import pyproj
+
+import gdal
+import ogr
+import osr
+
+from .. import PixelReader, RasterStack, NearestFeatureIndex, EARTH_RADIUS
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = [numpy.radians(numpy.asarray(v, dtype=numpy.float64)) for v in (lon1, lat1, lon2, lat2)]
+    a = numpy.sin((lat2 - lat1) / 2) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * numpy.arcsin(numpy.sqrt(a))
+
+
+def slerp(start, end, count):
+    """Evenly spaced (lons, lats) along the great circle between two (lon, lat) points"""
+    a = numpy.radians(start)
+    b = numpy.radians(end)
+    va = numpy.array([numpy.cos(a[1]) * numpy.cos(a[0]), numpy.cos(a[1]) * numpy.sin(a[0]), numpy.sin(a[1])])
+    vb = numpy.array([numpy.cos(b[1]) * numpy.cos(b[0]), numpy.cos(b[1]) * numpy.sin(b[0]), numpy.sin(b[1])])
+    omega = numpy.arccos(numpy.clip(va.dot(vb), -1, 1))
+    if omega == 0:
+        return numpy.array([start[0]]), numpy.array([start[1]])
+    t = numpy.linspace(0, 1, count)[:, None]
+    points = (numpy.sin((1 - t) * omega) * va + numpy.sin(t * omega) * vb) / numpy.sin(omega)
+    return numpy.degrees(numpy.arctan2(points[:, 1], points[:, 0])), numpy.degrees(numpy.arcsin(points[:, 2]))
+
+
+class PixelReaderTest(unittest2.TestCase):
+
+    nodata = -9999.0
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.random = numpy.random.RandomState(0)
+        self.data = self.random.uniform(0, 1000, (40, 50)).astype(numpy.float32)
+        self.data[5:8, 10:20] = self.nodata
+        self.filename = self._create_raster('values.tif', self.data, (-250000.0, 10000.0, 0.0, 200000.0, 0.0, -10000.0))
+        reader = PixelReader(self.filename)
+        self.proj = pyproj.Proj(reader.proj4)
+        reader.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _create_raster(self, name, data, geotransform):
+        filename = os.path.join(self.tempdir, name)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(3857)
+        dataset = gdal.GetDriverByName('GTiff').Create(
+            filename, data.shape[1], data.shape[0], 1, gdal.GDT_Float32,
+            options=['TILED=YES', 'BLOCKXSIZE=16', 'BLOCKYSIZE=16'])
+        dataset.SetGeoTransform(geotransform)
+        dataset.SetProjection(srs.ExportToWkt())
+        band = dataset.GetRasterBand(1)
+        band.SetNoDataValue(self.nodata)
+        band.WriteArray(data)
+        dataset = None
+        return filename
+
+    def _lonlats(self, x, y):
+        return self.proj(numpy.asarray(x, dtype=numpy.float64), numpy.asarray(y, dtype=numpy.float64), inverse=True)
+
+    def _points(self, count):
+        # Mostly inside the raster, with some points beyond every edge
+        return self._lonlats(self.random.uniform(-300000, 300000, count), self.random.uniform(-260000, 260000, count))
+
+    def _read(self, reader, lons, lats):
+        # read() only handles points inside the raster
+        values = []
+        for lon, lat in zip(lons, lats):
+            x, y = self.proj(lon, lat)
+            value = None
+            if -250000 <= x < 250000 and -200000 < y <= 200000:
+                value = reader.read(lon, lat)
+            values.append(numpy.nan if value is None else value)
+        return numpy.array(values)
+
+    def test_read_many_matches_read(self):
+        lons, lats = self._points(500)
+        reader = PixelReader(self.filename)
+        expected = self._read(reader, lons, lats)
+        values = reader.read_many(lons, lats)
+        reader.close()
+        numpy.testing.assert_array_equal(expected, values)
+        self.assertTrue(numpy.isnan(values).any())
+
+    def test_read_many_masked(self):
+        reader = PixelReader(self.filename)
+        values = reader.read_many(*self._lonlats([-245000, -145000, 400000], [195000, 145000, 0]), masked=True)
+        reader.close()
+        self.assertEqual([False, True, True], list(values.mask))
+        self.assertEqual(self.data[0, 0], values[0])
+
+    def test_read_pixels_matches_band(self):
+        px = self.random.randint(0, 50, 300)
+        py = self.random.randint(0, 40, 300)
+        reader = PixelReader(self.filename)
+        values = reader.read_pixels(px, py)
+        reader.close()
+        expected = self.data[py, px].astype(numpy.float64)
+        expected[expected == self.nodata] = numpy.nan
+        numpy.testing.assert_array_equal(expected, values)
+
+    def test_cached_matches_uncached(self):
+        lons, lats = self._points(2000)
+        uncached = PixelReader(self.filename)
+        cached = PixelReader(self.filename, cache_bytes=2 * 16 * 16 * 4)
+        expected = uncached.read_many(lons, lats)
+        for i in range(2):
+            numpy.testing.assert_array_equal(expected, cached.read_many(lons, lats))
+            self.assertLessEqual(cached.cached_bytes, cached.cache_bytes)
+        # read() goes through the cache too
+        numpy.testing.assert_array_equal(expected[:50], self._read(cached, lons[:50], lats[:50]))
+        self.assertGreater(cached.cache_misses, 0)
+        self.assertGreater(cached.cache_hits, 0)
+        uncached.close()
+        cached.close()
+
+    def test_block_cache_evicts_least_recently_used(self):
+        reader = PixelReader(self.filename, cache_bytes=2 * 16 * 16 * 4)
+        self.assertEqual((16, 16), tuple(reader.blockSize))
+        self.assertEqual(4, reader.blocksPerRow)
+
+        numpy.testing.assert_array_equal(self.data[0:16, 16:32], reader.block(1))
+        reader.block(0)
+        reader.block(1)
+        self.assertEqual((2, 1), (reader.cache_misses, reader.cache_hits))
+
+        # Block 0 is now the least recently used and makes room for block 7, the partial block at the right edge
+        numpy.testing.assert_array_equal(self.data[16:32, 48:50], reader.block(7))
+        self.assertEqual([1, 7], list(reader.cache.keys()))
+        self.assertLessEqual(reader.cached_bytes, reader.cache_bytes)
+        reader.block(0)
+        self.assertEqual([7, 0], list(reader.cache.keys()))
+        self.assertEqual((4, 1), (reader.cache_misses, reader.cache_hits))
+
+        reader.clear_cache()
+        self.assertEqual((0, 0, 0), (reader.cached_bytes, reader.cache_misses, reader.cache_hits))
+        reader.close()
+
+    def test_raster_stack_matches_readers(self):
+        other = self.random.uniform(0, 10, (30, 30)).astype(numpy.float32)
+        coarse = self._create_raster('coarse.tif', other, (-300000.0, 20000.0, 0.0, 300000.0, 0.0, -20000.0))
+        stack = RasterStack([('values', self.filename), ('again', self.filename), ('coarse', coarse)])
+        self.assertEqual(['values', 'again', 'coarse'], stack.names)
+        self.assertEqual(2, len(stack.groups.values()[0]))
+
+        lons, lats = self._points(500)
+        columns = stack.read_many(lons, lats)
+        self.assertEqual(['values', 'again', 'coarse'], list(columns.keys()))
+        for name, filename in (('values', self.filename), ('again', self.filename), ('coarse', coarse)):
+            reader = PixelReader(filename)
+            numpy.testing.assert_array_equal(reader.read_many(lons, lats), columns[name])
+            reader.close()
+        stack.close()
+
+
+class NearestFeatureIndexTest(unittest2.TestCase):
+
+    def setUp(self):
+        self.random = numpy.random.RandomState(1)
+        self.lons = self.random.uniform(-180, 180, 300)
+        self.lats = numpy.degrees(numpy.arcsin(self.random.uniform(-1, 1, 300)))
+
+    def test_points_match_haversine(self):
+        ports = numpy.column_stack((self.random.uniform(-180, 180, 50), self.random.uniform(-60, 60, 50)))
+        index = NearestFeatureIndex(numpy.repeat(ports[:, None, :], 2, axis=1), max_spacing=50000.0)
+        expected = haversine(self.lons[:, None], self.lats[:, None], ports[:, 0], ports[:, 1]).min(axis=1)
+        numpy.testing.assert_allclose(index.distance(self.lons, self.lats), expected, rtol=0, atol=1e-3)
+
+    def test_segments_match_sampled_haversine(self):
+        segments = [((-5.0, 50.0), (10.0, 60.0)), ((170.0, -10.0), (-170.0, 5.0)), ((0.0, 0.0), (0.0, 0.0))]
+        samples = [slerp(start, end, 20000) for start, end in segments]
+        lons = numpy.concatenate([s[0] for s in samples])
+        lats = numpy.concatenate([s[1] for s in samples])
+
+        # Points close to the segments as well as far away
+        near_lons = numpy.concatenate((self.lons, lons[::400] + self.random.uniform(-0.5, 0.5, len(lons[::400]))))
+        near_lats = numpy.concatenate((self.lats, numpy.clip(lats[::400] + self.random.uniform(-0.5, 0.5, len(lats[::400])), -90, 90)))
+        expected = numpy.array([haversine(lon, lat, lons, lats).min() for lon, lat in zip(near_lons, near_lats)])
+
+        index = NearestFeatureIndex(segments, max_spacing=20000.0)
+        actual = index.distance(near_lons, near_lats)
+
+        # The samples are at most about 150 meters apart, so the exact distance can only be a little shorter
+        self.assertTrue((actual <= expected + 1e-3).all())
+        self.assertTrue((actual >= expected - 100).all())
+
+    def test_long_segment_next_to_points(self):
+        # Samples placed off the great circle would leave gaps in the middle of a segment longer than 90 degrees
+        ports = numpy.column_stack((self.random.uniform(84, 86, 20), self.random.uniform(0.3, 0.35, 20)))
+        segments = [((0.0, 0.0), (170.0, 0.0))] + [(port, port) for port in ports]
+        lons = self.random.uniform(84, 86, 20000)
+        lats = self.random.uniform(0, 0.15, 20000)
+        expected = numpy.minimum(
+            haversine(lons[:, None], lats[:, None], ports[:, 0], ports[:, 1]).min(axis=1),
+            numpy.radians(lats) * EARTH_RADIUS)
+        for candidates in (8, 1):
+            index = NearestFeatureIndex(segments, candidates=candidates)
+            numpy.testing.assert_allclose(index.distance(lons, lats), expected, rtol=0, atol=1e-3)
+
+    def test_from_layer_and_from_file(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            features = {
+                'type': 'FeatureCollection',
+                'features': [
+                    {'type': 'Feature', 'properties': {},
+                     'geometry': {'type': 'Point', 'coordinates': [12.5, 41.9]}},
+                    {'type': 'Feature', 'properties': {},
+                     'geometry': {'type': 'MultiLineString',
+                                  'coordinates': [[[-5.0, 50.0], [10.0, 60.0], [20.0, 55.0]],
+                                                  [[170.0, -10.0], [-170.0, 5.0]]]}},
+                    {'type': 'Feature', 'properties': {}, 'geometry': None}]}
+            filename = os.path.join(tempdir, 'features.geojson')
+            with open(filename, 'w') as f:
+                json.dump(features, f)
+
+            segments = [((12.5, 41.9), (12.5, 41.9)), ((-5.0, 50.0), (10.0, 60.0)), ((10.0, 60.0), (20.0, 55.0)),
+                        ((170.0, -10.0), (-170.0, 5.0))]
+            expected = NearestFeatureIndex(segments).distance(self.lons, self.lats)
+
+            from_file = NearestFeatureIndex.from_file(filename)
+            numpy.testing.assert_allclose(from_file.distance(self.lons, self.lats), expected, rtol=0, atol=1e-3)
+
+            datasource = ogr.Open(filename)
+            from_layer = NearestFeatureIndex.from_layer(datasource.GetLayer(0))
+            numpy.testing.assert_allclose(from_layer.distance(self.lons, self.lats), expected, rtol=0, atol=1e-3)
+            datasource = None
+        finally:
+            shutil.rmtree(tempdir)
@@ -1,43 +1,163 @@
 import csv
 import numpy
 import datetime
+import hashlib
+import itertools
+import json
+import os
+import tempfile
 
 class namedArray(object):
-    def __init__(self, cols, arr):
+    """A (columns, rows) matrix with its rows accessible by column name.  Slicing
+    with basic indexes (ints and slices) returns views sharing the same memory."""
+    def __init__(self, cols, arr, categories=None, index=None):
         self.cols = cols
         self.arr = arr
+        self.categories = categories or {}
+        self.index = index if index is not None else {name: idx for idx, name in enumerate(cols)}
     def __getattr__(self, name):
-        return self.arr[self.cols.index(name)]
+        # Only reached for names that aren't attributes, so look at __dict__ directly to
+        # stay clear of recursion before __init__ has run, e.g. while unpickling
+        try:
+            return self.__dict__['arr'][self.__dict__['index'][name]]
+        except KeyError:
+            raise AttributeError(name)
     def __getitem__(self, *arg, **kw):
-        return type(self)(self.cols, self.arr.__getitem__(*arg, **kw))
+        return self.view(self.arr.__getitem__(*arg, **kw))
+    def __len__(self):
+        return self.arr.shape[1]
 
+    def view(self, arr):
+        """Wraps another matrix with the same columns, without rebuilding the column index"""
+        return type(self)(self.cols, arr, self.categories, self.index)
 
+    def rows(self, start=None, stop=None):
+        return self.view(self.arr[:, start:stop])
 
-def load(filename):
-    def mangle(rows):
-        for row in rows:
-            orig = dict(row)
-            for key, value in row.iteritems():
-                if key == 'mmsi':
-                    pass
-                else:
-                    row[key] = float(value)
-            row['_'] = orig
-            yield row
+    def runs(self, mask):
+        """Returns a view for every run of consecutive rows where mask is True"""
+        mask = numpy.concatenate(([False], numpy.asarray(mask, dtype=bool), [False]))
+        edges = numpy.nonzero(mask[1:] != mask[:-1])[0]
+        return [self.rows(start, stop) for start, stop in zip(edges[::2], edges[1::2])]
 
-    rows = 0
-    with open(filename) as infile:
-        for row in infile:
-            rows += 1
-    rows -= 1 # header
+    def between(self, col, low, high):
+        """Returns a view of the rows with low <= col < high, for a column the rows are sorted by"""
+        values = getattr(self, col)
+        return self.rows(numpy.searchsorted(values, low, 'left'), numpy.searchsorted(values, high, 'left'))
+
+    def groupby(self, col='mmsi'):
+        """Returns a list of (value, view) pairs, one for each value of col.  If each
+        value's rows aren't already together the rows are sorted by col once, so
+        the views share a single copy rather than one copy per group."""
+        values = getattr(self, col)
+        starts = numpy.concatenate(([0], numpy.nonzero(values[1:] != values[:-1])[0] + 1))
+        if len(numpy.unique(values[starts])) != len(starts):
+            return self[:, numpy.argsort(values, kind='mergesort')].groupby(col)
+        stops = numpy.concatenate((starts[1:], [len(values)]))
+        return [(values[start], self.rows(start, stop)) for start, stop in zip(starts, stops)]
+
+    def vessels(self):
+        """Returns (mmsi, view) pairs, with mmsi mapped back to its name if it was loaded as a category"""
+        names = self.categories.get('mmsi')
+        return [(names[int(mmsi)] if names else int(mmsi), group) for mmsi, group in self.groupby('mmsi')]
+
+
+CHUNK_ROWS = 100000
+
+def cache_paths(filename, cache_dir=None):
+    """Returns the (array, metadata) cache paths for a source file"""
+    filename = os.path.abspath(filename)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(filename), '.loadmeasures')
+    key = hashlib.sha1(filename if isinstance(filename, bytes) else filename.encode('utf-8')).hexdigest()[:16]
+    base = os.path.join(cache_dir, '%s-%s' % (os.path.basename(filename), key))
+    return base + '.npy', base + '.json'
+
+def source_key(filename):
+    stat = os.stat(filename)
+    return {'path': os.path.abspath(filename), 'size': stat.st_size, 'mtime': stat.st_mtime}
 
+def parse_column(values):
+    try:
+        return numpy.array(values, dtype=numpy.float64)
+    except ValueError:
+        return numpy.array([float(value) if value else numpy.nan for value in values], dtype=numpy.float64)
+
+def parse(filename, chunk_rows=CHUNK_ROWS):
+    """Parses a measures CSV chunk by chunk into a (columns, rows) float matrix.
+    mmsi is kept as its integer value, or as a category code into
+    categories['mmsi'] if any mmsi isn't an integer."""
+    chunks = []
+    mmsis = []
     with open(filename) as infile:
-        infile = csv.DictReader(infile)
-        cols = infile.fieldnames
-        arr = numpy.zeros((len(cols), rows))
-        for rowidx, row in enumerate(mangle(infile)):
-            for colidx, col in enumerate(cols):
-                if isinstance(row[col], float):
-                    arr[colidx,rowidx] = row[col]
-
-    return namedArray(cols, arr)
+        reader = csv.reader(infile)
+        cols = next(reader)
+        mmsiidx = cols.index('mmsi') if 'mmsi' in cols else None
+        while True:
+            rows = list(itertools.islice(reader, chunk_rows))
+            if not rows:
+                break
+            columns = zip(*rows)
+            chunk = numpy.zeros((len(cols), len(rows)))
+            for colidx, column in enumerate(columns):
+                if colidx == mmsiidx:
+                    mmsis.append(column)
+                else:
+                    chunk[colidx] = parse_column(column)
+            chunks.append(chunk)
+
+    categories = {}
+    arr = numpy.hstack(chunks) if chunks else numpy.zeros((len(cols), 0))
+    if mmsiidx is not None and mmsis:
+        mmsi = [value for column in mmsis for value in column]
+        try:
+            arr[mmsiidx] = numpy.array(mmsi, dtype=numpy.int64)
+        except ValueError:
+            names, codes = numpy.unique(mmsi, return_inverse=True)
+            arr[mmsiidx] = codes
+            categories['mmsi'] = names.tolist()
+    return cols, arr, categories
+
+def replace_file(path, write, mode='wb'):
+    """Writes a file through write(f) under a unique temporary name and renames it
+    into place, so a reader never sees half a file and concurrent writers don't
+    clobber each other's temporary files"""
+    fd, tmppath = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.rename(tmppath, path)
+    except BaseException:
+        os.remove(tmppath)
+        raise
+
+def load(filename, cache=True, cache_dir=None):
+    """Loads a measures CSV as a namedArray.  With cache=True the parsed matrix
+    is kept as a .npy file next to the source (or in cache_dir) and memory
+    mapped copy-on-write on later loads for as long as the source's path, size
+    and mtime don't change.  If the cache can't be written the parsed matrix is
+    returned as is.
+
+    Every column, mmsi included, is stored as float64 in a single matrix so
+    column views and row slices stay plain numpy views of one array."""
+    if not cache:
+        return namedArray(*parse(filename))
+
+    arrpath, metapath = cache_paths(filename, cache_dir)
+    key = source_key(filename)
+    if os.path.exists(arrpath) and os.path.exists(metapath):
+        with open(metapath) as f:
+            meta = json.load(f)
+        if meta['source'] == key:
+            return namedArray(meta['cols'], numpy.load(arrpath, mmap_mode='c'), meta['categories'])
+
+    cols, arr, categories = parse(filename)
+    try:
+        if not os.path.isdir(os.path.dirname(arrpath)):
+            os.makedirs(os.path.dirname(arrpath))
+        # The array goes first so the metadata never points at a missing or stale array
+        replace_file(arrpath, lambda f: numpy.save(f, arr))
+        replace_file(metapath, lambda f: json.dump({'source': key, 'cols': cols, 'categories': categories}, f), 'w')
+    except (OSError, IOError):
+        return namedArray(cols, arr, categories)
+    return namedArray(cols, numpy.load(arrpath, mmap_mode='c'), categories)
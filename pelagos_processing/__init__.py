@@ -36,6 +36,8 @@ PelagosProcessing - Data tools for the Pelagos projects
 
 import common
 import controller
+import measures
+import newlinejson
 from settings import *
 import cmdl
 import tests
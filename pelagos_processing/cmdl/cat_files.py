@@ -76,8 +76,8 @@ def print_usage():
 
     # TODO: Populate usage
     vprint("""
-{0} [--help-info] [-q] [-sl n] [-s schema] [-se]
-{1} [-m write_mode] ofile ifile [ifile ...]
+{0} [--help-info] [-q] [-sl n] [-s schema] [-se] [-z]
+{1} [-merge] [-mk field,...] [-m write_mode] ofile ifile [ifile ...]
 
 """.format(UTIL_NAME, " " * len(UTIL_NAME)))
     return 1
@@ -110,13 +110,25 @@ def print_long_usage():
     -sl -skip-lines     Skip n lines of each input file
                         [default: 0]
     -se -skip-empty     Skip concatenating completely empty lines
+    -z -gzip            Write the target file with gzip compression
+    -merge              Merge inputs that are each already sorted by the merge
+                        key into one sorted target file instead of concatenating
+                        them.  Empty lines are skipped.  At most {2} files
+                        and .zip members are open at once, more are merged in
+                        several passes through temporary files written next to
+                        the target file.
+    -mk -merge-key      Fields from the schema to merge by, as: field1,field2,...
+                        Implies -merge
+                        [default: {1}]
     ofile               Target file
-    ifile               Input file to be concatenated.  See --help for information
+    ifile               Input file to be concatenated.  Files ending in .gz are
+                        decompressed and every member of a .zip file is
+                        concatenated as its own input.  See --help for information
                         about getting around the command line's argument limit when
                         attempting to process a large number of files.  Using '-'
                         as an input file causes
 
-    """.format(','.join(raw.RAW_SCHEMA)))
+    """.format(','.join(raw.RAW_SCHEMA), ','.join(raw.MERGE_KEY), raw.MAX_MERGE_STREAMS))
 
     return 1
 
@@ -179,6 +191,8 @@ expansion.
     write_mode = 'w'
     skip_lines = 0
     skip_empty_lines = False
+    compress = False
+    merge_key = None
 
     #/* ----------------------------------------------------------------------- */#
     #/*     Containers
@@ -233,6 +247,19 @@ expansion.
                 i += 1
                 skip_empty_lines = True
 
+            # Compress output
+            elif arg in ('-z', '-gzip'):
+                i += 1
+                compress = True
+
+            # Merge sorted inputs
+            elif arg in ('-merge', '--merge'):
+                i += 1
+                merge_key = merge_key or raw.MERGE_KEY
+            elif arg in ('-mk', '-merge-key'):
+                i += 2
+                merge_key = args[i - 1].split(',')
+
             # Additional options
             elif arg in ('-m', '-mode'):
                 i += 2
@@ -342,11 +369,17 @@ expansion.
     vprint("Output file: %s" % output_file)
     vprint("Write mode: %s" % write_mode)
     vprint("Schema: %s" % output_schema)
-    vprint("Concatenating %s files ..." % len(input_files))
+    if merge_key is None:
+        vprint("Concatenating %s files ..." % len(input_files))
+    else:
+        # Lines with equal keys come out in input order, so make that order repeatable
+        input_files = sorted(input_files)
+        vprint("Merging %s files sorted by %s ..." % (len(input_files), ','.join(merge_key)))
 
     try:
         if not raw.cat_files(input_files, output_file, schema=output_schema, write_mode=write_mode,
-                             skip_lines=skip_lines, skip_empty=skip_empty_lines):
+                             skip_lines=skip_lines, skip_empty=skip_empty_lines, compress=compress,
+                             merge_key=merge_key):
             vprint("ERROR: Did not successfully concatenate files")
             return 1
     except Exception as e:
@@ -37,10 +37,12 @@ Clip arbitrary regions to quad tree levels
 """
 
 
+import csv
 import inspect
 import os
 from os.path import *
 import sys
+import time
 
 import components
 from components import *
@@ -62,6 +64,9 @@ osr.UseExceptions()
 __all__ = ['print_usage', 'print_help', 'print_long_usage', 'main']
 UTIL_NAME = 'gridify.py'
 
+# Minimum number of seconds between flushing the output and recording completed region features in the progress file
+PROGRESS_SYNC_INTERVAL = 30
+
 
 #/* ======================================================================= */#
 #/*     Define print_usage() function
@@ -82,7 +87,7 @@ def print_usage():
     vprint("""
 Usage:
     {0} [-of ogr_driver] [-lco option=value] [-dsco option=value]
-    {1} [-gl layer_name|layer1,layer2,...] [-rl layer_name|layer1,layer2]
+    {1} [-gl layer_name|layer1,layer2,...] [-rl layer_name|layer1,layer2] [-resume]
     {1} --grid=grid_file.ext --region=region_file.ext -o output_file.ext
 """.format(UTIL_NAME, " " * len(UTIL_NAME)))
     return 1
@@ -179,6 +184,150 @@ def is_ring_poly(ring):
         return False
 
 
+#/* ======================================================================= */#
+#/*     Define load_progress() function
+#/* ======================================================================= */#
+
+def load_progress(progress_file):
+
+    """
+    Read a progress sidecar written by a previous run
+
+    Every line contains an output layer name, a completed region FID, and the
+    last output FID written once that region was finished.  A truncated last
+    line left behind by an interrupted run is ignored.
+
+    :return: {output_layer_name: {'fids': set(region_fids), 'last_output_fid': int}}
+    :rtype: dict
+    """
+
+    progress = {}
+    if not os.path.isfile(progress_file):
+        return progress
+
+    with open(progress_file) as f:
+        for row in csv.reader(f):
+            try:
+                layer_name, region_fid, last_output_fid = row
+                region_fid = int(region_fid)
+                last_output_fid = int(last_output_fid)
+            except ValueError:
+                continue
+            if layer_name not in progress:
+                progress[layer_name] = {'fids': set(), 'last_output_fid': -1}
+            progress[layer_name]['fids'].add(region_fid)
+            progress[layer_name]['last_output_fid'] = max(progress[layer_name]['last_output_fid'], last_output_fid)
+
+    return progress
+
+
+#/* ======================================================================= */#
+#/*     Define record_progress() function
+#/* ======================================================================= */#
+
+def record_progress(f, rows):
+
+    """
+    Append completed region features to an open progress sidecar and flush
+    them to disk so the records survive the process being killed
+
+    :param rows: [(output_layer_name, region_fid, last_output_fid), ...]
+    """
+
+    csv.writer(f).writerows(rows)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+#/* ======================================================================= */#
+#/*     Define rollback_layer() function
+#/* ======================================================================= */#
+
+def rollback_layer(datasource, layer, last_output_fid):
+
+    """
+    Delete output features written after the last recorded region was finished.
+    These belong to region features that were not recorded as completed when
+    the previous run was interrupted and will be re-created.
+
+    :return: number of deleted features
+    :rtype: int
+    """
+
+    layer.ResetReading()
+    orphans = [feature.GetFID() for feature in layer if feature.GetFID() > last_output_fid]
+    layer.ResetReading()
+    for fid in orphans:
+        layer.DeleteFeature(fid)
+    if orphans:
+
+        # The shapefile driver only flags deleted records, which keep their FIDs until the file is repacked
+        if datasource.GetDriver().GetName() == 'ESRI Shapefile':
+            datasource.ExecuteSQL('REPACK %s' % layer.GetName())
+        layer.SyncToDisk()
+
+    return len(orphans)
+
+
+#/* ======================================================================= */#
+#/*     Define prepare_regions() function
+#/* ======================================================================= */#
+
+def prepare_regions(region_layer, target_srs):
+
+    """
+    Read every feature in a region layer once, reproject its geometry to the
+    target SRS, and compute the convex hull used as a spatial filter
+
+    :return: [(region_feature, region_geom, convex_hull), ...]
+    :rtype: list
+    """
+
+    region_layer_srs = region_layer.GetSpatialRef()
+    if region_layer_srs is None or target_srs is None or target_srs.IsSame(region_layer_srs) is 1:
+        coord_transform = None
+    else:
+        coord_transform = osr.CoordinateTransformation(region_layer_srs, target_srs)
+
+    prepared = []
+    region_layer.ResetReading()
+    for region_feature in region_layer:
+        region_geom = region_feature.GetGeometryRef().Clone()
+        if coord_transform is not None:
+            region_geom.Transform(coord_transform)
+        prepared.append((region_feature, region_geom, region_geom.ConvexHull()))
+    region_layer.ResetReading()
+
+    return prepared
+
+
+#/* ======================================================================= */#
+#/*     Define load_grid_cells() function
+#/* ======================================================================= */#
+
+def load_grid_cells(grid_layer, limit_geom):
+
+    """
+    Copy all grid cells intersecting a limiting geometry into an in-memory layer
+
+    :return: (memory datasource, memory layer) - the datasource must be kept
+             alive for as long as the layer is used
+    :rtype: tuple
+    """
+
+    mem_driver = ogr.GetDriverByName('Memory')
+    mem_ds = mem_driver.CreateDataSource('mem_grids')
+    mem_layer = mem_ds.CreateLayer('mem_grids', grid_layer.GetSpatialRef(), grid_layer.GetGeomType())
+    grid_layer.SetSpatialFilter(limit_geom)
+    grid_layer.ResetReading()
+    for grid_feature in grid_layer:
+        mem_layer.CreateFeature(grid_feature)
+    grid_layer.SetSpatialFilter(None)
+    grid_layer.ResetReading()
+
+    return mem_ds, mem_layer
+
+
 #/* ======================================================================= */#
 #/*     Define main() function
 #/* ======================================================================= */#
@@ -203,6 +352,7 @@ def main(args):
     #/* ----------------------------------------------------------------------- */#
 
     output_driver_name = "ESRI Shapefile"
+    resume_mode = False
 
     #/* ----------------------------------------------------------------------- */#
     #/*     Containers
@@ -275,6 +425,11 @@ def main(args):
                 i += 2
                 output_dsco.append(args[i - 1])
 
+            # Additional options
+            elif arg in ('-resume', '--resume'):
+                i += 1
+                resume_mode = True
+
             # Positional arguments and errors
             else:
 
@@ -329,9 +484,9 @@ def main(args):
     if not isinstance(output_file, str):
         bail = True
         vprint("ERROR: Invalid output file: %s" % output_file)
-    elif os.path.exists(output_file):
+    elif os.path.exists(output_file) and not resume_mode:
         bail = True
-        vprint("ERROR: Output file exists: %s" % output_file)
+        vprint("ERROR: Output file exists - use -resume to continue a previous run: %s" % output_file)
 
     # TODO: Figure out how to check output directory permissions
     # elif not os.access(dirname(output_file), os.W_OK):
@@ -369,13 +524,19 @@ def main(args):
     elif not output_driver.TestCapability('CreateDataSource'):
         bail = True
         vprint("ERROR: Output driver does not support datasource creation: %s" % output_driver_name)
+    elif resume_mode and os.path.exists(output_file):
+        output_ds = output_driver.Open(output_file, 1)
+        if output_ds is None:
+            bail = True
+            vprint("ERROR: Couldn't open output datasource for update: %s" % output_file)
     else:
         output_ds = output_driver.CreateDataSource(output_file, options=output_dsco)
         if output_ds is None:
             bail = True
             vprint("ERROR: Couldn't create output datasource: %s" % output_file)
 
-        # Make sure output datasource can create layers
+    # Make sure output datasource can create layers
+    if output_ds is not None:
         if not output_ds.TestCapability('CreateLayer'):
             bail = True
             vprint("ERROR: Output driver does not support layer creation: %s" % output_driver_name)
@@ -432,6 +593,43 @@ def main(args):
     #/*     Prepare input data
     #/* ----------------------------------------------------------------------- */#
 
+    # Completed region features are recorded in a sidecar next to the output so an interrupted run can be resumed
+    progress_file = output_file + '.progress'
+    if resume_mode:
+        completed = load_progress(progress_file)
+        progress_f = open(progress_file, 'a')
+    else:
+        completed = {}
+        progress_f = open(progress_file, 'w')
+    vprint("Progress file: %s" % progress_file)
+
+    # Every region layer is read, reprojected and prepared once per grid SRS instead of once per layer combination
+    vprint("Prepping data ...")
+    prepared_regions = {}
+    grid_srs_keys = []
+    for grid_layer in all_grid_layers:
+        grid_layer_srs = grid_layer.GetSpatialRef()
+        srs_key = grid_layer_srs.ExportToWkt() if grid_layer_srs is not None else None
+        grid_srs_keys.append(srs_key)
+        for region_layer in all_region_layers:
+            if (region_layer.GetName(), srs_key) not in prepared_regions:
+                prepared_regions[(region_layer.GetName(), srs_key)] = prepare_regions(region_layer, grid_layer_srs)
+
+    # Create an initial spatial filter consisting of one convex hull for every input region in every region layer
+    # This yields a much smaller set of grid tiles that need to be examined
+    # Dump these filtered grid cells into an in-memory layer that is shared by all region layers
+    grid_cells = []
+    for grid_layer, srs_key in zip(all_grid_layers, grid_srs_keys):
+        limit_geom = ogr.Geometry(ogr.wkbGeometryCollection)
+        for region_layer in all_region_layers:
+            for region_feature, region_geom, region_hull in prepared_regions[(region_layer.GetName(), srs_key)]:
+                limit_geom.AddGeometry(region_hull)
+        grid_cells.append(load_grid_cells(grid_layer, limit_geom))
+    region_feature = None
+    region_geom = None
+    region_hull = None
+    limit_geom = None
+
     # Process every combination of region layer and grid layer
     region_layer_counter = 0
     grid_layer_counter = 0
@@ -442,7 +640,7 @@ def main(args):
         vprint("Processing region layer %s/%s: %s" % (region_layer_counter, len(all_region_layers),
                                                       region_layer.GetName()))
 
-        for grid_layer in all_grid_layers:
+        for grid_layer, srs_key, (mem_ds, mem_layer) in zip(all_grid_layers, grid_srs_keys, grid_cells):
 
             # Get field definitions for processing
             # Make sure there are no duplicate fields
@@ -479,12 +677,23 @@ def main(args):
             grid_layer_counter += 1
             vprint("  Processing grid layer %s/%s: %s" % (grid_layer_counter, len(all_grid_layers), grid_layer.GetName()))
 
-            # Create output layer
+            # Create output layer or, when resuming, append to the layer left behind by the previous run
             output_layer_name = region_layer.GetName() + '-' + grid_layer.GetName()
-            output_layer = output_ds.CreateLayer(output_layer_name, srs=grid_layer.GetSpatialRef(),
-                                                 geom_type=ogr.wkbMultiPolygon, options=output_lco)
-            for field_def in region_field_definitions + grid_field_definitions:
-                output_layer.CreateField(field_def)
+            layer_progress = completed.get(output_layer_name, {'fids': set(), 'last_output_fid': -1})
+            output_layer = None
+            if resume_mode:
+                output_layer = output_ds.GetLayerByName(output_layer_name)
+            if output_layer is None:
+                output_layer = output_ds.CreateLayer(output_layer_name, srs=grid_layer.GetSpatialRef(),
+                                                     geom_type=ogr.wkbMultiPolygon, options=output_lco)
+                for field_def in region_field_definitions + grid_field_definitions:
+                    output_layer.CreateField(field_def)
+                layer_progress = {'fids': set(), 'last_output_fid': -1}
+            else:
+                vprint("    Resuming - %s region features already completed" % len(layer_progress['fids']))
+                num_removed = rollback_layer(output_ds, output_layer, layer_progress['last_output_fid'])
+                if num_removed:
+                    vprint("    Removed %s features from an unfinished region feature" % num_removed)
 
             # Cleanup
             region_field_definitions = None
@@ -493,68 +702,36 @@ def main(args):
             grid_feature_def = None
             field_def = None
 
-            # Cache SRS objects
-            grid_layer_srs = region_layer.GetSpatialRef()
-            region_layer_srs = region_layer.GetSpatialRef()
-
-            # Create a coordinate transformation object if the region_layer and grid_layer are in a different SRS
-            if grid_layer_srs.IsSame(region_layer_srs) is not 1:
-                coord_transform = osr.CoordinateTransformation(region_layer_srs, grid_layer_srs)
-            else:
-                coord_transform = None
-
             #/* ----------------------------------------------------------------------- */#
             #/*     Process data
             #/* ----------------------------------------------------------------------- */#
 
-
-            # Create an initial spatial filter consisting of one convex hull for every input region
-            # This yields a much smaller set of grid tiles that need to be examined
-            # Dump these filtered grid cells into an in-memory layer
             # Loop through all regions, set a spatial filter on the in-memory layer = convex hull
             # Stamp out all grid cells
 
             vprint("    Progress units are region features")
-            vprint("    Prepping data ...")
-
-            # Create an initial spatial filter from all input geometries
-            # Create a single geometry containing one convex hull for every input feature
-            limit_geom = ogr.Geometry(ogr.wkbGeometryCollection)
-            limit_geom.AssignSpatialReference(region_layer.GetSpatialRef())
-            for region_feature in region_layer:
-                region_geom = region_feature.GetGeometryRef()
-                limit_geom.AddGeometry(region_geom.ConvexHull())
-            if limit_geom.GetSpatialReference().IsSame(grid_layer_srs) is not 1:
-                limit_geom.Transform(coord_transform)
-            region_layer.ResetReading()
-            grid_layer.SetSpatialFilter(limit_geom)
-            region_feature = None
-            region_geom = None
-
-            # Stash all the found grid cells into an in memory layer
-            mem_driver = ogr.GetDriverByName('Memory')
-            mem_ds = mem_driver.CreateDataSource('mem_grids')
-            mem_layer = mem_ds.CreateLayer('mem_grids', grid_layer.GetSpatialRef(), grid_layer.GetGeomType())
-            for grid_feature in grid_layer:
-                mem_layer.CreateFeature(grid_feature)
-            grid_layer.ResetReading()
 
             # Loop through the region polygons, set a spatial filter
             region_feature_counter = 0
-            num_region_features = len(region_layer)
-            fid_counter = -1
-            for region_feature in region_layer:
+            region_features = prepared_regions[(region_layer.GetName(), srs_key)]
+            num_region_features = len(region_features)
+            fid_counter = layer_progress['last_output_fid']
+            last_output_fid = layer_progress['last_output_fid']
+            completed_regions = []
+            last_sync = time.time()
+            for region_feature, region_geom, region_hull in region_features:
 
                 # Update user
                 region_feature_counter += 1
                 sys.stdout.write("\r\x1b[K" + "    %s/%s" % (region_feature_counter, num_region_features))
                 sys.stdout.flush()
 
-                region_geom = region_feature.GetGeometryRef().Clone()
-                if coord_transform is not None:
-                    region_geom.Transform(coord_transform)
+                # Region feature was finished by a previous run
+                if region_feature.GetFID() in layer_progress['fids']:
+                    continue
+
+                mem_layer.SetSpatialFilter(region_hull)
                 mem_layer.ResetReading()
-                mem_layer.SetSpatialFilter(region_geom.ConvexHull())
 
                 # Stamp out all intersecting grids and add to output layer
                 for m_grid_feature in mem_layer:
@@ -631,9 +808,23 @@ def main(args):
                         output_feature.SetGeometry(output_geom)
                         output_layer.CreateFeature(output_feature)
 
+                        # Some drivers, like the shapefile driver, assign their own FID
+                        last_output_fid = output_feature.GetFID()
+
+                # Completed region features are recorded in batches, each after flushing the output.  Anything
+                # written since the last batch is rolled back and re-created when resuming.
+                completed_regions.append((output_layer_name, region_feature.GetFID(), last_output_fid))
+                if time.time() - last_sync >= PROGRESS_SYNC_INTERVAL:
+                    output_layer.SyncToDisk()
+                    record_progress(progress_f, completed_regions)
+                    completed_regions = []
+                    last_sync = time.time()
+
             # Update user - done processing a grid layer
             vprint(" - Done")
             output_layer.SyncToDisk()
+            if completed_regions:
+                record_progress(progress_f, completed_regions)
 
     # Cleanup
     sub_geom = None
@@ -646,9 +837,9 @@ def main(args):
     m_grid_geom = None
     mem_layer = None
     mem_ds = None
-    mem_driver = None
-    limit_geom = None
-    coord_transform = None
+    grid_cells = None
+    prepared_regions = None
+    region_hull = None
     region_geom = None
     grid_geom = None
     intersecting_geom = None
@@ -664,6 +855,7 @@ def main(args):
     #/* ----------------------------------------------------------------------- */#
 
     # Close OGR objects
+    progress_f.close()
     output_driver = None
     output_ds = None
     region_layers = None
@@ -0,0 +1,339 @@
+# This document is part of pelagos-data
+# https://github.com/skytruth/pelagos-data
+
+
+# =========================================================================== #
+#
+#  The MIT License (MIT)
+#
+#  Copyright (c) 2014 SkyTruth
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# =========================================================================== #
+
+
+"""
+Vessel measures
+
+Measures are declared in a registry with the inputs they are computed from,
+which are either raw columns or other measures.  A Plan resolves the
+measures that were asked for into the ordered steps needed to compute them,
+so shared intermediates like diffs, running sums and window starts are
+computed once per batch and measures nobody asked for are never evaluated.
+
+Windowed measures are computed once per window size and receive the window
+in seconds as the `window` keyword argument.
+"""
+
+
+from __future__ import division
+from __future__ import unicode_literals
+
+from functools import partial
+
+import numpy
+
+
+#/* ======================================================================= */#
+#/*     Global variables
+#/* ======================================================================= */#
+
+REGISTRY = {}
+
+DIFF_KEYS = ['longitude', 'latitude', 'timestamp', 'hdg', 'rot', 'cog', 'sog']
+
+DEFAULT_MEASURES = [key + '_diff' for key in DIFF_KEYS] + [
+    'cogstddev', 'sogstddev', 'cogavg', 'sogavg', 'latitudeavg', 'longitudeavg', 'pos', 'new_score']
+
+EARTH_RADIUS_NM = 3440.065
+
+
+#/* ======================================================================= */#
+#/*     Define Measure() class
+#/* ======================================================================= */#
+
+class Measure(object):
+
+    """
+    A named measure computed as func(*inputs) or, for windowed measures,
+    func(*inputs, window=window)
+    """
+
+    def __init__(self, name, func, inputs=(), windowed=False):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.windowed = windowed
+
+    def __repr__(self):
+        return "%s(%r, inputs=%r, windowed=%r)" % (self.__class__.__name__, self.name, self.inputs, self.windowed)
+
+
+#/* ======================================================================= */#
+#/*     Define register() function
+#/* ======================================================================= */#
+
+def register(name, inputs=(), windowed=False, registry=REGISTRY):
+
+    """
+    Decorator registering a function as a measure
+
+
+    Kwargs
+    ------
+    name : str, unicode
+        Measure name
+
+    inputs : list, tuple
+        Column or measure names passed to the function, in order
+
+    windowed : bool
+        Compute the measure once per window size
+
+    registry : dict
+        Registry to add the measure to
+
+
+    Raises
+    ------
+    ValueError
+        A measure with the same name is already registered
+    """
+
+    def decorator(func):
+        if name in registry:
+            raise ValueError("Measure already registered: %s" % name)
+        registry[name] = Measure(name, func, inputs, windowed)
+        return func
+
+    return decorator
+
+
+#/* ======================================================================= */#
+#/*     Define Plan() class
+#/* ======================================================================= */#
+
+class Plan(object):
+
+    """
+    The ordered steps needed to compute a set of measures for a set of windows
+
+    Outputs are keyed by (name, window), where window is None for measures
+    that don't depend on a window.
+    """
+
+    def __init__(self, names, windows=(), registry=REGISTRY):
+
+        self.windows = tuple(windows)
+        self.registry = registry
+        self.steps = []
+        self.outputs = []
+
+        for name in names:
+            measure = self._get(name)
+            if measure.windowed:
+                if not self.windows:
+                    raise ValueError("Measure '%s' needs at least one window" % name)
+                self.outputs += [(name, window) for window in self.windows]
+            else:
+                self.outputs.append((name, None))
+
+        planned = set()
+        for name, window in self.outputs:
+            self._add(name, window, planned, [])
+
+    def _get(self, name):
+        try:
+            return self.registry[name]
+        except KeyError:
+            raise ValueError("Unknown measure: %s" % name)
+
+    def _add(self, name, window, planned, path):
+
+        # Depth first so every step comes after the steps it depends on
+        if (name, window) in planned:
+            return
+        if name in path:
+            raise ValueError("Measure dependency cycle: %s" % ' -> '.join(path + [name]))
+        measure = self.registry[name]
+        for dependency in measure.inputs:
+            if dependency in self.registry:
+                if self.registry[dependency].windowed and not measure.windowed:
+                    raise ValueError("Measure '%s' can't depend on windowed measure '%s'" % (name, dependency))
+                self._add(dependency, window if self.registry[dependency].windowed else None, planned, path + [name])
+        planned.add((name, window))
+        self.steps.append((measure, window))
+
+    @property
+    def columns(self):
+
+        """
+        Raw columns the plan reads
+        """
+
+        return sorted(set(i for measure, window in self.steps for i in measure.inputs if i not in self.registry))
+
+    def evaluate(self, columns):
+
+        """
+        Compute every planned measure for one batch of rows
+
+
+        Kwargs
+        ------
+        columns : dict
+            {column name: numpy.ndarray} for a single vessel, in time order
+
+
+        Returns
+        -------
+        dict
+            {(name, window): numpy.ndarray} for every requested measure
+        """
+
+        results = {}
+        for measure, window in self.steps:
+            args = []
+            for i in measure.inputs:
+                if i in self.registry:
+                    args.append(results[(i, window if self.registry[i].windowed else None)])
+                else:
+                    args.append(columns[i])
+            if measure.windowed:
+                results[(measure.name, window)] = measure.func(*args, window=window)
+            else:
+                results[(measure.name, None)] = measure.func(*args)
+        return {key: results[key] for key in self.outputs}
+
+
+#/* ======================================================================= */#
+#/*     Define window helpers
+#/* ======================================================================= */#
+
+def window_starts(timestamps, window):
+
+    """
+    For each row, the index of the first row that is no more than window
+    seconds older
+    """
+
+    if numpy.all(timestamps[1:] >= timestamps[:-1]):
+        return numpy.searchsorted(timestamps, timestamps - window, 'left')
+
+    # Out of order timestamps - step the window start forward the same way a streaming window would
+    starts = numpy.zeros(len(timestamps), dtype=numpy.intp)
+    start = 0
+    for end in range(len(timestamps)):
+        while timestamps[end] - timestamps[start] > window:
+            start += 1
+        starts[end] = start
+    return starts
+
+
+def cumulative_sums(values):
+
+    """
+    Running totals of the values and their squares, shared by every window
+    """
+
+    # Shift by the mean so the sum of squares doesn't lose precision for values like latitudes, and
+    # use extended precision to keep the difference of two large running totals accurate for long tracks
+    shift = values.mean() if len(values) else 0.0
+    shifted = values - shift
+    sums = numpy.concatenate(([0.0], numpy.cumsum(shifted, dtype=numpy.longdouble)))
+    sqsums = numpy.concatenate(([0.0], numpy.cumsum(shifted * shifted, dtype=numpy.longdouble)))
+    return shift, sums, sqsums
+
+
+def window_avg_var(cumsums, starts, window=None):
+
+    """
+    Average and variance of values[starts[i]:i + 1] for every i
+    """
+
+    shift, sums, sqsums = cumsums
+    ends = numpy.arange(1, len(starts) + 1)
+    counts = ends - starts
+    mean = ((sums[ends] - sums[starts]) / counts).astype(numpy.float64)
+    var = numpy.maximum(((sqsums[ends] - sqsums[starts]) / counts).astype(numpy.float64) - mean * mean, 0.0)
+    return mean + shift, var
+
+
+def abs_diff(values):
+    return numpy.abs(numpy.diff(numpy.concatenate((values[:1], values))))
+
+
+def item(values, index, window=None):
+    return values[index]
+
+
+def stddev(var, window=None):
+    return numpy.sqrt(var)
+
+
+#/* ======================================================================= */#
+#/*     Standard measures
+#/* ======================================================================= */#
+
+for _key in DIFF_KEYS:
+    register(_key + '_diff', [_key])(abs_diff)
+
+register('window_starts', ['timestamp'], windowed=True)(window_starts)
+
+for _key in ('cog', 'sog', 'latitude', 'longitude'):
+    register(_key + '_cumsums', [_key])(cumulative_sums)
+    register(_key + '_avgvar', [_key + '_cumsums', 'window_starts'], windowed=True)(window_avg_var)
+    register(_key + 'avg', [_key + '_avgvar'], windowed=True)(partial(item, index=0))
+    register(_key + 'var', [_key + '_avgvar'], windowed=True)(partial(item, index=1))
+
+for _key in ('cog', 'sog'):
+    register(_key + 'stddev', [_key + 'var'], windowed=True)(stddev)
+
+
+@register('pos', ['latitudevar', 'longitudevar'], windowed=True)
+def pos(latitudevar, longitudevar, window):
+    # Combined standard deviation of the position in degrees, to knots...
+    speed = (numpy.sqrt(latitudevar + longitudevar) * 60) / (window / 60 / 60)
+    # Normalize to "normal" vessel speed
+    return numpy.minimum(1.0, speed / 17.0)
+
+
+@register('new_score', ['cogstddev', 'sogstddev', 'sogavg'], windowed=True)
+def new_score(cogstddev, sogstddev, sogavg, window):
+    return (cogstddev + sogstddev + sogavg) / 3.0
+
+
+@register('step_distance', ['longitude', 'latitude'])
+def step_distance(longitude, latitude):
+    # Great circle distance in nautical miles from the previous point
+    lon = numpy.radians(longitude)
+    lat = numpy.radians(latitude)
+    dlon = numpy.diff(numpy.concatenate((lon[:1], lon)))
+    dlat = numpy.diff(numpy.concatenate((lat[:1], lat)))
+    prev_lat = numpy.concatenate((lat[:1], lat[:-1]))
+    a = numpy.sin(dlat / 2) ** 2 + numpy.cos(prev_lat) * numpy.cos(lat) * numpy.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_NM * numpy.arcsin(numpy.sqrt(numpy.minimum(1.0, a)))
+
+
+@register('step_speed', ['step_distance', 'timestamp_diff'])
+def step_speed(step_distance, timestamp_diff):
+    # Knots, zero where there's no elapsed time
+    hours = timestamp_diff / 3600.0
+    return numpy.where(hours > 0, step_distance / numpy.where(hours > 0, hours, 1.0), 0.0)
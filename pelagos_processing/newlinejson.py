@@ -0,0 +1,308 @@
+# This document is part of pelagos-data
+# https://github.com/skytruth/pelagos-data
+
+
+# =========================================================================== #
+#
+#  The MIT License (MIT)
+#
+#  Copyright (c) 2014 SkyTruth
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# =========================================================================== #
+
+
+"""
+Newline delimited JSON reading and writing
+"""
+
+
+from __future__ import unicode_literals
+
+import json
+import os
+
+import numpy
+
+
+#/* ======================================================================= */#
+#/*     Global variables
+#/* ======================================================================= */#
+
+DEFAULT_BLOCK_SIZE = 4 * 1048576
+DEFAULT_BUFFER_SIZE = 1000
+
+
+#/* ======================================================================= */#
+#/*     Define decode_lines() function
+#/* ======================================================================= */#
+
+def decode_lines(text, delimiter=b'\n'):
+
+    """
+    Decode a block of complete newline delimited JSON lines with a single
+    json.loads() call by turning the block into a JSON array.  Blank lines are
+    skipped.  If the array doesn't hold exactly one value per line, like when
+    a line holds more than one value, the block is decoded line by line so the
+    offending line raises an exception.
+
+
+    Kwargs
+    ------
+    text : str, unicode
+        One or more complete lines, ideally UTF-8 encoded bytes
+
+    delimiter : str
+        Line delimiter
+
+
+    Returns
+    -------
+    list
+        One decoded value per non-empty line
+
+    Raises
+    ------
+    ValueError
+        A line could not be decoded or holds more than one value
+    """
+
+    lines = [line for line in text.split(delimiter) if line.strip()]
+    if not lines:
+        return []
+    try:
+        rows = json.loads(b'[' + b','.join(lines) + b']')
+        if len(rows) == len(lines):
+            return rows
+    except ValueError:
+        pass
+    return [json.loads(line) for line in lines]
+
+
+#/* ======================================================================= */#
+#/*     Define NewlineJSONReader() class
+#/* ======================================================================= */#
+
+class NewlineJSONReader(object):
+
+    """
+    Allow newline delimited JSON to be read similarly to csv.DictReader
+
+    The file is read in blocks of block_size bytes and each block of complete
+    lines is decoded at once.  Lines end with delimiter and must each hold a
+    single JSON value.  Rows can be iterated one at a time or a decoded
+    block at a time with iter_chunks() and iter_columns().
+    """
+
+    def __init__(self, f, fieldnames=None, delimiter=os.linesep, block_size=DEFAULT_BLOCK_SIZE):
+
+        if not isinstance(block_size, int) or block_size <= 0:
+            raise ValueError("Invalid block size - must be an int > 0: %s" % block_size)
+
+        self.f = f
+        self.delimiter = delimiter
+        self.block_size = block_size
+        self.fieldnames = fieldnames
+        self._remainder = b''
+
+        # Blocks of UTF-8 bytes must be searched and split with a byte string to avoid decoding them as ASCII
+        if isinstance(delimiter, unicode):
+            delimiter = delimiter.encode('utf-8')
+        self._delimiter = delimiter
+        self._rows = []
+        self._index = 0
+
+        # In order to allow collecting fieldnames from stdin, the first chunk must be cached, parsed for fieldnames,
+        # and returned later when iterated
+        if self.fieldnames is None:
+            self._rows = self._decode_next_block()
+            if self._rows:
+                self.fieldnames = list(self._rows[0].keys())
+
+    def _read_block(self):
+
+        # Only complete lines are returned - anything after the last newline is carried into the next block
+        while True:
+            block = self.f.read(self.block_size)
+            if not block:
+                text, self._remainder = self._remainder, b''
+                return text
+            if self._remainder:
+                block = self._remainder + block
+            idx = block.rfind(self._delimiter)
+            if idx == -1:
+                self._remainder = block
+            else:
+                idx += len(self._delimiter)
+                self._remainder = block[idx:]
+                return block[:idx]
+
+    def _decode_next_block(self):
+        while True:
+            text = self._read_block()
+            if not text:
+                return []
+            rows = decode_lines(text, self._delimiter)
+            if rows:
+                return rows
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        while self._index >= len(self._rows):
+            self._rows = self._decode_next_block()
+            self._index = 0
+            if not self._rows:
+                raise StopIteration
+        row = self._rows[self._index]
+        self._index += 1
+        return row
+
+    __next__ = next
+
+    def read_chunk(self):
+
+        """
+        Read the next decoded block of rows
+
+        Returns
+        -------
+        list
+            List of rows, which is empty once the input is exhausted
+        """
+
+        if self._index < len(self._rows):
+            rows = self._rows[self._index:] if self._index else self._rows
+        else:
+            rows = self._decode_next_block()
+        self._rows = []
+        self._index = 0
+        return rows
+
+    def iter_chunks(self):
+
+        """
+        Iterate over the input one decoded block at a time
+
+        Yields
+        ------
+        list
+            List of rows
+        """
+
+        while True:
+            rows = self.read_chunk()
+            if not rows:
+                break
+            yield rows
+
+    def iter_columns(self, fields=None, dtypes=None):
+
+        """
+        Iterate over the input one decoded block at a time as columns
+
+
+        Kwargs
+        ------
+        fields : list, tuple, None
+            Fields to collect - defaults to the reader's fieldnames.  Rows
+            missing a field get None.
+
+        dtypes : dict, None
+            {field: numpy dtype} - listed fields are returned as numpy arrays
+            instead of lists
+
+
+        Yields
+        ------
+        dict
+            {field: list or numpy.ndarray}
+        """
+
+        fields = self.fieldnames if fields is None else fields
+        dtypes = dtypes or {}
+        for rows in self.iter_chunks():
+            columns = {}
+            for field in fields:
+                values = [row.get(field) for row in rows]
+                if field in dtypes:
+                    values = numpy.array(values, dtype=dtypes[field])
+                columns[field] = values
+            yield columns
+
+    def seek(self, val):
+        self._remainder = b''
+        self._rows = []
+        self._index = 0
+        return self.f.seek(val)
+
+    def close(self):
+        self.f.close()
+
+
+#/* ======================================================================= */#
+#/*     Define NewlineJSONWriter() class
+#/* ======================================================================= */#
+
+class NewlineJSONWriter(object):
+
+    """
+    Allow newline delimited JSON to be written similarly to csv.DictWriter
+
+    Encoded rows are buffered and written buffer_size at a time, so flush()
+    or close() must be called once all rows have been written.
+    """
+
+    def __init__(self, f, fieldnames=None, delimiter=os.linesep, buffer_size=DEFAULT_BUFFER_SIZE, sort_keys=False):
+
+        if not isinstance(buffer_size, int) or buffer_size <= 0:
+            raise ValueError("Invalid buffer size - must be an int > 0: %s" % buffer_size)
+
+        self.f = f
+        self.delimiter = delimiter
+        self.fieldnames = fieldnames
+        self.buffer_size = buffer_size
+        self.sort_keys = sort_keys
+        self._fieldnames = set(fieldnames) if fieldnames else None
+        self._buffer = []
+
+    def writerow(self, row):
+        if self._fieldnames:
+            row = {k: v for k, v in row.iteritems() if k in self._fieldnames}
+        self._buffer.append(json.dumps(row, sort_keys=self.sort_keys))
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def write(self, row):
+        self.writerow(row)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        if self._buffer:
+            self.f.write(self.delimiter.join(self._buffer) + self.delimiter)
+            self._buffer = []
+
+    def close(self):
+        self.flush()
+        self.f.close()
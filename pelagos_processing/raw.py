@@ -36,7 +36,13 @@ Vessel processing
 
 from __future__ import unicode_literals
 
+import gzip
+import heapq
+import itertools
 import os
+import shutil
+import tempfile
+import zipfile
 
 
 #/* ======================================================================= */#
@@ -44,17 +50,345 @@ import os
 #/* ======================================================================= */#
 
 RAW_SCHEMA = ['mmsi', 'longitude', 'latitude', 'timestamp', 'score', 'navstat', 'hdg', 'rot', 'cog', 'sog']
+BLOCK_SIZE = 4 * 1024 * 1024
+MERGE_KEY = ('mmsi', 'timestamp')
+# Well under the common limit of 1024 open files per process
+MAX_MERGE_STREAMS = 256
+
+
+#/* ======================================================================= */#
+#/*     Define iter_input_streams() function
+#/* ======================================================================= */#
+
+def iter_input_streams(input_file):
+
+    """
+    Open an input file for binary reading.  Every member of a .zip archive and
+    the decompressed contents of a .gz file are read as if they were separate
+    plain files.
+
+
+    Kwargs
+    ------
+    input_file : str, unicode
+        File to read
+
+
+    Returns
+    -------
+    generator
+        An open file-like object for each stream, closed once the next one is
+        requested
+    """
+
+    lower = input_file.lower()
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(input_file) as archive:
+            for member in archive.infolist():
+                if not member.filename.endswith('/'):
+                    with archive.open(member) as i_f:
+                        yield i_f
+    elif lower.endswith('.gz'):
+        with gzip.open(input_file, 'rb') as i_f:
+            yield i_f
+    else:
+        with open(input_file, 'rb') as i_f:
+            yield i_f
+
+
+#/* ======================================================================= */#
+#/*     Define input_members() function
+#/* ======================================================================= */#
+
+def input_members(input_file):
+
+    """
+    List the streams in an input file without opening them.  Streams are split
+    up the same way as iter_input_streams().
+
+
+    Kwargs
+    ------
+    input_file : str, unicode
+        File to list
+
+
+    Returns
+    -------
+    list
+        A zipfile.ZipInfo for every member of a .zip archive, or [None] for any
+        other file
+    """
+
+    if input_file.lower().endswith('.zip'):
+        with zipfile.ZipFile(input_file) as archive:
+            return [member for member in archive.infolist() if not member.filename.endswith('/')]
+    else:
+        return [None]
+
+
+#/* ======================================================================= */#
+#/*     Define open_input_streams() function
+#/* ======================================================================= */#
+
+def open_input_streams(input_file, members=None):
+
+    """
+    Open every stream in an input file at once, for reading them side by side.
+    Streams are split up the same way as iter_input_streams().
+
+
+    Kwargs
+    ------
+    input_file : str, unicode
+        File to read
+
+    members : list, None
+        Members from input_members() to open instead of the whole file
+
+
+    Returns
+    -------
+    list
+        Open file-like objects, which the caller is responsible for closing
+    """
+
+    lower = input_file.lower()
+    if lower.endswith('.zip'):
+        if members is None:
+            members = input_members(input_file)
+        # Members opened from an archive given by name have their own file handle and outlive the archive
+        streams = []
+        try:
+            with zipfile.ZipFile(input_file) as archive:
+                for member in members:
+                    streams.append(archive.open(member))
+        except Exception:
+            for i_f in streams:
+                i_f.close()
+            raise
+        return streams
+    elif lower.endswith('.gz'):
+        return [gzip.open(input_file, 'rb')]
+    else:
+        return [open(input_file, 'rb')]
+
+
+#/* ======================================================================= */#
+#/*     Define iter_block_lines() function
+#/* ======================================================================= */#
+
+def iter_block_lines(stream, block_size=BLOCK_SIZE):
+
+    """
+    Iterate over a stream's lines while only reading about block_size bytes at
+    a time
+
+
+    Kwargs
+    ------
+    stream : file
+        Open file-like object
+
+    block_size : int
+        Approximate number of bytes to read ahead
+
+
+    Returns
+    -------
+    generator
+        Lines
+    """
+
+    while True:
+        lines = stream.readlines(block_size)
+        if not lines:
+            break
+        for line in lines:
+            yield line
+
+
+#/* ======================================================================= */#
+#/*     Define merge_lines() function
+#/* ======================================================================= */#
+
+def merge_lines(streams, key_columns, block_size=BLOCK_SIZE):
+
+    """
+    Merge comma delimited lines from streams that are each sorted by the values
+    in key_columns into one sorted sequence.  Values that look like numbers are
+    compared as numbers.  Lines with equal keys keep the order of their streams
+    and empty lines are dropped.
+
+
+    Kwargs
+    ------
+    streams : list
+        Open file-like objects, each positioned at its first line to merge
+
+    key_columns : list, tuple
+        Indexes of the columns to sort by
+
+    block_size : int
+        Number of bytes to read ahead, shared between all streams
+
+
+    Returns
+    -------
+    generator
+        Lines, each ending with a newline
+
+    Raises
+    ------
+    ValueError
+        A stream is not sorted
+    """
+
+    def sort_key(line):
+        values = line.rstrip(b'\r\n').split(b',')
+        key = []
+        for column in key_columns:
+            value = values[column]
+            try:
+                key.append(float(value))
+            except ValueError:
+                key.append(value)
+        return tuple(key)
+
+    def keyed_lines(idx, stream):
+        last_key = None
+        for line in iter_block_lines(stream, read_ahead):
+            if not line.strip():
+                continue
+            if not line.endswith(b'\n'):
+                line += os.linesep
+            key = sort_key(line)
+            if last_key is not None and key < last_key:
+                raise ValueError("Input is not sorted by the merge key: %s" % line.rstrip())
+            last_key = key
+            yield key, idx, line
+
+    # Every stream only holds its share of block_size in memory
+    read_ahead = max(1, block_size // max(1, len(streams)))
+    iterators = [keyed_lines(idx, stream) for idx, stream in enumerate(streams)]
+
+    heap = []
+    for iterator in iterators:
+        for item in iterator:
+            heap.append(item)
+            break
+    heapq.heapify(heap)
+
+    while heap:
+        key, idx, line = heap[0]
+        yield line
+        for item in iterators[idx]:
+            heapq.heapreplace(heap, item)
+            break
+        else:
+            heapq.heappop(heap)
+
+
+#/* ======================================================================= */#
+#/*     Define merge_inputs() function
+#/* ======================================================================= */#
+
+def merge_inputs(sources, o_f, key_columns, skip_lines=0, block_size=BLOCK_SIZE, max_streams=MAX_MERGE_STREAMS,
+                 tmp_dir=None):
+
+    """
+    Merge sorted input streams into an open file with merge_lines(), keeping at
+    most max_streams of them open at once.  With more sources than that, each
+    run of max_streams consecutive sources is first merged into a temporary
+    file and those files are merged in turn, so lines with equal keys still
+    keep the order of their sources.
+
+
+    Kwargs
+    ------
+    sources : list
+        (input_file, member) pairs, with members from input_members()
+
+    o_f : file
+        Open file-like object to write the merged lines to
+
+    key_columns : list, tuple
+        Indexes of the columns to sort by
+
+    skip_lines : int
+        Number of lines to skip at the start of each source
+
+    block_size : int
+        Number of bytes to read ahead, shared between all open streams
+
+    max_streams : int
+        Maximum number of streams open at once, at least 2
+
+    tmp_dir : str, unicode, None
+        Directory for the temporary files, the system default if None
+
+
+    Raises
+    ------
+    ValueError
+        A stream is not sorted, or max_streams is less than 2
+    """
+
+    if not isinstance(max_streams, int) or not max_streams >= 2:
+        raise ValueError("Invalid max streams - must be an int >= 2: %s" % max_streams)
+
+    # Merge in passes through temporary files
+    if len(sources) > max_streams:
+        merged = []
+        try:
+            for start in range(0, len(sources), max_streams):
+                fd, path = tempfile.mkstemp(suffix='.csv', dir=tmp_dir)
+                merged.append(path)
+                with os.fdopen(fd, 'wb') as t_f:
+                    merge_inputs(sources[start:start + max_streams], t_f, key_columns, skip_lines=skip_lines,
+                                 block_size=block_size, max_streams=max_streams, tmp_dir=tmp_dir)
+            merge_inputs([(path, None) for path in merged], o_f, key_columns, block_size=block_size,
+                         max_streams=max_streams, tmp_dir=tmp_dir)
+        finally:
+            for path in merged:
+                os.remove(path)
+        return
+
+    streams = []
+    try:
+        for input_file, group in itertools.groupby(sources, key=lambda source: source[0]):
+            streams.extend(open_input_streams(input_file, [member for ifile, member in group]))
+        for i_f in streams:
+            for sl in range(skip_lines):
+                i_f.readline()
+        for line in merge_lines(streams, key_columns, block_size):
+            o_f.write(line)
+    finally:
+        for i_f in streams:
+            i_f.close()
 
 
 #/* ======================================================================= */#
 #/*     Define cat_files() function
 #/* ======================================================================= */#
 
-def cat_files(input_files, target_file, schema=RAW_SCHEMA, write_mode='w', skip_lines=0, skip_empty=False):
+def cat_files(input_files, target_file, schema=RAW_SCHEMA, write_mode='w', skip_lines=0, skip_empty=False,
+              compress=False, block_size=BLOCK_SIZE, merge_key=None, max_streams=MAX_MERGE_STREAMS):
 
     """
     Concatenate a large number of large files
 
+    Inputs are copied in blocks rather than line by line unless empty lines
+    are being skipped.  Lines are only read to skip the first skip_lines of
+    each input.  Inputs ending in .gz are decompressed and every member of an
+    input ending in .zip is concatenated as if it were its own input file.
+
+    With a merge_key, inputs that are each already sorted by it are merged
+    into one sorted output instead of being concatenated.  Inputs with up to
+    max_streams files and .zip members between them are merged in a single
+    pass, and more in several passes through temporary files next to
+    target_file.
+
 
     Kwargs
     ------
@@ -77,6 +411,20 @@ def cat_files(input_files, target_file, schema=RAW_SCHEMA, write_mode='w', skip_
     skip_empty : bool
         Skip empty lines, which are classified as line in ('', os.linesep)
 
+    compress : bool
+        Write target_file with gzip compression
+
+    block_size : int
+        Number of bytes to copy at a time, or to read ahead across all inputs
+        when merging
+
+    merge_key : list, tuple, None
+        Field names from schema or column indexes that every input is sorted
+        by, e.g. MERGE_KEY.  Empty lines are always skipped when merging.
+
+    max_streams : int
+        Maximum number of input streams to open at once when merging
+
 
     Returns
     -------
@@ -86,7 +434,7 @@ def cat_files(input_files, target_file, schema=RAW_SCHEMA, write_mode='w', skip_
     Raises
     ------
     ValueError
-        Invalid argument value
+        Invalid argument value, or an input is not sorted by merge_key
     TypeError
         Invalid argument type
     IOError
@@ -97,31 +445,67 @@ def cat_files(input_files, target_file, schema=RAW_SCHEMA, write_mode='w', skip_
     write_mode = write_mode.lower()
     if not isinstance(skip_lines, int) or not skip_lines >= 0:
         raise ValueError("Invalid skip lines - must be an int >= 0: %s" % skip_lines)
+    if not isinstance(block_size, int) or not block_size > 0:
+        raise ValueError("Invalid block size - must be an int > 0: %s" % block_size)
+    if not isinstance(max_streams, int) or not max_streams >= 2:
+        raise ValueError("Invalid max streams - must be an int >= 2: %s" % max_streams)
     if isinstance(schema, (list, tuple)):
         header = ','.join(schema)
-    elif isinstance(schema, (str, unicode, None)):
+    elif schema is None or isinstance(schema, (str, unicode)):
         header = schema
     else:
         raise TypeError("Invalid schema: %s" % schema)
+    if merge_key is not None:
+        fields = header.split(',') if header else []
+        key_columns = []
+        for field in merge_key:
+            if isinstance(field, int):
+                key_columns.append(field)
+            elif field in fields:
+                key_columns.append(fields.index(field))
+            else:
+                raise ValueError("Invalid merge key - not a column index or a field in the schema: %s" % field)
 
     # Make sure all the input files actually exist
     for ifile in input_files:
         if not os.access(ifile, os.R_OK):
             raise IOError("Can't access input file: %s" % ifile)
 
-    with open(target_file, write_mode) as o_f:
+    if compress:
+        o_f = gzip.open(target_file, write_mode.replace('b', '') + 'b')
+    else:
+        o_f = open(target_file, write_mode)
+    with o_f:
 
         # Write the header if specified
         if schema not in (None, ''):
             o_f.write(header + os.linesep)
 
-        for ifile in input_files:
-            with open(ifile) as i_f:
-                # Skip lines
-                for sl in range(skip_lines):
-                    i_f.next()
-                for line in i_f:
-                    if not skip_empty and line not in ('', os.linesep):
-                        o_f.write(line)
+        # Input streams are open max_streams at a time and read a block at a time
+        if merge_key is not None:
+            sources = [(ifile, member) for ifile in input_files for member in input_members(ifile)]
+            merge_inputs(sources, o_f, key_columns, skip_lines=skip_lines, block_size=block_size,
+                         max_streams=max_streams, tmp_dir=os.path.dirname(os.path.abspath(target_file)))
+
+        # Concatenate one input stream at a time
+        else:
+            for ifile in input_files:
+                for i_f in iter_input_streams(ifile):
+
+                    # Skip lines
+                    for sl in range(skip_lines):
+                        i_f.readline()
+
+                    # Filter a block's worth of lines at a time
+                    if skip_empty:
+                        while True:
+                            lines = i_f.readlines(block_size)
+                            if not lines:
+                                break
+                            o_f.write(b''.join([line for line in lines if line not in (b'', os.linesep)]))
+
+                    # Nothing to filter so the rest of the file can be copied without splitting it into lines
+                    else:
+                        shutil.copyfileobj(i_f, o_f, block_size)
 
     return True
@@ -0,0 +1,144 @@
+# This document is part of pelagos-data
+# https://github.com/skytruth/pelagos-data
+
+
+# =========================================================================== #
+#
+#  The MIT License (MIT)
+#
+#  Copyright (c) 2014 SkyTruth
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# =========================================================================== #
+
+
+"""
+Unittests for bin/distraster.py
+"""
+
+
+from __future__ import unicode_literals
+
+import imp
+import json
+import math
+import os
+from os.path import abspath, dirname
+import shutil
+import tempfile
+import unittest
+
+try:
+    from osgeo import gdal
+except ImportError:
+    try:
+        import gdal
+    except ImportError:
+        gdal = None
+
+if gdal is not None:
+    distraster = imp.load_source(
+        str('distraster'), os.path.join(dirname(dirname(dirname(abspath(__file__)))), 'bin', 'distraster.py'))
+
+
+@unittest.skipIf(gdal is None, "GDAL is not installed")
+class TestTiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_vector(self, name, geometries, crs='EPSG:3857'):
+        path = os.path.join(self.tmpdir, name + '.geojson')
+        with open(path, 'w') as f:
+            json.dump({
+                'type': 'FeatureCollection',
+                'crs': {'type': 'name', 'properties': {'name': crs}},
+                'features': [{'type': 'Feature', 'properties': {}, 'geometry': g} for g in geometries]}, f)
+        return path
+
+    def _distraster(self, vector, raster, *args):
+        # Positional arguments go first so they aren't taken as more -ovr levels
+        args = [vector, raster, '-tr', '100', '100', '-md', '750'] + list(args)
+        self.assertEqual(0, distraster.main([str(a) for a in args]))
+
+    def _read(self, raster, overview=None):
+        ds = gdal.Open(str(raster))
+        band = ds.GetRasterBand(1)
+        if overview is not None:
+            band = band.GetOverview(overview)
+        values = band.ReadAsArray()
+        ds = None
+        return values
+
+    def _features(self):
+        # Points and a line spread over a 9600 x 8000 meter extent, some within the max distance of a tile edge
+        points = [(0, 0), (9600, 8000), (2790, 2810), (2805, 3390), (4450, 1200), (7190, 5590), (300, 7600)]
+        line = {'type': 'LineString', 'coordinates': [[1000, 5000], [6500, 6100], [9000, 2600]]}
+        return [{'type': 'Point', 'coordinates': list(p)} for p in points] + [line]
+
+    def test_tiled_matches_untiled(self):
+        vector = self._write_vector('features', self._features())
+        self._distraster(vector, os.path.join(self.tmpdir, 'untiled.tif'))
+        expected = self._read(os.path.join(self.tmpdir, 'untiled.tif'))
+        self.assertEqual((80, 96), expected.shape)
+        self.assertGreater(len(set(expected.ravel().tolist())), 2)
+
+        # Tiles that don't divide the raster evenly, computed in one process and in several
+        for name, args in (('tiled.tif', ['-ts', '28']), ('parallel.tif', ['-ts', '28', '-j', '2'])):
+            self._distraster(vector, os.path.join(self.tmpdir, name), *args)
+            self.assertTrue((expected == self._read(os.path.join(self.tmpdir, name))).all(), name)
+
+    def test_parallel_overviews_match_gdal(self):
+        vector = self._write_vector('features', self._features())
+        serial = os.path.join(self.tmpdir, 'serial.tif')
+        parallel = os.path.join(self.tmpdir, 'parallel.tif')
+        self._distraster(vector, serial, '-ovr', '2', '3', '4')
+        self._distraster(vector, parallel, '-ts', '28', '-j', '2', '-ovr', '2', '3', '4')
+        for overview in range(3):
+            self.assertTrue((self._read(serial, overview) == self._read(parallel, overview)).all(), overview)
+
+    def test_update_matches_rebuild(self):
+        features = self._features()
+        removed = features.pop(3)
+        added = {'type': 'Point', 'coordinates': [8150, 7050]}
+        original = self._write_vector('original', features)
+        updated = self._write_vector('updated', features + [added])
+
+        # The diff vector is in geographic coordinates and has to be reprojected to find the affected tiles
+        def to_lonlat(geometry):
+            x, y = geometry['coordinates']
+            return {'type': 'Point', 'coordinates': [math.degrees(x / 6378137.0),
+                                                     math.degrees(2 * math.atan(math.exp(y / 6378137.0)) - math.pi / 2)]}
+        diff = self._write_vector('diff', [to_lonlat(removed), to_lonlat(added)], crs='EPSG:4326')
+
+        # The update has to change something
+        output = os.path.join(self.tmpdir, 'output.tif')
+        expected = os.path.join(self.tmpdir, 'expected.tif')
+        self._distraster(original, output, '-ts', '28', '-ovr', '2', '4')
+        self._distraster(updated, expected, '-ts', '28', '-ovr', '2', '4')
+        self.assertFalse((self._read(output) == self._read(expected)).all())
+
+        self._distraster(updated, output, '-ts', '28', '-j', '2', '-u', diff)
+        self.assertTrue((self._read(expected) == self._read(output)).all())
+        for overview in range(2):
+            self.assertTrue((self._read(expected, overview) == self._read(output, overview)).all(), overview)
@@ -0,0 +1,169 @@
+# This document is part of pelagos-data
+# https://github.com/skytruth/pelagos-data
+
+
+# =========================================================================== #
+#
+#  The MIT License (MIT)
+#
+#  Copyright (c) 2014 SkyTruth
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# =========================================================================== #
+
+
+"""
+Unittests for pelagos_processing.cmdl.gridify
+"""
+
+
+from __future__ import unicode_literals
+
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from osgeo import ogr
+except ImportError:
+    ogr = None
+
+if ogr is not None:
+    from pelagos_processing.cmdl import gridify
+    from pelagos_processing.cmdl import components
+
+
+class Interrupted(Exception):
+    pass
+
+
+@unittest.skipIf(ogr is None, "GDAL/OGR is not installed")
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.grid_file = os.path.join(self.tmpdir, 'grid.shp')
+        self.region_file = os.path.join(self.tmpdir, 'regions.shp')
+
+        # 8x8 grid of unit cells
+        cells = []
+        for x in range(8):
+            for y in range(8):
+                cells.append(('POLYGON ((%s %s, %s %s, %s %s, %s %s, %s %s))'
+                              % (x, y, x + 1, y, x + 1, y + 1, x, y + 1, x, y), x * 8 + y))
+        self._create_layer(self.grid_file, 'cell', cells)
+
+        # Regions covering a varying number of cells
+        regions = [('POLYGON ((0.5 0.5, 3.5 0.5, 3.5 2.5, 0.5 2.5, 0.5 0.5))', 1),
+                   ('POLYGON ((4.2 0.2, 7.8 0.2, 6 3.7, 4.2 0.2))', 2),
+                   ('POLYGON ((0.3 4.1, 2.9 4.1, 2.9 7.9, 0.3 7.9, 0.3 4.1))', 3),
+                   ('POLYGON ((3.5 3.5, 7.5 3.5, 7.5 7.5, 3.5 7.5, 3.5 3.5))', 4),
+                   ('POLYGON ((5.1 5.1, 5.9 5.1, 5.9 5.9, 5.1 5.9, 5.1 5.1))', 5)]
+        self._create_layer(self.region_file, 'region', regions)
+
+        self.sync_interval = gridify.PROGRESS_SYNC_INTERVAL
+        self.verbose = components.VERBOSE_MODE
+        self.create_feature = ogr.Layer.CreateFeature
+
+    def tearDown(self):
+        gridify.PROGRESS_SYNC_INTERVAL = self.sync_interval
+        components.VERBOSE_MODE = self.verbose
+        ogr.Layer.CreateFeature = self.create_feature
+        shutil.rmtree(self.tmpdir)
+
+    def _create_layer(self, path, field, features):
+        ds = ogr.GetDriverByName(str('ESRI Shapefile')).CreateDataSource(str(path))
+        layer = ds.CreateLayer(str(os.path.splitext(os.path.basename(path))[0]), geom_type=ogr.wkbPolygon)
+        layer.CreateField(ogr.FieldDefn(str(field), ogr.OFTInteger))
+        for wkt, value in features:
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetField(str(field), value)
+            feature.SetGeometry(ogr.CreateGeometryFromWkt(str(wkt)))
+            layer.CreateFeature(feature)
+        ds = None
+
+    def _gridify(self, output_file, *args):
+        return gridify.main([str(a) for a in ['-q', '-g', self.grid_file, '-r', self.region_file,
+                                              '-o', output_file] + list(args)])
+
+    def _gridify_interrupted(self, output_file, num_features, *args):
+
+        # Fail once num_features output features have been written, leaving a region feature half done
+        count = [0]
+        create_feature = self.create_feature
+
+        def interrupting_create_feature(layer, feature):
+            if layer.GetName() != 'mem_grids':
+                if count[0] == num_features:
+                    raise Interrupted()
+                count[0] += 1
+            return create_feature(layer, feature)
+
+        ogr.Layer.CreateFeature = interrupting_create_feature
+        try:
+            self.assertRaises(Interrupted, self._gridify, output_file, *args)
+        finally:
+            ogr.Layer.CreateFeature = create_feature
+        gc.collect()
+
+    def _read_output(self, output_file):
+        ds = ogr.Open(str(output_file))
+        layer = ds.GetLayerByName(str('regions-grid'))
+        features = [(feature.GetFID(), feature.GetField(str('region')), feature.GetGeometryRef().ExportToWkt())
+                    for feature in layer]
+        ds = None
+        return features
+
+    def test_resume_after_two_interruptions(self):
+        gridify.PROGRESS_SYNC_INTERVAL = 0
+
+        expected_file = os.path.join(self.tmpdir, 'expected')
+        self.assertEqual(0, self._gridify(expected_file))
+        expected = self._read_output(expected_file)
+        self.assertGreater(len(expected), 20)
+
+        output_file = os.path.join(self.tmpdir, 'output')
+        self._gridify_interrupted(output_file, 7)
+        self.assertTrue(os.path.getsize(output_file + '.progress') > 0)
+        self._gridify_interrupted(output_file, 9, '-resume')
+        self.assertEqual(0, self._gridify(output_file, '-resume'))
+        actual = self._read_output(output_file)
+
+        # Features from half finished region features are neither duplicated nor left behind as deleted records
+        self.assertEqual(range(len(actual)), [fid for fid, region, wkt in actual])
+        self.assertEqual(sorted((region, wkt) for fid, region, wkt in expected),
+                         sorted((region, wkt) for fid, region, wkt in actual))
+
+    def test_resume_without_recorded_progress(self):
+
+        # Nothing is recorded before the sync interval has passed, so resuming starts over
+        gridify.PROGRESS_SYNC_INTERVAL = 3600
+
+        expected_file = os.path.join(self.tmpdir, 'expected')
+        self.assertEqual(0, self._gridify(expected_file))
+
+        output_file = os.path.join(self.tmpdir, 'output')
+        self._gridify_interrupted(output_file, 12)
+        self.assertEqual(0, os.path.getsize(output_file + '.progress'))
+        self.assertEqual(0, self._gridify(output_file, '-resume'))
+        self.assertEqual(sorted((region, wkt) for fid, region, wkt in self._read_output(expected_file)),
+                         sorted((region, wkt) for fid, region, wkt in self._read_output(output_file)))
@@ -0,0 +1,202 @@
+# This document is part of pelagos-data
+# https://github.com/skytruth/pelagos-data
+
+
+# =========================================================================== #
+#
+#  The MIT License (MIT)
+#
+#  Copyright (c) 2014 SkyTruth
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# =========================================================================== #
+
+
+"""
+Unittests for loadmeasures.py
+"""
+
+
+
+from __future__ import unicode_literals
+
+import imp
+import os
+from os.path import abspath, dirname
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+loadmeasures = imp.load_source(
+    str('loadmeasures'), os.path.join(dirname(dirname(dirname(abspath(__file__)))), 'loadmeasures.py'))
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'measures.csv')
+        # A whole second so the mtime can be restored exactly
+        self.mtime = 1400000000
+        self._write(['mmsi,timestamp,speed', '3,100,1.5', '1,200,', '2,300,7.25'], self.mtime)
+        self.parse = loadmeasures.parse
+
+    def tearDown(self):
+        loadmeasures.parse = self.parse
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, lines, mtime=None):
+        with open(self.filename, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        if mtime is not None:
+            os.utime(self.filename, (mtime, mtime))
+
+    def _fail_parse(self, *args, **kwargs):
+        raise AssertionError("Parsed instead of loading the cache")
+
+    def test_cache_hit_matches_uncached(self):
+        expected = loadmeasures.load(self.filename, cache=False)
+        self.assertEqual(['mmsi', 'timestamp', 'speed'], expected.cols)
+        self.assertEqual([3, 1, 2], expected.mmsi.tolist())
+        self.assertTrue(numpy.isnan(expected.speed[1]))
+
+        loadmeasures.load(self.filename)
+        self.assertTrue(all(os.path.exists(path) for path in loadmeasures.cache_paths(self.filename)))
+        loadmeasures.parse = self._fail_parse
+        cached = loadmeasures.load(self.filename)
+        self.assertIsInstance(cached.arr, numpy.memmap)
+        self.assertEqual(expected.cols, cached.cols)
+        self.assertEqual(expected.categories, cached.categories)
+        numpy.testing.assert_array_equal(expected.arr, cached.arr)
+
+    def test_size_change_invalidates(self):
+        loadmeasures.load(self.filename)
+        self._write(['mmsi,timestamp,speed', '3,100,1.5', '1,200,', '2,300,7.25', '2,400,8'], self.mtime)
+        self.assertEqual([100, 200, 300, 400], loadmeasures.load(self.filename).timestamp.tolist())
+
+    def test_mtime_change_invalidates(self):
+        loadmeasures.load(self.filename)
+        self._write(['mmsi,timestamp,speed', '3,100,1.5', '1,200,', '2,300,9.25'], self.mtime + 10)
+        self.assertEqual(9.25, loadmeasures.load(self.filename).speed[2])
+
+    def test_mmsi_categories(self):
+        self._write(['mmsi,timestamp', 'b,100', '7,200', 'a,300', 'b,400'])
+        for cache in (False, True, True):
+            loaded = loadmeasures.load(self.filename, cache=cache)
+            self.assertEqual(['7', 'a', 'b'], loaded.categories['mmsi'])
+            self.assertEqual([2, 0, 1, 2], loaded.mmsi.tolist())
+
+    def test_writes_never_reach_the_cache(self):
+        arrpath = loadmeasures.cache_paths(self.filename)[0]
+        for i in range(2):
+            loaded = loadmeasures.load(self.filename)
+            loaded.speed[:] = -1
+            loaded.arr.flush()
+            self.assertEqual([1.5, 7.25], numpy.load(arrpath)[2, [0, 2]].tolist())
+        loadmeasures.parse = self._fail_parse
+        self.assertEqual(1.5, loadmeasures.load(self.filename).speed[0])
+
+    def test_unwritable_cache_dir(self):
+        # A file where the cache directory should be
+        blocker = os.path.join(self.tmpdir, 'blocker')
+        with open(blocker, 'w') as f:
+            f.write('')
+        loaded = loadmeasures.load(self.filename, cache_dir=os.path.join(blocker, 'cache'))
+        self.assertNotIsInstance(loaded.arr, numpy.memmap)
+        numpy.testing.assert_array_equal(loadmeasures.load(self.filename, cache=False).arr, loaded.arr)
+        self.assertEqual([], [name for name in os.listdir(self.tmpdir) if name not in ('measures.csv', 'blocker')])
+
+
+class TestNamedArray(unittest.TestCase):
+
+    def _array(self, mmsi, timestamp=None, categories=None):
+        if timestamp is None:
+            timestamp = range(len(mmsi))
+        return loadmeasures.namedArray(['mmsi', 'timestamp'], numpy.array([mmsi, timestamp], dtype=numpy.float64),
+                                       categories)
+
+    def _assertView(self, view, arr):
+        self.assertTrue(numpy.shares_memory(view.arr, arr.arr))
+
+    def test_columns_and_rows_are_views(self):
+        arr = self._array([1, 1, 2, 2, 3], [10, 20, 30, 40, 50])
+        self.assertTrue(numpy.shares_memory(arr.timestamp, arr.arr))
+        rows = arr.rows(1, 3)
+        self._assertView(rows, arr)
+        self.assertEqual([20, 30], rows.timestamp.tolist())
+        self.assertEqual(2, len(rows))
+        self.assertEqual([40, 50], arr.rows(3).timestamp.tolist())
+        self._assertView(arr[:, ::2], arr)
+
+    def test_runs(self):
+        arr = self._array([1] * 7)
+        for mask, expected in (([1, 1, 0, 1, 0, 0, 1], [[0, 1], [3], [6]]),
+                               ([0, 1, 1, 0, 0, 1, 0], [[1, 2], [5]]),
+                               ([1] * 7, [range(7)]),
+                               ([0] * 7, [])):
+            runs = arr.runs(numpy.array(mask, dtype=bool))
+            self.assertEqual(expected, [run.timestamp.tolist() for run in runs], mask)
+            for run in runs:
+                self._assertView(run, arr)
+
+    def test_between(self):
+        arr = self._array([1] * 6, [10, 20, 20, 30, 40, 40])
+        for low, high, expected in ((20, 30, [20, 20]),
+                                    (10, 40, [10, 20, 20, 30]),
+                                    (40, 41, [40, 40]),
+                                    (0, 10, []),
+                                    (41, 50, [])):
+            self.assertEqual(expected, arr.between('timestamp', low, high).timestamp.tolist(), (low, high))
+        self._assertView(arr.between('timestamp', 20, 40), arr)
+
+    def test_groupby_grouped(self):
+        arr = self._array([5, 5, 2, 9, 9, 9])
+        groups = arr.groupby('mmsi')
+        self.assertEqual([5, 2, 9], [value for value, group in groups])
+        self.assertEqual([[0, 1], [2], [3, 4, 5]], [group.timestamp.tolist() for value, group in groups])
+        for value, group in groups:
+            self._assertView(group, arr)
+
+    def test_groupby_unsorted(self):
+        arr = self._array([2, 1, 2, 3, 1, 2])
+        groups = arr.groupby('mmsi')
+        self.assertEqual([1, 2, 3], [value for value, group in groups])
+        # Rows keep their order within each group
+        self.assertEqual([[1, 4], [0, 2, 5], [3]], [group.timestamp.tolist() for value, group in groups])
+
+        # Every group is a view of one sorted copy
+        base = groups[0][1].arr.base
+        for value, group in groups:
+            self.assertFalse(numpy.shares_memory(group.arr, arr.arr))
+            self.assertIs(base, group.arr.base)
+
+        # Long enough for an unstable sort to reorder rows
+        mmsi = numpy.random.RandomState(0).randint(0, 3, 200)
+        for value, group in self._array(mmsi).groupby('mmsi'):
+            self.assertEqual(numpy.nonzero(mmsi == value)[0].tolist(), group.timestamp.tolist())
+
+    def test_vessels(self):
+        self.assertEqual([(5, [0, 1]), (2, [2]), (9, [3])],
+                         [(mmsi, group.timestamp.tolist()) for mmsi, group in self._array([5, 5, 2, 9]).vessels()])
+        arr = self._array([1, 0, 1, 2], categories={'mmsi': ['a', 'b', 'c']})
+        self.assertEqual([('a', [1]), ('b', [0, 2]), ('c', [3])],
+                         [(mmsi, group.timestamp.tolist()) for mmsi, group in arr.vessels()])
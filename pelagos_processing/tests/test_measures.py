@@ -0,0 +1,113 @@
+# This document is part of pelagos-data
+# https://github.com/skytruth/pelagos-data
+
+
+# =========================================================================== #
+#
+#  The MIT License (MIT)
+#
+#  Copyright (c) 2014 SkyTruth
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# =========================================================================== #
+
+
+"""
+Unittests for pelagos_processing.measures
+"""
+
+
+from __future__ import unicode_literals
+
+import unittest
+
+import numpy
+
+from pelagos_processing import measures
+
+
+class TestPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        self.registry = {}
+
+        def record(name, func):
+            def wrapped(*args, **kwargs):
+                self.calls.append((name, kwargs.get('window')))
+                return func(*args, **kwargs)
+            return wrapped
+
+        measures.register('double', ['x'], registry=self.registry)(record('double', lambda x: x * 2))
+        measures.register('windowed', ['double'], windowed=True, registry=self.registry)(
+            record('windowed', lambda double, window: double + window))
+        measures.register('both', ['double', 'windowed'], windowed=True, registry=self.registry)(
+            record('both', lambda double, windowed, window: double * windowed))
+        measures.register('unused', ['x'], registry=self.registry)(record('unused', lambda x: x))
+
+    def test_shared_intermediates(self):
+        plan = measures.Plan(['both', 'windowed'], [10, 20], registry=self.registry)
+        result = plan.evaluate({'x': numpy.array([1.0, 2.0])})
+        self.assertEqual([('both', 10), ('both', 20), ('windowed', 10), ('windowed', 20)], sorted(result))
+        self.assertEqual([2.0 * 12, 4.0 * 14], result[('both', 10)].tolist())
+        self.assertEqual([22.0, 24.0], result[('windowed', 20)].tolist())
+        self.assertEqual(1, self.calls.count(('double', None)))
+        self.assertEqual(2, len([c for c in self.calls if c[0] == 'windowed']))
+        self.assertNotIn('unused', [c[0] for c in self.calls])
+        self.assertEqual(['x'], plan.columns)
+
+    def test_exceptions(self):
+        self.assertRaises(ValueError, measures.Plan, ['missing'], [10], registry=self.registry)
+        self.assertRaises(ValueError, measures.Plan, ['windowed'], [], registry=self.registry)
+        self.assertRaises(ValueError, measures.register('double', registry=self.registry), lambda x: x)
+        measures.register('a', ['b'], registry=self.registry)(lambda b: b)
+        measures.register('b', ['a'], registry=self.registry)(lambda a: a)
+        self.assertRaises(ValueError, measures.Plan, ['a'], registry=self.registry)
+        measures.register('c', ['windowed'], registry=self.registry)(lambda w: w)
+        self.assertRaises(ValueError, measures.Plan, ['c'], [10], registry=self.registry)
+
+
+class TestStandardMeasures(unittest.TestCase):
+
+    def test_window_stats(self):
+        timestamps = numpy.array([0.0, 10.0, 20.0, 35.0, 36.0, 100.0])
+        sog = numpy.array([0.5, 0.25, 1.0, 0.0, 0.75, 0.5])
+        latitude = 40 + numpy.array([0.0, 0.001, 0.003, 0.002, 0.004, 0.01])
+        longitude = -10 - numpy.array([0.0, 0.002, 0.001, 0.004, 0.003, 0.01])
+        columns = {'timestamp': timestamps, 'sog': sog, 'latitude': latitude, 'longitude': longitude}
+        plan = measures.Plan(['timestamp_diff', 'sogavg', 'sogstddev', 'pos'], [20])
+        result = plan.evaluate(columns)
+
+        self.assertEqual([0, 10, 10, 15, 1, 64], result[('timestamp_diff', None)].tolist())
+        for i in range(len(timestamps)):
+            in_window = (timestamps <= timestamps[i]) & (timestamps >= timestamps[i] - 20)
+            self.assertAlmostEqual(sog[in_window].mean(), result[('sogavg', 20)][i])
+            self.assertAlmostEqual(sog[in_window].std(), result[('sogstddev', 20)][i])
+            expected = min(1.0, numpy.sqrt(latitude[in_window].var() + longitude[in_window].var()) * 60 / (20 / 3600.0) / 17)
+            self.assertAlmostEqual(expected, result[('pos', 20)][i])
+
+    def test_step_distance(self):
+        columns = {'longitude': numpy.array([0.0, 0.0, 1.0]), 'latitude': numpy.array([0.0, 1.0, 1.0]),
+                   'timestamp': numpy.array([0.0, 3600.0, 3600.0])}
+        result = measures.Plan(['step_distance', 'step_speed']).evaluate(columns)
+        self.assertAlmostEqual(0.0, result[('step_distance', None)][0])
+        self.assertAlmostEqual(60.04, result[('step_distance', None)][1], places=2)
+        self.assertAlmostEqual(60.04, result[('step_speed', None)][1], places=2)
+        self.assertEqual(0.0, result[('step_speed', None)][2])
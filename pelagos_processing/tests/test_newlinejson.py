@@ -0,0 +1,144 @@
+# This document is part of pelagos-data
+# https://github.com/skytruth/pelagos-data
+
+
+# =========================================================================== #
+#
+#  The MIT License (MIT)
+#
+#  Copyright (c) 2014 SkyTruth
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# =========================================================================== #
+
+
+"""
+Unittests for pelagos_processing.newlinejson
+"""
+
+
+from __future__ import unicode_literals
+
+from StringIO import StringIO
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from pelagos_processing import newlinejson
+
+
+class TestNewlineJSONReader(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [{'mmsi': i % 3, 'timestamp': 1000 + i, 'name': 'vessel-%s' % i} for i in range(25)]
+        self.text = '\n'.join(json.dumps(row) for row in self.rows) + '\n'
+
+    def test_rows(self):
+        for block_size in (1, 7, 64, 4096):
+            reader = newlinejson.NewlineJSONReader(StringIO(self.text), block_size=block_size)
+            self.assertEqual(sorted(self.rows[0].keys()), sorted(reader.fieldnames))
+            self.assertEqual(self.rows, list(reader))
+
+    def test_chunks(self):
+        reader = newlinejson.NewlineJSONReader(StringIO(self.text), block_size=100)
+        chunks = list(reader.iter_chunks())
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(self.rows, [row for chunk in chunks for row in chunk])
+
+    def test_mixed_iteration(self):
+        reader = newlinejson.NewlineJSONReader(StringIO(self.text), block_size=100)
+        first = next(reader)
+        self.assertEqual(self.rows, [first] + [row for chunk in reader.iter_chunks() for row in chunk])
+
+    def test_blank_lines_and_missing_trailing_newline(self):
+        text = '\n\n' + self.text.replace('\n', '\r\n\n').rstrip()
+        reader = newlinejson.NewlineJSONReader(StringIO(text), block_size=50)
+        self.assertEqual(self.rows, list(reader))
+
+    def test_columns(self):
+        reader = newlinejson.NewlineJSONReader(StringIO(self.text), block_size=200)
+        mmsi = []
+        names = []
+        for columns in reader.iter_columns(fields=['mmsi', 'name'], dtypes={'mmsi': numpy.int64}):
+            self.assertIsInstance(columns['mmsi'], numpy.ndarray)
+            mmsi += columns['mmsi'].tolist()
+            names += columns['name']
+        self.assertEqual([row['mmsi'] for row in self.rows], mmsi)
+        self.assertEqual([row['name'] for row in self.rows], names)
+
+    def test_empty(self):
+        reader = newlinejson.NewlineJSONReader(StringIO(''))
+        self.assertIsNone(reader.fieldnames)
+        self.assertEqual([], list(reader))
+
+    def test_utf8_file(self):
+        rows = [{'name': 'caf\xe9', 'mmsi': 1}, {'name': '\u6f01\u8239', 'mmsi': 2}] * 20
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'rows.json')
+            with open(path, 'wb') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False).encode('utf-8') + b'\n')
+            for block_size in (1, 5, 64, 4096):
+                with open(path, 'rb') as f:
+                    self.assertEqual(rows, list(newlinejson.NewlineJSONReader(f, block_size=block_size)))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_delimiter(self):
+        text = self.text.replace('\n', '|')
+        for delimiter in ('|', b'|'):
+            reader = newlinejson.NewlineJSONReader(StringIO(text), delimiter=delimiter, block_size=30)
+            self.assertEqual(self.rows, list(reader))
+
+    def test_one_value_per_line(self):
+        self.assertRaises(ValueError, newlinejson.decode_lines, '1, 2\n3\n')
+        self.assertRaises(ValueError, list, newlinejson.NewlineJSONReader(StringIO('{"a": 1}, {"a": 2}\n'),
+                                                                          fieldnames=['a']))
+        self.assertEqual([1, [2, 3]], newlinejson.decode_lines('1\n\n[2, 3]\n'))
+
+    def test_exceptions(self):
+        self.assertRaises(ValueError, newlinejson.NewlineJSONReader, StringIO('{"a": 1}\n{"a": \n'))
+        self.assertRaises(ValueError, newlinejson.NewlineJSONReader, StringIO(self.text), block_size=0)
+
+
+class TestNewlineJSONWriter(unittest.TestCase):
+
+    def test_roundtrip(self):
+        rows = [{'mmsi': i, 'timestamp': i * 10, 'extra': 'x'} for i in range(12)]
+        f = StringIO()
+        writer = newlinejson.NewlineJSONWriter(f, fieldnames=['mmsi', 'timestamp'], delimiter='\n', buffer_size=5)
+        writer.writerows(rows)
+        writer.flush()
+        f.seek(0)
+        expected = [{'mmsi': row['mmsi'], 'timestamp': row['timestamp']} for row in rows]
+        self.assertEqual(expected, list(newlinejson.NewlineJSONReader(f)))
+
+    def test_sort_keys(self):
+        f = StringIO()
+        writer = newlinejson.NewlineJSONWriter(f, delimiter='\n', sort_keys=True)
+        writer.writerow({'b': 2, 'a': 1})
+        self.assertEqual('', f.getvalue())
+        writer.flush()
+        self.assertEqual('{"a": 1, "b": 2}\n', f.getvalue())
@@ -36,9 +36,13 @@ Unittests for pelagos_processing.raw
 
 from __future__ import unicode_literals
 
+import gzip
 import os
 from os.path import isfile
+import shutil
+import tempfile
 import unittest
+import zipfile
 
 from pelagos_processing import raw
 from pelagos_processing.tests import testdata
@@ -94,8 +98,168 @@ class TestCatFiles(unittest.TestCase):
             actual = f.read()
         self.assertEqual(expected, actual)
 
+    def test_small_blocks(self):
+
+        skip = 1
+        expected = ''
+        for ifile in self.input_files:
+            with open(ifile) as f:
+                expected += ''.join(f.readlines()[skip:])
+
+        self.assertTrue(raw.cat_files(self.input_files, self.test_file, schema=None, skip_lines=skip, block_size=4))
+        with open(self.test_file) as f:
+            actual = f.read()
+        self.assertEqual(expected, actual)
+
+    def test_skip_empty(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            ifile = os.path.join(tmp_dir, 'empty.csv')
+            with open(ifile, 'w') as f:
+                f.write('1,A' + os.linesep + os.linesep + '2,B' + os.linesep + os.linesep)
+
+            self.assertTrue(raw.cat_files([ifile], self.test_file, schema=None, skip_empty=True))
+            with open(self.test_file) as f:
+                self.assertEqual('1,A' + os.linesep + '2,B' + os.linesep, f.read())
+
+            self.assertTrue(raw.cat_files([ifile], self.test_file, schema=None, skip_empty=False))
+            with open(self.test_file) as f:
+                self.assertEqual('1,A' + os.linesep + os.linesep + '2,B' + os.linesep + os.linesep, f.read())
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_compressed(self):
+
+        schema = 'uid,val'
+        expected = schema + os.linesep
+        for ifile in self.input_files:
+            with open(ifile) as f:
+                expected += ''.join(f.readlines()[1:])
+
+        # The first two inputs are members of a zip archive and the rest are gzipped
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            zip_file = os.path.join(tmp_dir, 'inputs.zip')
+            with zipfile.ZipFile(zip_file, 'w') as archive:
+                for ifile in self.input_files[:2]:
+                    archive.write(ifile, os.path.basename(ifile))
+            input_files = [zip_file]
+            for ifile in self.input_files[2:]:
+                gz_file = os.path.join(tmp_dir, os.path.basename(ifile) + '.gz')
+                with open(ifile, 'rb') as i_f, gzip.open(gz_file, 'wb') as o_f:
+                    o_f.write(i_f.read())
+                input_files.append(gz_file)
+
+            self.assertTrue(raw.cat_files(input_files, self.test_file, schema=schema, skip_lines=1, compress=True))
+            with gzip.open(self.test_file) as f:
+                actual = f.read()
+            self.assertEqual(expected, actual)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_merge(self):
+
+        schema = 'uid,val'
+        lines = []
+        for ifile in self.input_files:
+            with open(ifile) as f:
+                lines.extend(f.readlines()[1:])
+        expected = schema + os.linesep + ''.join(sorted(lines, key=lambda l: int(l.split(',')[0])))
+
+        self.assertTrue(raw.cat_files(self.input_files, self.test_file, schema=schema, skip_lines=1,
+                                      merge_key=('uid',), block_size=8))
+        with open(self.test_file) as f:
+            actual = f.read()
+        self.assertEqual(expected, actual)
+
+    def test_merge_key(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # Two days of rows sorted by mmsi and then timestamp, one of them in a zip with a third day
+            days = [
+                ['1,0,0,100', '1,0,0,200', '22,0,0,50', '3000,0,0,10'],
+                ['1,0,0,150', '3000,0,0,5', '3000,0,0,20'],
+                ['22,0,0,50', '22,0,0,60']
+            ]
+            input_files = []
+            for idx, rows in enumerate(days):
+                ifile = os.path.join(tmp_dir, 'day%s.csv' % idx)
+                with open(ifile, 'w') as f:
+                    f.write(os.linesep.join(['mmsi,longitude,latitude,timestamp'] + rows))
+                input_files.append(ifile)
+            zip_file = os.path.join(tmp_dir, 'days.zip')
+            with zipfile.ZipFile(zip_file, 'w') as archive:
+                for ifile in input_files[1:]:
+                    archive.write(ifile, os.path.basename(ifile))
+            input_files = [input_files[0], zip_file]
+
+            schema = 'mmsi,longitude,latitude,timestamp'
+            expected = os.linesep.join([schema, '1,0,0,100', '1,0,0,150', '1,0,0,200', '22,0,0,50', '22,0,0,50',
+                                        '22,0,0,60', '3000,0,0,5', '3000,0,0,10', '3000,0,0,20']) + os.linesep
+            self.assertTrue(raw.cat_files(input_files, self.test_file, schema=schema, skip_lines=1,
+                                          merge_key=raw.MERGE_KEY))
+            with open(self.test_file) as f:
+                actual = f.read()
+            self.assertEqual(expected, actual)
+
+            self.assertRaises(ValueError, raw.cat_files, *[input_files[:1], self.test_file],
+                              **{'schema': schema, 'skip_lines': 1, 'merge_key': ('timestamp',)})
+            self.assertRaises(ValueError, raw.cat_files, *[input_files, self.test_file],
+                              **{'schema': schema, 'merge_key': ('nope',)})
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_merge_passes(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # Seven streams with repeated keys, three of them in a zip, merged two at a time
+            input_files = []
+            for idx in range(4):
+                ifile = os.path.join(tmp_dir, 'in%s.csv' % idx)
+                with open(ifile, 'w') as f:
+                    f.write(os.linesep.join(['uid,val'] + ['%s,%s' % (uid, idx) for uid in range(idx, 12, 2)]))
+                input_files.append(ifile)
+            zip_file = os.path.join(tmp_dir, 'in.zip')
+            with zipfile.ZipFile(zip_file, 'w') as archive:
+                for idx in range(4, 7):
+                    archive.writestr('in%s.csv' % idx, os.linesep.join(
+                        ['uid,val'] + ['%s,%s' % (uid, idx) for uid in range(idx % 3, 12, 3)]))
+            input_files.append(zip_file)
+            self.assertEqual(7, sum(len(raw.input_members(ifile)) for ifile in input_files))
+
+            output_dir = os.path.join(tmp_dir, 'output')
+            os.mkdir(output_dir)
+            expected_file = os.path.join(output_dir, 'expected.csv')
+            actual_file = os.path.join(output_dir, 'actual.csv')
+            self.assertTrue(raw.cat_files(input_files, expected_file, schema='uid,val', skip_lines=1,
+                                          merge_key=('uid',)))
+            self.assertTrue(raw.cat_files(input_files, actual_file, schema='uid,val', skip_lines=1,
+                                          merge_key=('uid',), max_streams=2, block_size=16))
+            with open(expected_file) as f:
+                expected = f.read()
+            with open(actual_file) as f:
+                actual = f.read()
+            self.assertEqual(expected, actual)
+
+            # Equal keys keep the order of the inputs
+            rows = [line.split(',') for line in expected.splitlines()[1:]]
+            self.assertEqual(sorted(rows, key=lambda row: int(row[0])), rows)
+            self.assertEqual(['0', '2', '6'], [val for uid, val in rows if uid == '6'])
+
+            # No temporary files are left behind next to the target file
+            self.assertEqual(['actual.csv', 'expected.csv'], sorted(os.listdir(output_dir)))
+
+            self.assertRaises(ValueError, raw.cat_files, *[input_files, actual_file],
+                              **{'merge_key': ('uid',), 'max_streams': 1})
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_exceptions(self):
         self.assertRaises(ValueError, raw.cat_files, *[self.input_files, self.test_file], **{'skip_lines': -1})
         self.assertRaises(ValueError, raw.cat_files, *[self.input_files, self.test_file], **{'skip_lines': None})
+        self.assertRaises(ValueError, raw.cat_files, *[self.input_files, self.test_file], **{'block_size': 0})
         self.assertRaises(TypeError, raw.cat_files, *[self.input_files, self.test_file], **{'schema': 1.23})
         self.assertRaises(IOError, raw.cat_files, *[['I-DO_NOT_|EXIST'], self.test_file])
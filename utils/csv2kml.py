@@ -1,17 +1,26 @@
 #!/usr/bin/env python
 
 import logging
+import math
+import multiprocessing
 from optparse import OptionParser
+import os
 import re
 from string import Template
 import csv
 from dateutil.parser import parse as parse_date
 from datetime import datetime, timedelta, date
 import sys
-import bisect
+from operator import itemgetter
+import tempfile
+import zipfile
+from vectortile import TileBounds
    
    
 MIN_INTERVAL = 60   # minimum interval between placemarks in seconds
+MAX_ZOOM = 12       # deepest super-overlay tile level
+TILE_PLACEMARKS = 200   # most placemarks shown by one super-overlay tile before the rest move to its children
+TILE_PIXELS = 256   # on screen size of a super-overlay tile that tracks are simplified for
 
 
 time_gap_styles = [
@@ -163,6 +172,11 @@ document_kml_template = Template(
 """	)
 
 
+# The document is streamed a vessel at a time between its head and its tail
+document_head_template, document_tail_template = [
+    Template(part) for part in document_kml_template.template.split('$vessels_kml')]
+
+
 vessel_kml_template = Template(
 """<Folder>
     <name>$name</name>
@@ -180,6 +194,12 @@ $placemarks_kml
 """	 )
 
 
+# Each vessel is streamed as its head, track segments, middle, day folders and tail
+vessel_head_template, vessel_middle, vessel_tail = re.split(
+    r'\$track_kml|\$placemarks_kml', vessel_kml_template.template)
+vessel_head_template = Template(vessel_head_template)
+
+
 track_template = Template (
 """	<Placemark>
 	<name>$name</name>
@@ -230,6 +250,37 @@ placemark_template = Template(
 
 
 
+region_template = Template(
+"""<Region>
+    <LatLonAltBox><north>$north</north><south>$south</south><east>$east</east><west>$west</west></LatLonAltBox>
+    <Lod><minLodPixels>$min_lod</minLodPixels><maxLodPixels>$max_lod</maxLodPixels></Lod>
+</Region>""")
+
+
+tile_kml_template = Template(
+"""$region
+<Folder>
+    <name>Vessel Tracks</name>
+$track_region
+$track_kml
+</Folder>
+<Folder>
+    <name>AIS Points</name>
+$placemarks_kml
+</Folder>
+$links_kml
+""")
+
+
+network_link_template = Template(
+"""<NetworkLink>
+    <name>$name</name>
+$region
+    <Link><href>$href</href><viewRefreshMode>onRegion</viewRefreshMode></Link>
+</NetworkLink>""")
+
+
+
 class Vessel ():
     def __init__(self, params):
         self.mmsi = params['mmsi']  # This can't be null
@@ -243,48 +294,112 @@ class Vessel ():
         self.timestamps = []
             
     def add_ais (self, ais):
-        idx = 0
-        dt = ais['datetime']
-        if self.ais:
-            # ignore anything that is less than MIN_INTERVAL seconds away from a record we already have in the list
-            idx = bisect.bisect (self.timestamps,dt)      
-            if idx > 0 and abs((dt - self.timestamps[idx-1]).total_seconds()) < MIN_INTERVAL:
-                return
-            if idx < len(self.timestamps) and abs((dt - self.timestamps[idx]).total_seconds()) < MIN_INTERVAL:
-                return
-        self.timestamps.insert (idx, dt)
-        self.ais.insert (idx, ais)
+        # records are only appended here, sort() puts them in order once they have all been added
+        self.ais.append (ais)
+
+    def sort (self):
+        # order records by time and ignore anything that is less than MIN_INTERVAL seconds after the last record kept
+        self.ais.sort (key=itemgetter('datetime'))
+        records = []
+        last_dt = None
+        for ais in self.ais:
+            dt = ais['datetime']
+            if last_dt is None or (dt - last_dt).total_seconds() >= MIN_INTERVAL:
+                records.append (ais)
+                last_dt = dt
+        self.ais = records
+        self.timestamps = [ais['datetime'] for ais in records]
         
     
 
         
 
-def convert (infile_name, outfile_name):
-    vessels = read_csv (infile_name)
-    
-    print "Found %s vessels" % len(vessels)
-    
-    params = {'name': outfile_name}
-    params['vessels_kml'] = '\n'.join([get_vessel_kml(vessel, mmsi) for mmsi,vessel in vessels.items()])
-    document_kml = document_kml_template.substitute (params)
-    with sys.stdout if outfile_name is None or '-' == outfile_name else open(outfile_name, 'w') as kml_file:
-        kml_file.write (document_kml)    
-    
-def get_vessel_kml (vessel, mmsi):
-    params = {'name': vessel.name}
-#    params['placemarks_kml'] = '\n'.join([get_placemark_kml(ais) for ais  in vessel.ais])
-    params['placemarks_kml'] = get_placemark_folders_kml(vessel)
-    params['track_kml'] = get_track_kml (vessel)
-    return vessel_kml_template.substitute (params)
-    
+def convert (infile_name, outfile_name, grouped=False, jobs=1, super_overlay=False, max_zoom=MAX_ZOOM,
+             tile_placemarks=TILE_PLACEMARKS):
+    if grouped:
+        vessels = iter_grouped_csv (infile_name)
+    else:
+        vessels = read_csv (infile_name)
+        print "Found %s vessels" % len(vessels)
+        vessels = vessels.itervalues()
+
+    if super_overlay:
+        write_super_overlay (vessels, outfile_name, max_zoom, tile_placemarks)
+    elif outfile_name is not None and outfile_name.lower().endswith('.kmz'):
+        write_kmz (vessels, outfile_name, jobs)
+    else:
+        with sys.stdout if outfile_name is None or '-' == outfile_name else open(outfile_name, 'w') as kml_file:
+            write_kml (kml_file, outfile_name, vessels, jobs)
+
+def write_kml (kml_file, name, vessels, jobs=1):
+    """Streams the document to kml_file, so only the vessel being written is held
+    as KML.  With jobs > 1 vessels are rendered in a pool of processes and
+    written in their original order."""
+    kml_file.write (document_head_template.substitute ({'name': name}))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        vessels_kml = pool.imap (get_vessel_kml, vessels)
+    else:
+        pool = None
+        vessels_kml = (iter_vessel_kml(vessel) for vessel in vessels)
+    try:
+        for idx, vessel_kml in enumerate(vessels_kml):
+            if idx:
+                kml_file.write ('\n')
+            if isinstance(vessel_kml, basestring):
+                kml_file.write (vessel_kml)
+            else:
+                for chunk in vessel_kml:
+                    kml_file.write (chunk)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    kml_file.write (document_tail_template.substitute ({}))
+
+def write_kmz (vessels, outfile_name, jobs=1):
+    # zipfile can't stream into a member, so the KML is streamed to a temporary file next to the output first
+    fd, kml_name = tempfile.mkstemp(suffix='.kml', dir=os.path.dirname(os.path.abspath(outfile_name)))
+    try:
+        with os.fdopen(fd, 'w') as kml_file:
+            write_kml (kml_file, outfile_name, vessels, jobs)
+        with zipfile.ZipFile(outfile_name, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as kmz_file:
+            kmz_file.write (kml_name, 'doc.kml')
+    finally:
+        os.remove(kml_name)
+
+def get_vessel_kml (vessel):
+    return ''.join(iter_vessel_kml(vessel))
+
+def iter_vessel_kml (vessel):
+    """Yields a vessel's KML in pieces, one track segment or day folder at a time"""
+    yield vessel_head_template.substitute ({'name': vessel.name})
+    for chunk in iter_joined(iter_track_kml(vessel)):
+        yield chunk
+    yield vessel_middle
+    for chunk in iter_joined(iter_placemark_folders_kml(vessel)):
+        yield chunk
+    yield vessel_tail
+
+def iter_joined (chunks, separator='\n'):
+    """Yields chunks with separator between them, like separator.join(chunks) but lazily"""
+    for idx, chunk in enumerate(chunks):
+        if idx:
+            yield separator
+        yield chunk
+
 def get_placemark_folders_kml (vessel):
+    return '\n'.join(iter_placemark_folders_kml(vessel))
+
+def iter_placemark_folders_kml (vessel):
     ais_days = {}
     for ais in vessel.ais:
         d = ais['datetime'].date()
         if not ais_days.get(d):
             ais_days[d] = []
         ais_days[d].append (ais)
-    return '\n'.join([get_placemark_folder_kml(dt.strftime('%Y-%m-%d'), ais_days[dt]) for dt in sorted(ais_days.keys())])
+    for dt in sorted(ais_days.keys()):
+        yield get_placemark_folder_kml(dt.strftime('%Y-%m-%d'), ais_days[dt])
                 
 def get_placemark_folder_kml (name, records):
     params = {'name': name}
@@ -318,36 +433,235 @@ def get_track_segment_kml (records, style):
     return track_template.substitute(params)
     
 def get_track_kml (vessel):
-    kml = []
+    return '\n'.join (iter_track_kml(vessel))
+
+def iter_track_kml (vessel):
+    for records, style in iter_track_segments (vessel.ais):
+        yield get_track_segment_kml(records, style)
+
+# split time ordered records into (records, style) segments wherever the time gap style changes
+def iter_track_segments (ais_records):
     records = []
-    last_dt = vessel.timestamps[0]
+    last_dt = ais_records[0]['datetime']
     last_style = get_time_gap_style (last_dt, last_dt)
         
-    for ais in vessel.ais:
+    for ais in ais_records:
         dt = ais['datetime']
         style = get_time_gap_style (dt, last_dt)
         if style != last_style and records:
-            kml.append (get_track_segment_kml(records, last_style))
+            yield records, last_style
             records = [records[-1]]
         records.append (ais)
         last_style = style
         last_dt = dt
     
     if records:
-        kml.append (get_track_segment_kml(records, last_style))
-    
-    return '\n'.join (kml)
+        yield records, last_style
+
+# Douglas-Peucker simplification in degrees, always keeping the first and last record
+def simplify_track (records, tolerance):
+    if tolerance <= 0 or len(records) < 3:
+        return records
+    points = [(float(r['longitude']), float(r['latitude'])) for r in records]
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = points[first]
+        dx, dy = points[last][0] - x1, points[last][1] - y1
+        length = math.hypot(dx, dy)
+        max_dist, index = 0.0, None
+        for i in xrange(first + 1, last):
+            x, y = points[i]
+            if length:
+                dist = abs(dy * (x - x1) - dx * (y - y1)) / length
+            else:
+                dist = math.hypot(x - x1, y - y1)
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if index is not None and max_dist > tolerance:
+            keep[index] = True
+            stack.append ((first, index))
+            stack.append ((index, last))
+    return [r for r, k in zip(records, keep) if k]
+
+# split (records, style) track pieces into pieces that start in each tile at zoom, keyed by gridcode.  Each
+# piece keeps the record following it, if any, so the pieces still join up into one line
+def split_track_pieces (pieces, zoom):
+    tiles = {}
+    for records, style in pieces:
+        start = 0
+        for idx in xrange(1, len(records) + 1):
+            if idx == len(records) or records[idx]['gridcode'][:zoom] != records[start]['gridcode'][:zoom]:
+                if idx - start > 1 or idx < len(records):
+                    tiles.setdefault(records[start]['gridcode'][:zoom], []).append((records[start:idx + 1], style))
+                start = idx
+    return tiles
+
+# pick count records spread evenly through records, returning (picked, rest)
+def thin_records (records, count):
+    if len(records) <= count:
+        return records, []
+    picked = set(int(i * len(records) / float(count)) for i in xrange(count))
+    return ([r for i, r in enumerate(records) if i in picked],
+            [r for i, r in enumerate(records) if i not in picked])
+
+def get_region_kml (tile, min_lod=TILE_PIXELS / 2, max_lod=-1):
+    bbox = tile.get_bbox()
+    params = {'north': bbox.latmax, 'south': bbox.latmin, 'east': bbox.lonmax, 'west': bbox.lonmin,
+              'min_lod': min_lod, 'max_lod': max_lod}
+    return region_template.substitute (params)
+
+def get_tile_href (gridcode):
+    return 't%s.kml' % gridcode
+
+def iter_super_overlay_tiles (vessels, max_zoom=MAX_ZOOM, tile_placemarks=TILE_PLACEMARKS):
+    """Yields (gridcode, kml) for the tiles of a Region/NetworkLink super-overlay,
+    starting with the world tile ''.  Every tile shows at most tile_placemarks
+    placemarks spread through the ones its parents didn't show, and the tracks
+    starting in it simplified to its zoom level.  Tiles with more placemarks
+    than that link to their children, which only load once they are visible and
+    replace the parent's tracks with more detailed ones."""
+    placemarks = []
+    pieces = []
+    for vessel in vessels:
+        records = []
+        for ais in vessel.ais:
+            try:
+                ais['gridcode'] = TileBounds.from_point(
+                    lon=float(ais['longitude']), lat=float(ais['latitude']), zoom_level=max_zoom).gridcode
+            except (AssertionError, ValueError, TypeError):
+                continue
+            records.append (ais)
+        if records:
+            placemarks.extend (records)
+            pieces.extend (iter_track_segments(records))
+
+    # Depth first, so only the tiles along one branch are held at once
+    stack = [('', placemarks, pieces)]
+    while stack:
+        gridcode, placemarks, pieces = stack.pop()
+        tile = TileBounds(gridcode)
+        zoom = tile.zoom_level
+        leaf = zoom >= max_zoom or len(placemarks) <= tile_placemarks
+        if leaf:
+            shown, rest = placemarks, []
+            tolerance = 0
+        else:
+            shown, rest = thin_records (placemarks, tile_placemarks)
+            tolerance = tile.get_bbox().width / TILE_PIXELS
+
+        children = []
+        if not leaf:
+            child_placemarks = {}
+            for ais in rest:
+                child_placemarks.setdefault(ais['gridcode'][:zoom + 1], []).append (ais)
+            child_pieces = split_track_pieces (pieces, zoom + 1)
+            for child in tile.get_children():
+                if child.gridcode in child_placemarks or child.gridcode in child_pieces:
+                    children.append ((child.gridcode, child_placemarks.get(child.gridcode, []),
+                                      child_pieces.get(child.gridcode, [])))
+
+        params = {'region': get_region_kml (tile)}
+        # A parent's tracks are hidden once its children are big enough to show their own
+        params['track_region'] = get_region_kml (tile, max_lod=-1 if leaf else TILE_PIXELS)
+        params['track_kml'] = '\n'.join([get_track_segment_kml(simplify_track(records, tolerance), style)
+                                         for records, style in pieces])
+        params['placemarks_kml'] = '\n'.join([get_placemark_kml(ais) for ais in shown])
+        params['links_kml'] = '\n'.join([network_link_template.substitute (
+            {'name': child_gridcode, 'region': get_region_kml (TileBounds(child_gridcode)),
+             'href': get_tile_href (child_gridcode)}) for child_gridcode, _, _ in children])
+        kml = (document_head_template.substitute ({'name': gridcode or 'world'}) +
+               tile_kml_template.substitute (params) + document_tail_template.substitute ({}))
+        yield gridcode, kml
+
+        stack.extend (reversed(children))
+
+def write_super_overlay (vessels, outfile_name, max_zoom=MAX_ZOOM, tile_placemarks=TILE_PLACEMARKS):
+    """Writes a super-overlay to outfile_name, with its tiles in a directory next to it named after
+    it, or inside the archive if outfile_name ends in .kmz"""
+    kmz = outfile_name.lower().endswith('.kmz')
+    if kmz:
+        tiles_dir = 'tiles'
+        kmz_file = zipfile.ZipFile(outfile_name, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+    else:
+        tiles_dir = os.path.splitext(os.path.basename(outfile_name))[0] + '_tiles'
+        tiles_path = os.path.join(os.path.dirname(outfile_name), tiles_dir)
+        if not os.path.isdir(tiles_path):
+            os.makedirs(tiles_path)
+
+    def write (name, kml):
+        if kmz:
+            kmz_file.writestr (name, kml)
+        else:
+            with open(os.path.join(os.path.dirname(outfile_name), name), 'w') as kml_file:
+                kml_file.write (kml)
+
+    try:
+        root_link = network_link_template.substitute (
+            {'name': 'world', 'region': get_region_kml (TileBounds(''), min_lod=0),
+             'href': '%s/%s' % (tiles_dir, get_tile_href(''))})
+        write ('doc.kml' if kmz else os.path.basename(outfile_name),
+               document_head_template.substitute ({'name': outfile_name}) + root_link + document_tail_template.substitute ({}))
+        count = 0
+        for gridcode, kml in iter_super_overlay_tiles (vessels, max_zoom, tile_placemarks):
+            write ('%s/%s' % (tiles_dir, get_tile_href(gridcode)), kml)
+            count += 1
+        print "Wrote %s tiles" % count
+    finally:
+        if kmz:
+            kmz_file.close()
     
 # load csv file into a dict keyed by MMSI, and then by timestamp
 def read_csv (infile_name):    
     vessels = {}
-    
+    for mmsi, row in iter_csv_rows (infile_name):
+        if not vessels.get(mmsi):
+            vessels[mmsi] = Vessel (row)
+        vessels[mmsi].add_ais(row)
+    for vessel in vessels.itervalues():
+        vessel.sort()
+    return vessels
+
+# yield a Vessel each time the MMSI changes, for input with each vessel's rows together
+def iter_grouped_csv (infile_name):
+    vessel = None
+    for mmsi, row in iter_csv_rows (infile_name):
+        if vessel is None or vessel.mmsi != mmsi:
+            if vessel is not None:
+                vessel.sort()
+                yield vessel
+            vessel = Vessel (row)
+        vessel.add_ais(row)
+    if vessel is not None:
+        vessel.sort()
+        yield vessel
+
+# epoch seconds from 1973 to 2286 have 9 or 10 digits, longer digit strings are compact dates like 20140101120000
+def is_epoch_seconds (dt):
+    return dt.isdigit() and 9 <= len(dt) <= 10
+
+# parse a datetime string, or integer epoch seconds if epoch is set and dt looks like them
+def parse_datetime (dt, epoch=False):
+    if epoch and is_epoch_seconds(dt):
+        try:
+            return datetime.fromtimestamp(int(dt))
+        except ValueError:
+            pass
+    try:
+        return parse_date(dt, fuzzy=1)
+    except ValueError:
+        return datetime.fromtimestamp(int(dt))
+
+# yield (mmsi, row) for every row with an mmsi and a timestamp, with row['datetime'] parsed
+def iter_csv_rows (infile_name):
     with sys.stdin if infile_name is None or '-' == infile_name else open(infile_name, 'rb') as csvfile:
 #        dialect = csv.Sniffer().sniff(csvfile.read(1024), delimiters=',') 
 #        csvfile.seek(0)   
 #        reader = csv.DictReader(csvfile, dialect=dialect) 
         reader = csv.DictReader(csvfile) 
-        last_dt = datetime (2000,1,1)
+        epoch = None
         for row in reader:
             dt = row.get('datetime')
             if dt is None:
@@ -358,18 +672,12 @@ def read_csv (infile_name):
             row['marinetraffic_url'] = 'http://www.marinetraffic.com/ais/shipdetails.aspx?MMSI=%s'% mmsi
             row['itu_url'] = 'http://www.itu.int/cgi-bin/htsh/mars/ship_search.sh?sh_mmsi=%s' % mmsi
             if mmsi and dt:
-                if not vessels.get(mmsi):
-                    vessels[mmsi] = Vessel (row)
-                try:
-                    dt = parse_date(dt, fuzzy=1)
-                except ValueError:
-                    dt = datetime.fromtimestamp(int(dt))
-                    
-                row['datetime'] = dt
+                # the first timestamp decides whether the file holds epoch seconds, which skips dateutil for every row
+                if epoch is None:
+                    epoch = is_epoch_seconds(dt)
+                row['datetime'] = parse_datetime (dt, epoch)
                 
-                vessels[mmsi].add_ais(row)
-                    
-    return vessels
+                yield mmsi, row
         
      
 
@@ -383,7 +691,9 @@ def main ():
   INFILE 
     filename containing AIS Data in CSV format
   OUTFILE
-    output filename to get kml output
+    output filename to get kml output, written as KMZ if it ends in .kmz.
+    With --super-overlay the tiles go in OUTFILE's archive, or in a directory
+    next to it named OUTFILE_tiles
     
 """
     parser = OptionParser(description=desc, usage=usage)
@@ -395,6 +705,21 @@ def main ():
     parser.add_option("-v", "--verbose",
                           action="store_const", dest="loglevel", const=logging.DEBUG, 
                           help="Output debugging information")
+    parser.add_option("-g", "--grouped",
+                          action="store_true", dest="grouped", default=False,
+                          help="INFILE has all of each vessel's rows together, so only one vessel is held in memory at a time")
+    parser.add_option("-j", "--jobs",
+                          action="store", dest="jobs", type="int", default=1,
+                          help="Render vessels in this many processes")
+    parser.add_option("-s", "--super-overlay",
+                          action="store_true", dest="super_overlay", default=False,
+                          help="Write a Region/NetworkLink super-overlay of quadtree tiles that load as they come into view")
+    parser.add_option("--max-zoom",
+                          action="store", dest="max_zoom", type="int", default=MAX_ZOOM,
+                          help="Deepest super-overlay tile level [default: %default]")
+    parser.add_option("--tile-placemarks",
+                          action="store", dest="tile_placemarks", type="int", default=TILE_PLACEMARKS,
+                          help="Most placemarks in one super-overlay tile [default: %default]")
 
     (options, args) = parser.parse_args()
     
@@ -411,7 +736,11 @@ def main ():
     
     print '%s => %s' % (infile_name, outfile_name)
     
-    convert (infile_name, outfile_name)
+    if options.super_overlay and (outfile_name is None or '-' == outfile_name):
+        parser.error("--super-overlay needs an OUTFILE to put its tiles next to.")
+
+    convert (infile_name, outfile_name, options.grouped, options.jobs, options.super_overlay, options.max_zoom,
+             options.tile_placemarks)
     
 
 if __name__ == "__main__":
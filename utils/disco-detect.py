@@ -41,20 +41,21 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from collections import deque
 import csv
-from datetime import datetime
-import json
+import multiprocessing
 import os
 from os.path import abspath, expanduser, isfile, dirname
 import sys
 
+import numpy
+
+from pelagos_processing.newlinejson import NewlineJSONReader, NewlineJSONWriter
+
 try:
-    from osgeo import ogr
     from osgeo import osr
 except ImportError:
-    import ogr
     import osr
-ogr.UseExceptions()
 osr.UseExceptions()
 
 
@@ -84,7 +85,8 @@ def print_usage():
 
     print("""
 {0} [-q] [-tt seconds] [-dt distance] [-s schema] [-wm w|a]
-{1} [-op csv|csv-no-schema|newline|frequency] [-sl num_lines]
+{1} [-op csv|csv-no-schema|newline|frequency] [-sl num_lines] [-bs num_rows]
+{1} [-j jobs]
 {1} [-overwrite] [-a-srs srs_def] infile outfile
 """.format(UTIL_NAME, " " * len(UTIL_NAME)))
     return 1
@@ -118,6 +120,15 @@ def print_long_usage():
     -dh -distance-threshold     Number of georeferenced distance units allowed
                                 between points before they are flagged as
                                 discontinuous.  Default assumes input is in degrees.
+                                If the assigned SRS is geographic the great circle
+                                distance in degrees of arc is used.
+                                [default: 1]
+    -bs -batch-size             Number of rows compared at once
+                                [default: 10000]
+    -j -jobs                    Number of worker processes.  With more than one
+                                worker the input is split into chunks that
+                                always start with a new MMSI so every chunk
+                                can be processed independently.
                                 [default: 1]
     -s -schema                  Header for input file if it is a CSV.  If none
                                 is supplied, the first row is used as the schema.
@@ -184,94 +195,287 @@ Help: {0}
 
 
 #/* ======================================================================= */#
-#/*     Define NewlineJSONReader() class
+#/*     Define central_angle() function
 #/* ======================================================================= */#
 
-class NewlineJSONReader(object):
+def central_angle(lon1, lat1, lon2, lat2):
 
     """
-    Allow newline delimited JSON to be read similarly to csv.DictReader
+    Compute the great circle distance between two sets of points with the
+    haversine formula.  The distance is expressed in degrees of arc so it can
+    be compared against the same thresholds as the planar distance between
+    points in a geographic SRS.
+
+
+    Arguments:
+
+        lon1, lat1, lon2, lat2 (numpy.ndarray): Coordinates in decimal degrees
+
+
+    Returns:
+
+        numpy.ndarray of distances in degrees
     """
 
-    def __init__(self, f, fieldnames=None, delimiter=os.linesep):
+    lon1, lat1, lon2, lat2 = (numpy.radians(a) for a in (lon1, lat1, lon2, lat2))
+    a = numpy.sin((lat2 - lat1) / 2.0) ** 2 + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2.0) ** 2
 
-        self.f = f
-        self.delimiter = delimiter
-        self.fieldnames = fieldnames
-        self._first_line = None
+    return numpy.degrees(2.0 * numpy.arcsin(numpy.sqrt(numpy.clip(a, 0.0, 1.0))))
+
+
+#/* ======================================================================= */#
+#/*     Define flag_discontinuities() function
+#/* ======================================================================= */#
+
+def flag_discontinuities(mmsi, timestamp, x, y, tt, dt, previous=None, geodesic=True):
+
+    """
+    Flag every point that is discontinuous with the point before it.  A point
+    is discontinuous if the previous point belongs to the same vessel, was
+    recorded no more than `tt` seconds earlier, and is at least `dt` distance
+    units away.  Input is expected to be sorted by MMSI and timestamp.
+
+
+    Arguments:
+
+        mmsi, timestamp, x, y (numpy.ndarray): One element per point
+
+        tt (int|float): Time threshold in seconds
+
+        dt (int|float): Distance threshold in georeferenced units
+
+
+    Keyword Arguments:
+
+        previous (tuple): (mmsi, timestamp, x, y) of the last point in the
+                          previous batch so a vessel spanning two batches is
+                          compared across the boundary
+                          [default: None]
+
+        geodesic (bool): Compute great circle distance in degrees for
+                         geographic coordinates instead of planar distance
+                         [default: True]
+
+
+    Returns:
 
-        # In order to allow collecting fieldnames from stdin, the first row must be cached, parsed for fieldnames,
-        # and returned later when iterated
-        if self.fieldnames is None:
-            self._first_line = self.f.readline()
-            self.fieldnames = json.loads(self._first_line.replace(self.delimiter, '')).keys()
+        numpy.ndarray of bools - one per point
+    """
+
+    if previous is not None:
+        mmsi = numpy.concatenate(([previous[0]], mmsi))
+        timestamp = numpy.concatenate(([previous[1]], timestamp))
+        x = numpy.concatenate(([previous[2]], x))
+        y = numpy.concatenate(([previous[3]], y))
+
+    same_vessel = mmsi[1:] == mmsi[:-1]
+    time_delta = timestamp[1:] - timestamp[:-1]
+    if geodesic:
+        distance = central_angle(x[:-1], y[:-1], x[1:], y[1:])
+    else:
+        distance = numpy.hypot(x[1:] - x[:-1], y[1:] - y[:-1])
+
+    flags = same_vessel & (time_delta <= tt) & (distance >= dt)
+
+    # The first point has nothing to be compared against
+    if previous is None:
+        flags = numpy.concatenate(([False], flags))
+
+    return flags
+
+
+#/* ======================================================================= */#
+#/*     Define ByteCounter() class
+#/* ======================================================================= */#
+
+class ByteCounter(object):
+
+    """
+    Wrap a file object and keep track of the number of bytes read from it.
+    Works for stdin, which can't report its size or position.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
 
     def __iter__(self):
         return self
 
     def next(self):
-        if self._first_line:
-            line = self._first_line
-            self._first_line = None
-        else:
-            line = self.f.readline()
-        return json.loads(line.replace(self.delimiter, ''))
+        line = next(self.f)
+        self.bytes_read += len(line)
+        return line
+
+    __next__ = next
+
+    def readline(self):
+        line = self.f.readline()
+        self.bytes_read += len(line)
+        return line
 
-    def seek(self, val):
-        return self.f.seek(val)
+    def read(self, size=-1):
+        block = self.f.read(size)
+        self.bytes_read += len(block)
+        return block
 
     def close(self):
         self.f.close()
 
 
 #/* ======================================================================= */#
-#/*     Define NewlineJSONWriter() class
+#/*     Define iter_batches() function
 #/* ======================================================================= */#
 
-class NewlineJSONWriter(object):
+def iter_batches(reader, batch_size, skip_lines=0, align_field=None):
 
     """
-    Allow newline delimited JSON to be written similarly to csv.DictWriter
-    """
+    Group rows from a reader into lists of at most batch_size rows
 
-    def __init__(self, f, fieldnames=None, delimiter=os.linesep):
-        self.f = f
-        self.delimiter = delimiter
-        self.fieldnames = fieldnames
 
-    def writerow(self, row):
-        if self.fieldnames:
-            row = {k: v for k, v in row.iteritems() if k in self.fieldnames}
-        self.f.write(json.dumps(row) + os.linesep)
+    Arguments:
 
-    def write(self, row):
-        self.writerow(row)
+        reader (iterable): Produces one dictionary per row
 
-    def close(self):
-        self.f.close()
+        batch_size (int): Maximum number of rows per batch
+
+
+    Keyword Arguments:
+
+        skip_lines (int): Number of rows to skip before the first batch
+                          [default: 0]
+
+        align_field (str): Grow batches past batch_size until this field
+                           changes so every batch starts with a new value,
+                           e.g. 'mmsi' to never split a vessel across batches
+                           [default: None]
+
+
+    Returns:
+
+        Generator producing lists of rows
+    """
+
+    batch = []
+    for row_i, row in enumerate(reader):
+        if row_i >= skip_lines:
+            if len(batch) >= batch_size and (align_field is None or row[align_field] != batch[-1][align_field]):
+                yield batch
+                batch = []
+            batch.append(row)
+    if batch:
+        yield batch
 
 
 #/* ======================================================================= */#
-#/*     Define is_discontinuous() function
+#/*     Define process_batch() function
 #/* ======================================================================= */#
 
-def is_discontinuous(row, last_row, a_srs=None, tt=None, dt=None, st=None):
+def process_batch(job):
+
+    """
+    Compute discontinuity flags for one batch of points.  Takes a single tuple
+    so it can be handed to a process pool.
+
+
+    Arguments:
+
+        job (tuple): (mmsi, timestamp, x, y, tt, dt, geodesic, previous, count_only)
+                     The first four elements are lists of raw field values and
+                     the rest are passed to flag_discontinuities()
 
-    last_timestamp = datetime.fromtimestamp(int(last_row['timestamp']))
-    process_timestamp = datetime.fromtimestamp(int(row['timestamp']))
-    time_delta = process_timestamp - last_timestamp
 
-    if not time_delta.seconds <= tt:
-        return False
+    Returns:
+
+        numpy.ndarray of flags or, if count_only is True, a dictionary
+        containing the number of discontinuous points per MMSI
+    """
+
+    mmsi, timestamp, x, y, tt, dt, geodesic, previous, count_only = job
+
+    flags = flag_discontinuities(numpy.array(mmsi), numpy.array(timestamp, dtype=numpy.float64),
+                                 numpy.array(x, dtype=numpy.float64), numpy.array(y, dtype=numpy.float64),
+                                 tt, dt, previous=previous, geodesic=geodesic)
+
+    if count_only:
+        counts = {}
+        for m, flag in zip(mmsi, flags):
+            if flag:
+                counts[m] = counts.get(m, 0) + 1
+        return counts
     else:
-        last_point = ogr.CreateGeometryFromWkt('POINT (%s %s)' % (last_row['longitude'], last_row['latitude']))
-        last_point.AssignSpatialReference(a_srs)
-        process_point = ogr.CreateGeometryFromWkt('POINT (%s %s)' % (row['longitude'], row['latitude']))
-        process_point.AssignSpatialReference(a_srs)
-        distance = last_point.Distance(process_point)
+        return flags
+
+
+#/* ======================================================================= */#
+#/*     Define iter_results() function
+#/* ======================================================================= */#
+
+def iter_results(batches, tt, dt, geodesic=True, count_only=False, pool=None, max_pending=None):
+
+    """
+    Process batches in order, optionally in a process pool
+
+
+    Arguments:
+
+        batches (iterable): Lists of rows produced by iter_batches().  When
+                            using a pool every batch must start with a new
+                            MMSI because batches are processed independently.
+
+        tt (int|float): Time threshold in seconds
+
+        dt (int|float): Distance threshold
+
+
+    Keyword Arguments:
+
+        geodesic (bool): See flag_discontinuities()
+                         [default: True]
+
+        count_only (bool): See process_batch()
+                           [default: False]
 
-        # Check distance
-        return distance >= dt and distance / time_delta >= st
+        pool (multiprocessing.Pool): Process batches in this pool.  Without a
+                                     pool the last point of every batch is
+                                     compared against the first point of the
+                                     next batch.
+                                     [default: None]
+
+        max_pending (int): Maximum number of batches submitted to the pool but
+                           not yet returned, which bounds memory use
+                           [default: 2 per CPU]
+
+
+    Returns:
+
+        Generator producing (batch, result) pairs in input order
+    """
+
+    def columns(batch):
+        return ([row['mmsi'] for row in batch], [row['timestamp'] for row in batch],
+                [row['longitude'] for row in batch], [row['latitude'] for row in batch])
+
+    if pool is None:
+        previous = None
+        for batch in batches:
+            job = columns(batch) + (tt, dt, geodesic, previous, count_only)
+            yield batch, process_batch(job)
+            previous = (job[0][-1], float(job[1][-1]), float(job[2][-1]), float(job[3][-1]))
+
+    else:
+        if max_pending is None:
+            max_pending = 2 * multiprocessing.cpu_count()
+        pending = deque()
+        for batch in batches:
+            job = columns(batch) + (tt, dt, geodesic, None, count_only)
+            pending.append((batch, pool.apply_async(process_batch, (job, ))))
+            if len(pending) >= max_pending:
+                batch, result = pending.popleft()
+                yield batch, result.get()
+        while pending:
+            batch, result = pending.popleft()
+            yield batch, result.get()
 
 
 #/* ======================================================================= */#
@@ -311,6 +515,8 @@ Currently the output file is just a count of MMSI's and number of discontinuous
     quiet_mode = False
     output_product = 'csv'
     input_file_format = None
+    batch_size = 10000
+    num_jobs = 1
 
     #/* ----------------------------------------------------------------------- */#
     #/*     Containers
@@ -359,6 +565,12 @@ Currently the output file is just a count of MMSI's and number of discontinuous
             elif arg in ('-sl', '-skip-lines'):
                 i += 2
                 skip_lines = int(args[i - 1])
+            elif arg in ('-bs', '-batch-size'):
+                i += 2
+                batch_size = int(args[i - 1])
+            elif arg in ('-j', '-jobs'):
+                i += 2
+                num_jobs = int(args[i - 1])
 
             # Determine if reading from stdin
             elif arg == '-' and not input_file and sys.stdin.isatty():
@@ -467,6 +679,12 @@ Currently the output file is just a count of MMSI's and number of discontinuous
     if not 0 <= distance_threshold:
         bail = True
         print("ERROR: Invalid distance threshold - must be >= 0: '%s'" % distance_threshold)
+    if not 0 < batch_size:
+        bail = True
+        print("ERROR: Invalid batch size - must be > 0: '%s'" % batch_size)
+    if not 0 < num_jobs:
+        bail = True
+        print("ERROR: Invalid number of jobs - must be > 0: '%s'" % num_jobs)
 
     # Check output product options
     if output_product not in valid_output_products:
@@ -519,17 +737,11 @@ Currently the output file is just a count of MMSI's and number of discontinuous
         print("Output file: %s" % output_file)
         print("Schema: %s" % (','.join(input_schema) if isinstance(input_schema, (list, tuple)) else input_schema))
 
-    # Get line count, which is only used when writing to a file and NOT for stdout
-    prog_total = 0
-    if not quiet_mode and output_file != '-':
-        with sys.stdin if input_file == '-' else open(input_file) as i_f:
-            for row in i_f:
-                prog_total += 1
-
-        # Remove the number of skipped lines and CSV header
-        prog_total -= skip_lines
-        if input_schema is None:
-            prog_total -= 1
+    # Progress is reported in bytes read so the input only has to be read once - the size of stdin is unknown
+    if input_file == '-':
+        prog_total = None
+    else:
+        prog_total = os.path.getsize(input_file)
 
     #/* ----------------------------------------------------------------------- */#
     #/*     Process data
@@ -539,7 +751,8 @@ Currently the output file is just a count of MMSI's and number of discontinuous
     flag_val = 1
 
     # Open input file or stdin
-    with sys.stdin if input_file == '-' else open(input_file) as i_f:
+    with sys.stdin if input_file == '-' else open(input_file) as raw_i_f:
+        i_f = ByteCounter(raw_i_f)
 
         # Open output file or stdin
         with sys.stdout if output_file == '-' else open(output_file, write_mode) as o_f:
@@ -580,64 +793,69 @@ Currently the output file is just a count of MMSI's and number of discontinuous
             else:
                 raise IOError("Invalid output product: '%s'" % output_product)
 
-            # Loop over input file
+            # Distance is measured along a great circle if the points are in a geographic SRS
+            geodesic = bool(assign_srs.IsGeographic())
+            count_only = output_product == 'frequency'
+
+            # Loop over input file in batches and compare every point against the previous point at once
             discontinuity_counts = {}
-            last_row = None
-            for prog_i, row in enumerate(reader):
+            if num_jobs > 1:
+                pool = multiprocessing.Pool(num_jobs)
+                batches = iter_batches(reader, batch_size, skip_lines=skip_lines, align_field='mmsi')
+            else:
+                pool = None
+                batches = iter_batches(reader, batch_size, skip_lines=skip_lines)
+
+            try:
+                for batch, result in iter_results(batches, time_threshold, distance_threshold, geodesic=geodesic,
+                                                  count_only=count_only, pool=pool, max_pending=2 * num_jobs):
+
+                    # Merge frequency counts
+                    if count_only:
+                        for mmsi, count in result.iteritems():
+                            if mmsi not in discontinuity_counts:
+                                discontinuity_counts[mmsi] = count
+                            else:
+                                discontinuity_counts[mmsi] += count
 
-                # Only process rows once the proper number of lines has been skipped
-                if prog_i >= skip_lines:
+                    else:
+                        for row, flag in zip(batch, result):
 
-                    # Update user, but NOT if writing to stdout
-                    if not quiet_mode and output_file != '-':
-                        sys.stdout.write("\r\x1b[K" + "    %s/%s" % (prog_i, prog_total))
-                        sys.stdout.flush()
+                            # If flagging output, make sure all rows contain the field
+                            if 'flag' in output_product:
+                                row[flag_field] = flag_val if flag else ''
+                                writer.writerow(row)
 
-                    # Compare MMSI values - if they don't match then re-set the last row to start processing the new MMSI
-                    try:
-                        if last_row and row['mmsi'] != last_row['mmsi']:
-                            last_row = None
-                    except KeyError:
-                        print(row)
-                        print(last_row)
-                        return 1
-
-                    # If flagging output, make sure all rows contain the field
-                    if 'flag' in output_product:
-                        row[flag_field] = ''
-
-                    # Normal processing
-                    if last_row is not None and is_discontinuous(row, last_row, tt=time_threshold,
-                                                                 dt=distance_threshold, a_srs=assign_srs):
-
-                        # Flag output
-                        if 'flag' in output_product:
-                            row[flag_field] = flag_val
-
-                        # Collect frequency counts
-                        if output_product == 'frequency':
-                            if row['mmsi'] not in discontinuity_counts:
-                                discontinuity_counts[row['mmsi']] = 1
-                            else:
-                                discontinuity_counts[row['mmsi']] += 1
+                            # Write discontinous row
+                            elif flag:
+                                writer.writerow(row)
 
-                        # Write discontinous row
+                    # Update user, but NOT if writing to stdout
+                    if not quiet_mode and output_file != '-':
+                        if prog_total:
+                            sys.stdout.write("\r\x1b[K" + "    %.1f/%.1f MB (%d%%)" % (
+                                i_f.bytes_read / 1048576, prog_total / 1048576, 100 * i_f.bytes_read // prog_total))
                         else:
-                            writer.writerow(row)
+                            sys.stdout.write("\r\x1b[K" + "    %.1f MB" % (i_f.bytes_read / 1048576))
+                        sys.stdout.flush()
 
-                    # Make sure all rows are written when flagging output
-                    # This also catches MMSi's containing only a single point AND the firs row of every MMSI
-                    elif 'flag' in output_product:
-                        writer.writerow(row)
+            except (KeyError, ValueError) as e:
+                print("ERROR: Could not read mmsi, timestamp, longitude, and latitude from batch: %s" % e)
+                return 1
 
-                    # Mark the row just processed as the last row in preparation for processing the next row
-                    last_row = row.copy()
+            finally:
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
 
             #/* ----------------------------------------------------------------------- */#
             #/*     Dump results if output product is 'frequency'
             #/* ----------------------------------------------------------------------- */#
 
-            if output_product == 'frequency':
+            if 'newline' in output_product:
+                writer.flush()
+
+            elif output_product == 'frequency':
                 writer = csv.DictWriter(o_f, ['mmsi', 'count'])
                 writer.writeheader()
                 for mmsi, count in discontinuity_counts.iteritems():
@@ -0,0 +1,530 @@
+#!/usr/bin/env python
+
+
+# This document is part of Pelagos Data
+# https://github.com/skytruth/pelagos-data
+
+
+# =========================================================================== #
+#
+#  The MIT License (MIT)
+#
+#  Copyright (c) 2014 SkyTruth
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# =========================================================================== #
+
+
+
+"""
+Benchmark the processing algorithms available in gridify.py
+"""
+
+
+import csv
+from glob import glob
+import multiprocessing
+import os
+from os.path import *
+import Queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import gridify
+
+try:
+    from osgeo import ogr
+except ImportError:
+    import ogr
+ogr.UseExceptions()
+
+
+#/* ======================================================================= */#
+#/*     Build information
+#/* ======================================================================= */#
+
+__version__ = '0.1-dev'
+__release__ = 'October 18, 2026'
+__source__ = 'https://github.com/SkyTruth/pelagos-data'
+__docname__ = basename(__file__)
+__license__ = gridify.__license__
+
+
+#/* ======================================================================= */#
+#/*     Global variables
+#/* ======================================================================= */#
+
+ALGORITHMS = ('combined', 'region', 'regionnohull', 'grid', 'parallel', 'analytic')
+REPO_DIR = dirname(dirname(abspath(__file__)))
+DEFAULT_GRIDS = sorted(glob(join(REPO_DIR, 'data', 'regions', 'global_grids', '*', '*.shp')))
+DEFAULT_REGIONS = [join(REPO_DIR, 'utils', 'tests', 'fixtures', 'pipa', 'pipa.shp')]
+REPORT_FIELDS = ['region', 'grid', 'algorithm', 'exit_code', 'seconds', 'region_features', 'features_per_second',
+                 'peak_memory_mb', 'output_features', 'output_area', 'equivalent']
+
+
+#/* ======================================================================= */#
+#/*     Define print_usage() function
+#/* ======================================================================= */#
+
+def print_usage():
+
+    """
+    Command line usage information
+
+    :return: 1 for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Usage:
+    {0} [-a algorithm,algorithm,...] [-g grid_file] [-r region_file]
+    {1} [-j jobs] [-n repeat] [-t tolerance] [-k] [-o report.csv]
+""".format(__docname__, " " * len(__docname__)))
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_help() function
+#/* ======================================================================= */#
+
+def print_help():
+
+    """
+    Detailed help information
+
+    :return: 1 for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+Help: {0}
+------{1}
+{2}
+    """.format(__docname__, '-' * len(__docname__), main.__doc__))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define print_version() function
+#/* ======================================================================= */#
+
+def print_version():
+
+    """
+    Print script version information
+
+    :return: 1 for exit code purposes
+    :rtype: int
+    """
+
+    print("""
+%s version %s - released %s
+    """ % (__docname__, __version__, __release__))
+
+    return 1
+
+
+#/* ======================================================================= */#
+#/*     Define run_case() function
+#/* ======================================================================= */#
+
+def run_case(gridify_args, queue):
+
+    """
+    Run gridify.main() in a child process so peak memory is measured per run.
+    gridify's progress output is discarded.
+
+    Puts (exit_code, seconds, peak_memory_mb) into the queue.
+    """
+
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    try:
+        exit_code = gridify.main(gridify_args)
+    except Exception:
+        exit_code = 'exception'
+    seconds = time.time() - start
+
+    # ru_maxrss is in kilobytes on Linux - the 'parallel' algorithm's workers are children of this process
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    queue.put((exit_code, seconds, peak / 1024.0))
+
+
+#/* ======================================================================= */#
+#/*     Define run_process() function
+#/* ======================================================================= */#
+
+def run_process(gridify_args):
+
+    """
+    Run one benchmark case in its own process with run_case() and wait for it.
+    A child that dies without reporting, e.g. killed for running out of memory
+    or crashed inside GDAL, is reported as failed instead of waited on forever.
+
+    :return: (exit_code, seconds, peak_memory_mb), with exit_code 'signal N'
+             for a child killed by a signal and peak_memory_mb None when the
+             child didn't report it
+    :rtype: tuple
+    """
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_case, args=(gridify_args, queue))
+    start = time.time()
+    process.start()
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except Queue.Empty:
+            if not process.is_alive():
+                # Pick up a result put just before the child exited
+                try:
+                    result = queue.get(timeout=1)
+                except Queue.Empty:
+                    break
+    seconds = time.time() - start
+    process.join()
+
+    if result is not None:
+        return result
+    elif process.exitcode < 0:
+        return 'signal %s' % -process.exitcode, seconds, None
+    else:
+        return 'died %s' % process.exitcode, seconds, None
+
+
+#/* ======================================================================= */#
+#/*     Define summarize_output() function
+#/* ======================================================================= */#
+
+def summarize_output(output_file):
+
+    """
+    Collect the information needed to compare the output of two algorithms.
+    Output features don't carry the region FID so areas are summed per set of
+    region attributes.
+
+    :return: {layer_name: (feature_count, total_area, {attributes: area})}
+    :rtype: dict
+    """
+
+    summary = {}
+    ds = ogr.Open(output_file)
+    if ds is None:
+        return summary
+    for layer in ds:
+        feature_count = 0
+        total_area = 0.0
+        areas = {}
+        for feature in layer:
+            key = tuple(feature.GetField(i) for i in range(feature.GetFieldCount()))
+            area = feature.GetGeometryRef().GetArea()
+            feature_count += 1
+            total_area += area
+            areas[key] = areas.get(key, 0.0) + area
+        summary[layer.GetName()] = (feature_count, total_area, areas)
+    layer = None
+    ds = None
+
+    return summary
+
+
+#/* ======================================================================= */#
+#/*     Define is_equivalent() function
+#/* ======================================================================= */#
+
+def is_equivalent(summary, baseline, tolerance):
+
+    """
+    Compare two output summaries produced by summarize_output()
+
+    :return: True if both contain the same layers with the same number of
+             features and areas that differ by no more than the relative
+             tolerance
+    :rtype: bool
+    """
+
+    if sorted(summary.keys()) != sorted(baseline.keys()):
+        return False
+
+    for layer_name, (feature_count, total_area, areas) in summary.items():
+        b_feature_count, b_total_area, b_areas = baseline[layer_name]
+        if feature_count != b_feature_count or sorted(areas.keys()) != sorted(b_areas.keys()):
+            return False
+        for key, area in areas.items():
+            if abs(area - b_areas[key]) > tolerance * max(abs(b_areas[key]), 1.0):
+                return False
+
+    return True
+
+
+#/* ======================================================================= */#
+#/*     Define main() function
+#/* ======================================================================= */#
+
+def main(args):
+
+    """
+Run every requested gridify.py algorithm against every combination of grid and
+region file and write a CSV report to stdout or the file given with -o.
+
+By default the bundled grids in data/regions/global_grids/*/ are used with the
+PIPA region from the unittest fixtures.  Every run happens in its own process so
+peak memory reflects a single run.  With -n the fastest successful of n
+repeats is reported.  A run killed by a signal, e.g. for running out of
+memory, is reported with exit_code 'signal N' and no peak memory.
+
+Output equivalence is checked against the 'combined' algorithm or, if it was
+not requested, the first algorithm.  Outputs are equivalent if they contain the
+same number of features and the area per set of region attributes differs by
+no more than the relative tolerance set with -t.  Equivalence is left blank
+when either run failed.
+
+Options:
+    -a -algorithms  Comma separated algorithms to benchmark
+                    [default: all]
+    -g -grid        Grid file - can be used multiple times
+    -r -region      Region file - can be used multiple times
+    -j -jobs        Number of workers for the 'parallel' algorithm
+    -n -repeat      Number of times to run every case
+                    [default: 1]
+    -t -tolerance   Relative area tolerance for equivalence checks
+                    [default: 1e-6]
+    -k -keep        Keep the workspace containing all outputs
+    -o -output      Report file
+                    [default: stdout]
+    """
+
+    #/* ----------------------------------------------------------------------- */#
+    #/*     Defaults
+    #/* ----------------------------------------------------------------------- */#
+
+    algorithms = list(ALGORITHMS)
+    num_jobs = None
+    repeat = 1
+    tolerance = 1e-6
+    keep_workspace = False
+    report_file = '-'
+
+    #/* ----------------------------------------------------------------------- */#
+    #/*     Containers
+    #/* ----------------------------------------------------------------------- */#
+
+    grid_files = []
+    region_files = []
+
+    #/* ----------------------------------------------------------------------- */#
+    #/*     Parse arguments
+    #/* ----------------------------------------------------------------------- */#
+
+    i = 0
+    arg = None
+    arg_error = False
+    while i < len(args):
+
+        try:
+            arg = args[i]
+
+            # Help arguments
+            if arg in ('--help', '-help'):
+                return print_help()
+            elif arg in ('--usage', '-usage'):
+                return print_usage()
+            elif arg in ('--version', '-version'):
+                return print_version()
+
+            # Benchmark cases
+            elif arg in ('-a', '-algorithms'):
+                i += 2
+                algorithms = [a.lower() for a in args[i - 1].split(',')]
+            elif arg in ('-g', '-grid'):
+                i += 2
+                grid_files.append(abspath(normpath(expanduser(args[i - 1]))))
+            elif arg in ('-r', '-region'):
+                i += 2
+                region_files.append(abspath(normpath(expanduser(args[i - 1]))))
+
+            # Additional options
+            elif arg in ('-j', '-jobs'):
+                i += 2
+                num_jobs = int(args[i - 1])
+            elif arg in ('-n', '-repeat'):
+                i += 2
+                repeat = int(args[i - 1])
+            elif arg in ('-t', '-tolerance'):
+                i += 2
+                tolerance = float(args[i - 1])
+            elif arg in ('-k', '-keep'):
+                i += 1
+                keep_workspace = True
+            elif arg in ('-o', '-output'):
+                i += 2
+                report_file = args[i - 1]
+
+            # Positional arguments and errors
+            else:
+                i += 1
+                arg_error = True
+                print("ERROR: Invalid argument: %s" % arg)
+
+        # This catches several conditions:
+        #   1. The last argument is a flag that requires parameters but the user did not supply the parameter
+        #   2. The arg parser did not properly consume all parameters for an argument
+        #   3. The arg parser did not properly iterate the 'i' variable
+        #   4. An argument split on '=' doesn't have anything after '=' - e.g. '--output-file='
+        except (IndexError, ValueError):
+            i += 1
+            arg_error = True
+            print("ERROR: An argument has invalid parameters: %s" % arg)
+
+    if not grid_files:
+        grid_files = DEFAULT_GRIDS
+    if not region_files:
+        region_files = DEFAULT_REGIONS
+
+    #/* ----------------------------------------------------------------------- */#
+    #/*     Validate parameters
+    #/* ----------------------------------------------------------------------- */#
+
+    bail = False
+
+    # Check arguments
+    if arg_error:
+        bail = True
+        print("ERROR: Did not successfully parse arguments")
+
+    # Check algorithms
+    for algorithm in algorithms:
+        if algorithm not in ALGORITHMS:
+            bail = True
+            print("ERROR: Invalid algorithm: %s" % algorithm)
+            print("       Options: %s" % ', '.join(ALGORITHMS))
+
+    # Check input files
+    for ifile in grid_files + region_files:
+        if not os.access(ifile, os.R_OK):
+            bail = True
+            print("ERROR: Can't access input file: %s" % ifile)
+
+    # Check additional options
+    if repeat < 1:
+        bail = True
+        print("ERROR: Invalid repeat - must be >= 1: %s" % repeat)
+    if num_jobs is not None and num_jobs < 1:
+        bail = True
+        print("ERROR: Invalid number of jobs - must be >= 1: %s" % num_jobs)
+
+    # Exit if something did not pass validation
+    if bail:
+        return 1
+
+    #/* ----------------------------------------------------------------------- */#
+    #/*     Run benchmarks
+    #/* ----------------------------------------------------------------------- */#
+
+    baseline_algorithm = 'combined' if 'combined' in algorithms else algorithms[0]
+    workspace = tempfile.mkdtemp(prefix='gridify-benchmark-')
+    sys.stderr.write("Workspace: %s\n" % workspace)
+
+    report = []
+    try:
+        for region_file in region_files:
+
+            # gridify.py processes the first layer of the region file by default
+            region_ds = ogr.Open(region_file)
+            num_region_features = len(region_ds.GetLayerByIndex(0))
+            region_ds = None
+
+            for grid_file in grid_files:
+                baseline = None
+                summaries = {}
+
+                # Run the baseline first so every other algorithm can be compared against it
+                for algorithm in [baseline_algorithm] + [a for a in algorithms if a != baseline_algorithm]:
+                    sys.stderr.write("%s x %s: %s ...\n" % (basename(region_file), basename(grid_file), algorithm))
+
+                    # The fastest run, preferring runs that succeeded
+                    best = None
+                    best_output_file = None
+                    for run in range(repeat):
+                        output_file = join(workspace, '%s-%s-%s-%s' % (
+                            splitext(basename(region_file))[0], splitext(basename(grid_file))[0], algorithm, run))
+                        gridify_args = ['-g', grid_file, '-r', region_file, '-o', output_file, '-a', algorithm]
+                        if num_jobs is not None:
+                            gridify_args += ['-j', str(num_jobs)]
+
+                        result = run_process(gridify_args)
+                        if best is None or (result[0] == 0, -result[1]) > (best[0] == 0, -best[1]):
+                            best = result
+                            best_output_file = output_file
+
+                    exit_code, seconds, peak_memory = best
+                    summaries[algorithm] = summarize_output(best_output_file) if exit_code == 0 else {}
+                    if algorithm == baseline_algorithm:
+                        # Nothing can be compared against a failed baseline
+                        baseline = summaries[algorithm] if exit_code == 0 else None
+                        equivalent = 'baseline'
+                    elif exit_code != 0 or baseline is None:
+                        equivalent = ''
+                    else:
+                        equivalent = is_equivalent(summaries[algorithm], baseline, tolerance)
+
+                    report.append({
+                        'region': basename(region_file),
+                        'grid': basename(grid_file),
+                        'algorithm': algorithm,
+                        'exit_code': exit_code,
+                        'seconds': '%.3f' % seconds,
+                        'region_features': num_region_features,
+                        'features_per_second': '%.2f' % (num_region_features / seconds if seconds > 0 else 0.0),
+                        'peak_memory_mb': '' if peak_memory is None else '%.1f' % peak_memory,
+                        'output_features': sum(s[0] for s in summaries[algorithm].values()),
+                        'output_area': sum(s[1] for s in summaries[algorithm].values()),
+                        'equivalent': equivalent
+                    })
+
+    finally:
+        if not keep_workspace:
+            shutil.rmtree(workspace)
+
+    #/* ----------------------------------------------------------------------- */#
+    #/*     Write report
+    #/* ----------------------------------------------------------------------- */#
+
+    with sys.stdout if report_file == '-' else open(report_file, 'w') as o_f:
+        writer = csv.DictWriter(o_f, REPORT_FIELDS)
+        writer.writeheader()
+        for row in report:
+            writer.writerow(row)
+
+    return 0
+
+
+#/* ======================================================================= */#
+#/*     Command Line Execution
+#/* ======================================================================= */#
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
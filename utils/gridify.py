@@ -103,6 +103,7 @@ def print_usage():
 Usage:
     {0} [-of ogr_driver] [-lco option=value] [-dsco option=value] [-cfn]
     {1} [-gl layer_name|layer1,layer2,...] [-rl layer_name|layer1,layer2]
+    {1} [-a combined|region|regionnohull|grid|parallel|analytic] [-j jobs]
     {1} -g grid_file.ext -r region_file.ext -o output_file.ext
 """.format(__docname__, " " * len(__docname__)))
     return 1
@@ -205,7 +206,7 @@ def ring2poly(ring, add_z=True):
     if not ring.GetGeometryType() is ogr.wkbLinearRing:
         raise ValueError("ERROR: Wrong type - should be '%s' not '%s'" % (ogr.wkbLinearRing, ring.GetGeometryType()))
 
-    ring = ring.CLone()
+    ring = ring.Clone()
     if add_z:
         geom_type = ogr.wkbPolygon
     else:
@@ -237,6 +238,263 @@ def is_ring_poly(ring):
         return False
 
 
+#/* ======================================================================= */#
+#/*     Define get_coord_transform() function
+#/* ======================================================================= */#
+
+def get_coord_transform(region_layer, grid_layer):
+
+    """
+    Get a transformation from the region layer's SRS to the grid layer's SRS
+
+    :return: osr.CoordinateTransformation or None if both layers share an SRS
+    """
+
+    region_layer_srs = region_layer.GetSpatialRef()
+    grid_layer_srs = grid_layer.GetSpatialRef()
+    if region_layer_srs is None or grid_layer_srs is None or grid_layer_srs.IsSame(region_layer_srs) is 1:
+        return None
+    else:
+        return osr.CoordinateTransformation(region_layer_srs, grid_layer_srs)
+
+
+#/* ======================================================================= */#
+#/*     Define clean_intersection() function
+#/* ======================================================================= */#
+
+def clean_intersection(intersecting_geom):
+
+    """
+    Reduce the result of a grid cell and region intersection to a multipolygon
+
+    Points and lines produced where the region only touches a cell are
+    discarded.  Geometry collections are exploded and only their polygon
+    components are kept - this is the "gridify problem".
+
+    :return: ogr.wkbMultiPolygon, which may be empty
+    :rtype: ogr.Geometry
+    :raises TypeError: intersection produced a geometry that can't be handled
+    """
+
+    output_geom = ogr.Geometry(ogr.wkbMultiPolygon)
+    geom_type = intersecting_geom.GetGeometryType()
+
+    # POLYGON - Add
+    if geom_type in (ogr.wkbPolygon, ogr.wkbPolygon25D):
+        output_geom.AddGeometry(intersecting_geom)
+
+    # LINEARRING - Actually a closed polygon - convert to polygon and add
+    elif geom_type is ogr.wkbLinearRing and is_ring_poly(intersecting_geom):
+        output_geom.AddGeometry(ring2poly(intersecting_geom))
+
+    # MULTIPOLYGON - Split into and add individual polygons
+    elif geom_type in (ogr.wkbMultiPolygon, ogr.wkbMultiPolygon25D):
+        for i in range(intersecting_geom.GetGeometryCount()):
+            output_geom.AddGeometry(intersecting_geom.GetGeometryRef(i))
+
+    # POINT, MULTIPOINT, LINESTRING, or MULTILINESTRING - Discard
+    elif geom_type in (ogr.wkbPoint, ogr.wkbPoint25D, ogr.wkbMultiPoint, ogr.wkbMultiPoint25D,
+                       ogr.wkbLineString, ogr.wkbLineString25D, ogr.wkbMultiLineString, ogr.wkbMultiLineString25D):
+        pass
+
+    # The edge cases of edge cases - the "gridify problem"
+    # Geometry collection could contain any combination of points, multipoints, lines, multilines,
+    # linearrings, polygons, and multipolygons.  All must be dealt with.
+    elif geom_type in (ogr.wkbGeometryCollection, ogr.wkbGeometryCollection25D):
+        for i in range(intersecting_geom.GetGeometryCount()):
+            sub_geom = intersecting_geom.GetGeometryRef(i)
+            sub_geom_type = sub_geom.GetGeometryType()
+
+            # Sub geometry is a polygon - add to output
+            if sub_geom_type in (ogr.wkbPolygon, ogr.wkbPolygon25D):
+                output_geom.AddGeometry(sub_geom)
+
+            # Sub geometry is a linearring that is actually a closed and should be a polygon
+            elif sub_geom_type is ogr.wkbLinearRing and is_ring_poly(sub_geom):
+                output_geom.AddGeometry(ring2poly(sub_geom))
+
+            # Sub geometry is a multipolygon - explode and add individually
+            elif sub_geom_type in (ogr.wkbMultiPolygon, ogr.wkbMultiPolygon25D):
+                for j in range(sub_geom.GetGeometryCount()):
+                    output_geom.AddGeometry(sub_geom.GetGeometryRef(j))
+
+    # Unrecognized geometry type
+    else:
+        raise TypeError("Unrecognized geometry - type: %s name: %s geometry count: %s point count: %s"
+                        % (geom_type, intersecting_geom.GetGeometryName(),
+                           intersecting_geom.GetGeometryCount(), intersecting_geom.GetPointCount()))
+
+    return output_geom
+
+
+#/* ======================================================================= */#
+#/*     Define stamp_region() function
+#/* ======================================================================= */#
+
+def stamp_region(region_geom, grid_layer, spatial_filter=None):
+
+    """
+    Intersect one region geometry with every grid cell passing a spatial filter
+
+    :param region_geom: region geometry already in the grid layer's SRS
+    :param spatial_filter: geometry used as a spatial filter on the grid layer,
+                           typically the region's convex hull.  Defaults to
+                           the region geometry itself.
+    :return: generator producing one multipolygon per intersecting grid cell
+    """
+
+    if spatial_filter is None:
+        spatial_filter = region_geom
+    grid_layer.SetSpatialFilter(spatial_filter)
+    grid_layer.ResetReading()
+    for grid_feature in grid_layer:
+        output_geom = clean_intersection(grid_feature.GetGeometryRef().Intersection(region_geom))
+        if not output_geom.IsEmpty():
+            yield output_geom
+
+
+#/* ======================================================================= */#
+#/*     Define regular_grid_index() function
+#/* ======================================================================= */#
+
+def regular_grid_index(grid_layer, tolerance=1e-6):
+
+    """
+    Index a grid layer consisting of equal sized, axis aligned rectangular
+    cells by column and row so candidate cells can be computed directly from
+    a region's envelope instead of through a spatial filter
+
+    :return: (min_x, min_y, cell_width, cell_height, {(col, row): geometry}) or
+             None if the layer is not a regular grid
+    :rtype: tuple|None
+    """
+
+    grid_layer.SetSpatialFilter(None)
+    grid_layer.ResetReading()
+    min_x, max_x, min_y, max_y = grid_layer.GetExtent()
+    cell_width = None
+    cell_height = None
+    cells = {}
+    for grid_feature in grid_layer:
+        grid_geom = grid_feature.GetGeometryRef()
+        g_min_x, g_max_x, g_min_y, g_max_y = grid_geom.GetEnvelope()
+        width = g_max_x - g_min_x
+        height = g_max_y - g_min_y
+
+        # Cells must be rectangles that completely fill their envelope and all share the same size
+        if width <= 0 or height <= 0 or abs(grid_geom.GetArea() - width * height) > tolerance * width * height:
+            return None
+        if cell_width is None:
+            cell_width = width
+            cell_height = height
+        elif abs(width - cell_width) > tolerance * cell_width or abs(height - cell_height) > tolerance * cell_height:
+            return None
+
+        col = int(round((g_min_x - min_x) / cell_width))
+        row = int(round((g_min_y - min_y) / cell_height))
+        if (col, row) in cells:
+            return None
+        cells[(col, row)] = grid_geom.Clone()
+    grid_layer.ResetReading()
+
+    if cell_width is None:
+        return None
+
+    return min_x, min_y, cell_width, cell_height, cells
+
+
+#/* ======================================================================= */#
+#/*     Define stamp_region_analytic() function
+#/* ======================================================================= */#
+
+def stamp_region_analytic(region_geom, grid_index):
+
+    """
+    Same as stamp_region() but candidate cells come from a regular_grid_index()
+    and cells completely inside the region are copied without an intersection
+
+    :return: generator producing one multipolygon per intersecting grid cell
+    """
+
+    min_x, min_y, cell_width, cell_height, cells = grid_index
+    r_min_x, r_max_x, r_min_y, r_max_y = region_geom.GetEnvelope()
+    first_col = int((r_min_x - min_x) // cell_width)
+    last_col = int((r_max_x - min_x) // cell_width)
+    first_row = int((r_min_y - min_y) // cell_height)
+    last_row = int((r_max_y - min_y) // cell_height)
+
+    # Iterate in the same order as a spatial filter over a grid written row by row from the top
+    for row in range(last_row, first_row - 1, -1):
+        for col in range(first_col, last_col + 1):
+            grid_geom = cells.get((col, row))
+            if grid_geom is None or not grid_geom.Intersects(region_geom):
+                continue
+            if region_geom.Contains(grid_geom):
+                output_geom = ogr.Geometry(ogr.wkbMultiPolygon)
+                output_geom.AddGeometry(grid_geom)
+            else:
+                output_geom = clean_intersection(grid_geom.Intersection(region_geom))
+            if not output_geom.IsEmpty():
+                yield output_geom
+
+
+#/* ======================================================================= */#
+#/*     Define parallel_worker() function
+#/* ======================================================================= */#
+
+_worker_layers = {}
+
+
+def parallel_worker(job):
+
+    """
+    Process a chunk of region features in a worker process.  OGR objects can't
+    be pickled so every worker opens its own copy of the input layers, which
+    are cached for the lifetime of the worker.
+
+    :param job: (region_file, region_layer_name, grid_file, grid_layer_name, [region_fids])
+    :return: [(region_fid, [output geometry WKB, ...]), ...]
+    :rtype: list
+    """
+
+    region_file, region_layer_name, grid_file, grid_layer_name, region_fids = job
+
+    key = (region_file, region_layer_name, grid_file, grid_layer_name)
+    if key not in _worker_layers:
+        region_ds = ogr.Open(region_file)
+        grid_ds = ogr.Open(grid_file)
+        region_layer = region_ds.GetLayerByName(region_layer_name)
+        grid_layer = grid_ds.GetLayerByName(grid_layer_name)
+        _worker_layers[key] = (region_ds, grid_ds, region_layer, grid_layer,
+                               get_coord_transform(region_layer, grid_layer))
+    region_ds, grid_ds, region_layer, grid_layer, coord_transform = _worker_layers[key]
+
+    results = []
+    for fid in region_fids:
+        region_geom = region_layer.GetFeature(fid).GetGeometryRef().Clone()
+        if coord_transform is not None:
+            region_geom.Transform(coord_transform)
+        results.append((fid, [g.ExportToWkb() for g in stamp_region(region_geom, grid_layer, region_geom.ConvexHull())]))
+
+    return results
+
+
+#/* ======================================================================= */#
+#/*     Define write_output_feature() function
+#/* ======================================================================= */#
+
+def write_output_feature(output_layer, region_feature, output_geom, fid):
+
+    """
+    Write one gridified chunk of a region feature to the output layer
+    """
+
+    output_feature = region_feature.Clone()
+    output_feature.SetFID(fid)
+    output_feature.SetGeometry(output_geom)
+    output_layer.CreateFeature(output_feature)
+
+
 #/* ======================================================================= */#
 #/*     Define main() function
 #/* ======================================================================= */#
@@ -250,13 +508,14 @@ def main(args):
     output_driver_name = "ESRI Shapefile"
     processing_algorithm = 'combined'
     check_field_names = False
+    num_jobs = multiprocessing.cpu_count()
+    chunk_size_limit = 100
 
     #/* ----------------------------------------------------------------------- */#
     #/*     Containers
     #/* ----------------------------------------------------------------------- */#
 
-    # options_processing_algorithm = ('region', 'grid', 'combined', 'regionnohull')
-    options_processing_algorithm = ('combined')
+    options_processing_algorithm = ('combined', 'region', 'regionnohull', 'grid', 'parallel', 'analytic')
     grid_file = None
     grid_layer_name = None
     region_file = None
@@ -323,6 +582,12 @@ def main(args):
             elif arg in ('-cfn', '-check-field-names'):
                 i += 1
                 check_field_names = True
+            elif arg in ('-a', '-algorithm'):
+                i += 2
+                processing_algorithm = args[i - 1].lower()
+            elif arg in ('-j', '-jobs'):
+                i += 2
+                num_jobs = int(args[i - 1])
 
             # Positional arguments and errors
             else:
@@ -390,6 +655,9 @@ def main(args):
         bail = True
         print("ERROR: Invalid processing algorithm: %s" % processing_algorithm)
         print("       Options: %s" % ', '.join(options_processing_algorithm))
+    if num_jobs < 1:
+        bail = True
+        print("ERROR: Invalid number of jobs - must be >= 1: %s" % num_jobs)
 
     # Exit if something did not pass validation
     if bail:
@@ -512,10 +780,6 @@ def main(args):
             region_layer_fields = [i.GetName() for i in region_field_definitions]
             grid_layer_fields = [i.GetName() for i in grid_field_definitions]
 
-            # Cache SRS objects
-            grid_layer_srs = region_layer.GetSpatialRef()
-            region_layer_srs = region_layer.GetSpatialRef()
-
             # Check for duplicate fields
             if check_field_names:
                 bail = False
@@ -532,9 +796,6 @@ def main(args):
             #           % (region_layer.GetName(), grid_layer.GetName()))
 
             if bail:
-                grid_srs = None
-                grid_layer_srs = None
-                region_layer_srs = None
                 r_field = None
                 region_feature_def = None
                 grid_feature_def = None
@@ -563,383 +824,192 @@ def main(args):
             field_def = None
 
             # Create a coordinate transformation object if the region_layer and grid_layer are in a different SRS
-            if grid_layer_srs.IsSame(region_layer_srs) is not 1:
-                coord_transform = osr.CoordinateTransformation(region_layer_srs, grid_layer_srs)
-            else:
-                coord_transform = None
-
-            # TODO: Determine which algorithm to use - grid centric or region polygon centric
+            coord_transform = get_coord_transform(region_layer, grid_layer)
 
             #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
-            #/*     Region polygon centric algorithm
+            #/*     Process data
             #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
 
-            print("    Using algorithm: %s" % processing_algorithm)
+            # All algorithms produce one output feature per intersecting region feature and grid cell pair.
+            # Use utils/gridify-benchmark.py to compare their speed and output.
+            #   region       - spatial filter on the grid layer is the convex hull of each region feature
+            #   regionnohull - spatial filter on the grid layer is the region geometry itself
+            #   grid         - grid centric, every grid cell is used as a spatial filter on the region layer
+            #   combined     - grid layer is limited to the convex hulls of all regions, then same as 'region'
+            #   parallel     - same as 'region' but region features are distributed across worker processes
+            #   analytic     - candidate cells are computed from the region's envelope - regular grids only
 
+            print("    Using algorithm: %s" % processing_algorithm)
 
-            # TODO: Remove other algorithms - combined is the only one that handles the 'gridify problem'
-            # if processing_algorithm.lower() == 'region':
-            #
-            #     # No upfront data prep
-            #     # Uses the convex hull of the region feature being processed as a spatial index on every pass
-            #     # Limits the number of grid cells being examined
-            #
-            #     # # Create an output chunk for every intersecting geometry for grid cell
-            #     region_feature_counter = 0
-            #     num_region_features = len(region_layer)
-            #     region_layer.ResetReading()
-            #     fid_counter = -1
-            #     for region_feature in region_layer:
-            #
-            #         # Cache region geometry
-            #         region_geom = region_feature.GetGeometryRef().Clone()
-            #         if coord_transform is not None:
-            #             region_geom.Transform(coord_transform)
-            #
-            #         # Apply a spatial filter to the grid
-            #         spat_filter_geom = region_geom.ConvexHull()
-            #         grid_layer.SetSpatialFilter(spat_filter_geom)
-            #         grid_layer.ResetReading()
-            #
-            #         # Update user
-            #         region_feature_counter += 1
-            #         sys.stdout.write("\r\x1b[K" + "    %s/%s" % (region_feature_counter, num_region_features))
-            #         sys.stdout.flush()
-            #
-            #         for grid_feature in grid_layer:
-            #
-            #             grid_geom = grid_feature.GetGeometryRef()
-            #
-            #             intersecting_geom = grid_geom.Intersection(region_geom)
-            #             if not intersecting_geom.IsEmpty():
-            #                 if intersecting_geom.GetGeometryType() is ogr.wkbGeometryCollection:
-            #                     temp_geom = ogr.Geometry(ogr.wkbMultiPolygon)
-            #                     for i in range(intersecting_geom.GetGeometryCount()):
-            #                         sub_geom = intersecting_geom.GetGeometryRef(i)
-            #                         if sub_geom.GetPointCount() > 2:
-            #                             temp_geom.AddGeometry(sub_geom)
-            #                     intersecting_geom = temp_geom
-            #                 output_feature = region_feature.Clone()
-            #                 output_feature.SetGeometry(intersecting_geom)
-            #                 fid_counter += 1
-            #                 output_feature.SetFID(fid_counter)
-            #                 output_layer.CreateFeature(output_feature)
-            #
-            #     # Update user - done processing a grid layer
-            #     print(" - Done")
-            #     output_layer.SyncToDisk()
-            #
-            # #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
-            # #/*     Region polygon centric algorithm - NO CONVEX HULL
-            # #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
-            #
-            # elif processing_algorithm.lower() == 'regionnohull':
-            #
-            #     # Same as above but uses the more complex region geometry as the spatial filter instead of a convex hull
-            #
-            #     # # Create an output chunk for every intersecting geometry for grid cell
-            #     region_feature_counter = 0
-            #     num_region_features = len(region_layer)
-            #     region_layer.ResetReading()
-            #     fid_counter = -1
-            #     for region_feature in region_layer:
-            #
-            #         # Cache region geometry
-            #         region_geom = region_feature.GetGeometryRef().Clone()
-            #         if coord_transform is not None:
-            #             region_geom.Transform(coord_transform)
-            #
-            #         # Spatial filter
-            #         grid_layer.SetSpatialFilter(region_geom)
-            #         grid_layer.ResetReading()
-            #
-            #         # Update user
-            #         region_feature_counter += 1
-            #         sys.stdout.write("\r\x1b[K" + "    %s/%s" % (region_feature_counter, num_region_features))
-            #         sys.stdout.flush()
-            #
-            #         progress_max = len(grid_layer)
-            #         for grid_feature in grid_layer:
-            #
-            #             grid_geom = grid_feature.GetGeometryRef()
-            #
-            #             intersecting_geom = grid_geom.Intersection(region_geom)
-            #             if not intersecting_geom.IsEmpty():
-            #                 if intersecting_geom.GetGeometryType() is ogr.wkbGeometryCollection:
-            #                     temp_geom = ogr.Geometry(ogr.wkbMultiPolygon)
-            #                     for i in range(intersecting_geom.GetGeometryCount()):
-            #                         sub_geom = intersecting_geom.GetGeometryRef(i)
-            #                         if sub_geom.GetPointCount() > 2:
-            #                             temp_geom.AddGeometry(sub_geom)
-            #                     intersecting_geom = temp_geom
-            #                 output_feature = region_feature.Clone()
-            #                 output_feature.SetGeometry(intersecting_geom)
-            #                 fid_counter += 1
-            #                 output_feature.SetFID(fid_counter)
-            #                 output_layer.CreateFeature(output_feature)
-            #
-            #     # Update user - done processing a grid layer
-            #     print(" - Done")
-            #     output_layer.SyncToDisk()
-            #
-            # #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
-            # #/*     Grid centric algorithms
-            # #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
-            #
-            # elif processing_algorithm.lower() == 'grid':
-            #
-            #     # Limit the number of features in the grid_layer that will be processed
-            #     # Create a geometry collection containing one convex hull per region geometry
-            #     # Use this geometry as a spatial filter on the grid layer
-            #     # Be sure to reset reading afterwards
-            #     # Get one grid feature and stamp out all intersecting region polygons
-            #     #   Repeat ...
-            #
-            #     print("    Progress units are grid features")
-            #     print("    Prepping data ...")
-            #     limit_geom = ogr.Geometry(ogr.wkbGeometryCollection)x
-            #     limit_geom.AssignSpatialReference(region_layer.GetSpatialRef())
-            #     for region_feature in region_layer:
-            #         region_geom = region_feature.GetGeometryRef()
-            #         limit_geom.AddGeometry(region_geom.ConvexHull())
-            #     if limit_geom.GetSpatialReference().IsSame(grid_layer_srs) is not 1:
-            #         limit_geom.Transform(coord_transform)
-            #     region_layer.ResetReading()
-            #     grid_layer.SetSpatialFilter(limit_geom)
-            #     region_feature = None
-            #     region_geom = None
-            #
-            #     # Create an output chunk for every intersecting geometry for grid cell
-            #     grid_feature_counter = 0
-            #     num_grid_features = len(grid_layer)
-            #     fid_counter = -1
-            #     for grid_feature in grid_layer:
-            #
-            #         # Prep region layer
-            #         grid_geom = grid_feature.GetGeometryRef()
-            #         region_layer.ResetReading()
-            #         region_layer.SetSpatialFilter(grid_geom)
-            #
-            #         # Update user
-            #         grid_feature_counter += 1
-            #         sys.stdout.write("\r\x1b[K" + "    %s/%s" % (grid_feature_counter, num_grid_features))
-            #         sys.stdout.flush()
-            #         for region_feature in region_layer:
-            #
-            #             # Compute the intersection
-            #             region_geom = region_feature.GetGeometryRef().Clone()
-            #             if coord_transform is not None:
-            #                 region_geom.Transform(coord_transform)
-            #             intersecting_geom = grid_geom.Intersection(region_geom)
-            #
-            #             # Add new feature to the output layer
-            #             if not intersecting_geom.IsEmpty():
-            #                 if intersecting_geom.GetGeometryType() is ogr.wkbGeometryCollection:
-            #                     temp_geom = ogr.Geometry(ogr.wkbMultiPolygon)
-            #                     for i in range(intersecting_geom.GetGeometryCount()):
-            #                         sub_geom = intersecting_geom.GetGeometryRef(i)
-            #                         if sub_geom.GetGeometryType() in (ogr.wkbPolygon, ogr.wkbMultiPolygon):
-            #                             temp_geom.AddGeometry(sub_geom)
-            #                     intersecting_geom = temp_geom
-            #                 output_feature = region_feature.Clone()
-            #                 output_feature.SetGeometry(intersecting_geom)
-            #                 fid_counter += 1
-            #                 output_feature.SetFID(fid_counter)
-            #                 output_layer.CreateFeature(output_feature)
-            #
-            #     # Update user - done processing a grid layer
-            #     print(" - Done")
-            #     output_layer.SyncToDisk()
-
-            #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
-            #/*     Combined
-            #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
+            region_layer.SetSpatialFilter(None)
+            region_layer.ResetReading()
+            grid_layer.SetSpatialFilter(None)
+            grid_layer.ResetReading()
+            num_region_features = len(region_layer)
+            region_feature_counter = 0
+            fid_counter = -1
+            region_feature = None
+
+            try:
+
+                #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
+                #/*     Grid centric algorithm
+                #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
+
+                if processing_algorithm == 'grid':
+
+                    # Limit the number of grid cells that are examined with one convex hull per region feature
+                    print("    Progress units are grid features")
+                    print("    Prepping data ...")
+                    limit_geom = ogr.Geometry(ogr.wkbGeometryCollection)
+                    for region_feature in region_layer:
+                        limit_geom.AddGeometry(region_feature.GetGeometryRef().ConvexHull())
+                    region_layer.ResetReading()
+                    if coord_transform is not None:
+                        limit_geom.Transform(coord_transform)
+                    grid_layer.SetSpatialFilter(limit_geom)
 
-            if processing_algorithm == 'combined':
-
-                # Create an initial spatial filter consisting of one convex hull for every input region
-                # This yields a much smaller set of grid tiles that need to be examined
-                # Dump these filtered grid cells into an in-memory layer
-                # Loop through all regions, set a spatial filter on the in-memory layer = convex hull
-                # Stamp out all grid cells
-
-                print("    Progress units are region features")
-                print("    Prepping data ...")
-
-                # Create an initial spatial filter from all input geometries
-                # Create a single geometry containing one convex hull for every input feature
-                limit_geom = ogr.Geometry(ogr.wkbGeometryCollection)
-                limit_geom.AssignSpatialReference(region_layer.GetSpatialRef())
-                for region_feature in region_layer:
-                    region_geom = region_feature.GetGeometryRef()
-                    limit_geom.AddGeometry(region_geom.ConvexHull())
-                if limit_geom.GetSpatialReference().IsSame(grid_layer_srs) is not 1:
-                    limit_geom.Transform(coord_transform)
-                region_layer.ResetReading()
-                grid_layer.SetSpatialFilter(limit_geom)
-                region_feature = None
-                region_geom = None
-
-                # Loop through the region polygons, set a spatial filter
-                region_feature_counter = 0
-                num_region_features = len(region_layer)
-                fid_counter = -1
-                print("    Processing data ...")
-                for region_feature in region_layer:
-
-                    # Update user
-                    region_feature_counter += 1
-                    sys.stdout.write("\r\x1b[K" + "        %s/%s" % (region_feature_counter, num_region_features))
-                    sys.stdout.flush()
-
-                    region_geom = region_feature.GetGeometryRef().Clone()
+                    # The region layer is filtered in its own SRS
                     if coord_transform is not None:
-                        region_geom.Transform(coord_transform)
-                    grid_layer.ResetReading()
-                    grid_layer.SetSpatialFilter(region_geom.ConvexHull())
+                        reverse_transform = get_coord_transform(grid_layer, region_layer)
+                    else:
+                        reverse_transform = None
 
-                    # Stamp out all intersecting grids and add to output layer
+                    grid_feature_counter = 0
+                    num_grid_features = len(grid_layer)
+                    print("    Processing data ...")
                     for grid_feature in grid_layer:
 
+                        # Update user
+                        grid_feature_counter += 1
+                        sys.stdout.write("\r\x1b[K" + "        %s/%s" % (grid_feature_counter, num_grid_features))
+                        sys.stdout.flush()
+
                         grid_geom = grid_feature.GetGeometryRef()
-                        intersecting_geom = grid_geom.Intersection(region_geom)
-                        output_geom = ogr.Geometry(ogr.wkbMultiPolygon)
-
-                # # Stash all the found grid cells into an in memory layer
-                # mem_driver = ogr.GetDriverByName('Memory')
-                # mem_ds = mem_driver.CreateDataSource('mem_grids')
-                # mem_layer = mem_ds.CreateLayer('mem_grids', grid_layer.GetSpatialRef(), grid_layer.GetGeomType())
-                # print("")
-                # mi = 0
-                # for grid_feature in grid_layer:
-                #     mi += 1
-                #     print("Mem I: %s" % mi)
-                #     mem_layer.CreateFeature(grid_feature)
-                # grid_layer.ResetReading()
-                #
-                # # Loop through the region polygons, set a spatial filter
-                # region_feature_counter = 0
-                # num_region_features = len(region_layer)
-                # fid_counter = -1
-                # print("    Processing data ...")
-                # for region_feature in region_layer:
-                #
-                #     # Update user
-                #     region_feature_counter += 1
-                #     sys.stdout.write("\r\x1b[K" + "        %s/%s" % (region_feature_counter, num_region_features))
-                #     sys.stdout.flush()
-                #
-                #     region_geom = region_feature.GetGeometryRef().Clone()
-                #     if coord_transform is not None:
-                #         region_geom.Transform(coord_transform)
-                #     mem_layer.ResetReading()
-                #     mem_layer.SetSpatialFilter(region_geom.ConvexHull())
-                #
-                #     # Stamp out all intersecting grids and add to output layer
-                #     for m_grid_feature in mem_layer:
-                #
-                #         m_grid_geom = m_grid_feature.GetGeometryRef()
-                #         intersecting_geom = m_grid_geom.Intersection(region_geom)
-                #         output_geom = ogr.Geometry(ogr.wkbMultiPolygon)
-
-                        # NOTE: This logic ONLY allows multi/polygons to pass through - although first IF statement might let others through
-                        # Logic in the validate section still only allows polygons
-
-                        # POLYGON - Add
-                        if intersecting_geom.GetGeometryType() in (ogr.wkbPolygon, ogr.wkbPolygon25D):
-                            output_geom.AddGeometry(intersecting_geom)
-                            intersecting_geom = None
-
-                        # LINEARRING - Actually a closed polygon - convert to polygon and add
-                        elif intersecting_geom.GetGeometryType() is ogr.wkbLinearRing and is_ring_poly(intersecting_geom):
-                            output_geom.AddGeometry(ring2poly(intersecting_geom))
-                            intersecting_geom = None
-
-                        # MULTIPOLYGON - Split into and add individual polygons
-                        elif intersecting_geom.GetGeometryType() in (ogr.wkbMultiPolygon, ogr.wkbMultiPolygon25D):
-                            for add_poly in [intersecting_geom.GetGeometryRef(i) for i in range(intersecting_geom.GetGeometryCount())]:
-                                output_geom.AddGeometry(add_poly)
-                            add_poly = None
-                            intersecting_geom = None
-
-                        # POINT or MULTIPOINT - Discard
-                        elif intersecting_geom.GetGeometryType() in (ogr.wkbPoint, ogr.wkbPoint25D,
-                                                                     ogr.wkbMultiPoint, ogr.wkbMultiPoint25D):
-                            intersecting_geom = None
-
-                        # LINESTRING or MULTILINESTRING
-                        elif intersecting_geom.GetGeometryType() in (ogr.wkbLineString, ogr.wkbLineString25D,
-                                                                     ogr.wkbMultiLineString, ogr.wkbMultiLineString25D):
-                            intersecting_geom = None
-
-                        # The edge cases of edge cases - the "gridify problem"
-                        # Geometry collection could contain any combination of points, multipoints, lines, multilines,
-                        # linearrings, polygons, and multipolygons.  All must be dealt with.
-                        elif intersecting_geom.GetGeometryType() is ogr.wkbGeometryCollection:
-                            for sub_geom_i in range(intersecting_geom.GetPointCount()):
-                                sub_geom = intersecting_geom.GetGeometryRef(sub_geom_i)
-
-                                # Sub geometry is a polygon - add to output
-                                if sub_geom.GetGeometryType() in (ogr.wkbPolygon, ogr.wkbPolygon25D):
-                                    output_geom.AddGeometry(sub_geom)
-
-                                # Sub geometry is a linearring that is actually a closed and should be a polygon
-                                elif sub_geom.GetGeometryType() is ogr.wkbLinearRing and is_ring_poly(sub_geom):
-                                    output_geom.AddGeometry(ring2poly(sub_geom))
-
-                                # Sub geometry is a multipolygon - explode and add individually
-                                elif sub_geom.GetGeometryType() in (ogr.wkbMultiPolygon, ogr.wkbMultiPolygon25D):
-                                    for add_poly in [sub_geom.GetGeometryRef(i) for i in range(sub_geom.GetGeometryCount())]:
-                                        output_geom.AddGeometry(add_poly)
-                                    add_poly = None
-
-                            sub_geom = None
-                            intersecting_geom = None
-
-                        # Unrecognized geometry type
-                        else:
-                            print("")
-                            print("")
-                            print("ERROR: Unrecognized geometry")
-                            print("       Intersections can sometimes yield strange geometry")
-                            print("")
-                            print("       Input file information:")
-                            print("       Region FID: %s" % region_feature.GetFID())
-                            print("       Grid FID: %s" % m_grid_feature.GetFID())
-                            print("")
-                            print("       Problem geometry information:")
-                            print("       Type: %s" % intersecting_geom.GetGeometryType())
-                            print("       Name: %s" % intersecting_geom.GetGeometryName())
-                            print("       Geometry count: %s" % intersecting_geom.GetGeometryCount())
-                            print("       Point count: %s" % intersecting_geom.GetPointCount())
-                            print("")
-                            intersecting_geom = None
+                        region_filter = grid_geom.Clone()
+                        if reverse_transform is not None:
+                            region_filter.Transform(reverse_transform)
+                        region_layer.SetSpatialFilter(region_filter)
+                        region_layer.ResetReading()
+                        for region_feature in region_layer:
+                            region_geom = region_feature.GetGeometryRef().Clone()
+                            if coord_transform is not None:
+                                region_geom.Transform(coord_transform)
+                            output_geom = clean_intersection(grid_geom.Intersection(region_geom))
+                            if not output_geom.IsEmpty():
+                                fid_counter += 1
+                                write_output_feature(output_layer, region_feature, output_geom, fid_counter)
+                    region_layer.SetSpatialFilter(None)
+
+                #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
+                #/*     Parallel region centric algorithm
+                #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
+
+                elif processing_algorithm == 'parallel':
+
+                    # Workers only receive region FIDs and return WKB - output is written here in region order
+                    print("    Progress units are region features")
+                    print("    Processing data with %s workers ..." % num_jobs)
+                    region_fids = [region_feature.GetFID() for region_feature in region_layer]
+                    region_layer.ResetReading()
+                    chunk_size = max(1, min(chunk_size_limit, len(region_fids) // (num_jobs * 4) or 1))
+                    jobs = [(region_file, region_layer.GetName(), grid_file, grid_layer.GetName(),
+                             region_fids[c:c + chunk_size]) for c in range(0, len(region_fids), chunk_size)]
+                    pool = multiprocessing.Pool(num_jobs)
+                    try:
+                        for results in pool.imap(parallel_worker, jobs):
+                            for region_fid, wkbs in results:
+
+                                # Update user
+                                region_feature_counter += 1
+                                sys.stdout.write("\r\x1b[K" + "        %s/%s" % (region_feature_counter,
+                                                                                 num_region_features))
+                                sys.stdout.flush()
+
+                                region_feature = region_layer.GetFeature(region_fid)
+                                for wkb in wkbs:
+                                    fid_counter += 1
+                                    write_output_feature(output_layer, region_feature,
+                                                         ogr.CreateGeometryFromWkb(wkb), fid_counter)
+                    finally:
+                        pool.terminate()
+                        pool.join()
+
+                #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
+                #/*     Region centric algorithms
+                #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
+
+                else:
+
+                    print("    Progress units are region features")
+                    print("    Prepping data ...")
+
+                    grid_index = None
+                    if processing_algorithm == 'analytic':
+                        grid_index = regular_grid_index(grid_layer)
+                        if grid_index is None:
+                            print("ERROR: Grid layer is not a regular grid - can't use algorithm: %s"
+                                  % processing_algorithm)
                             output_layer = None
                             region_layer = None
                             grid_layer = None
                             return 1
 
-                        # Add output feature
-                        if not output_geom.IsEmpty():
-                            output_feature = region_feature.Clone()
-                            fid_counter += 1
-                            output_feature.SetFID(fid_counter)
-                            output_feature.SetGeometry(output_geom)
-                            output_layer.CreateFeature(output_feature)
-
-
-                # Update user - done processing a grid layer
-                print(" - Done")
-                output_layer.SyncToDisk()
-
-            #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
-            #/*     Bad algorithm
-            #/* ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ */#
+                    # Create an initial spatial filter consisting of one convex hull for every input region
+                    # This yields a much smaller set of grid tiles that need to be examined
+                    elif processing_algorithm == 'combined':
+                        limit_geom = ogr.Geometry(ogr.wkbGeometryCollection)
+                        for region_feature in region_layer:
+                            limit_geom.AddGeometry(region_feature.GetGeometryRef().ConvexHull())
+                        region_layer.ResetReading()
+                        if coord_transform is not None:
+                            limit_geom.Transform(coord_transform)
+                        grid_layer.SetSpatialFilter(limit_geom)
+                        region_feature = None
+
+                    print("    Processing data ...")
+                    for region_feature in region_layer:
+
+                        # Update user
+                        region_feature_counter += 1
+                        sys.stdout.write("\r\x1b[K" + "        %s/%s" % (region_feature_counter, num_region_features))
+                        sys.stdout.flush()
+
+                        region_geom = region_feature.GetGeometryRef().Clone()
+                        if coord_transform is not None:
+                            region_geom.Transform(coord_transform)
+
+                        if processing_algorithm == 'analytic':
+                            output_geoms = stamp_region_analytic(region_geom, grid_index)
+                        elif processing_algorithm == 'regionnohull':
+                            output_geoms = stamp_region(region_geom, grid_layer)
+                        else:
+                            output_geoms = stamp_region(region_geom, grid_layer, region_geom.ConvexHull())
 
-            else:
-                print("ERROR: Invalid processing algorithm: %s" % processing_algorithm)
+                        # Stamp out all intersecting grids and add to output layer
+                        for output_geom in output_geoms:
+                            fid_counter += 1
+                            write_output_feature(output_layer, region_feature, output_geom, fid_counter)
+
+            # Intersections can sometimes yield strange geometry
+            except TypeError as e:
+                print("")
+                print("")
+                print("ERROR: %s" % e)
+                print("       Intersections can sometimes yield strange geometry")
+                if region_feature is not None:
+                    print("       Region FID: %s" % region_feature.GetFID())
+                print("")
+                output_layer = None
+                region_layer = None
+                grid_layer = None
                 return 1
 
+            # Update user - done processing a grid layer
+            grid_layer.SetSpatialFilter(None)
+            print(" - Done")
+            output_layer.SyncToDisk()
+
     # Cleanup
     sub_geom = None
     all_geoms = None
@@ -0,0 +1,93 @@
+import unittest2
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+from .. import csv2kml
+
+
+class VesselTest(unittest2.TestCase):
+
+    def _record(self, dt):
+        return {'mmsi': '1', 'datetime': dt}
+
+    def test_sort_dedupes_in_time_order(self):
+        start = datetime(2014, 1, 1)
+        offsets = [300, 0, 30, 120, 150, 59, 60]
+        vessel = csv2kml.Vessel({'mmsi': '1'})
+        for offset in offsets:
+            vessel.add_ais(self._record(start + timedelta(seconds=offset)))
+        vessel.sort()
+        expected = [start + timedelta(seconds=offset) for offset in (0, 60, 120, 300)]
+        self.assertEqual(expected, vessel.timestamps)
+        self.assertEqual(expected, [ais['datetime'] for ais in vessel.ais])
+
+    def test_sort_ignores_input_order(self):
+        start = datetime(2014, 1, 1)
+        offsets = [0, 45, 90, 135, 180, 3600]
+        forward = csv2kml.Vessel({'mmsi': '1'})
+        backward = csv2kml.Vessel({'mmsi': '1'})
+        for offset in offsets:
+            forward.add_ais(self._record(start + timedelta(seconds=offset)))
+        for offset in reversed(offsets):
+            backward.add_ais(self._record(start + timedelta(seconds=offset)))
+        forward.sort()
+        backward.sort()
+        self.assertEqual(forward.timestamps, backward.timestamps)
+
+
+class ParseDatetimeTest(unittest2.TestCase):
+
+    def test_epoch(self):
+        self.assertEqual(datetime.fromtimestamp(1325810870), csv2kml.parse_datetime('1325810870', True))
+
+    def test_epoch_falls_back_to_dateutil(self):
+        self.assertEqual(datetime(2012, 1, 6, 0, 47, 50), csv2kml.parse_datetime('2012-01-06 00:47:50', True))
+
+    def test_datetime(self):
+        self.assertEqual(datetime(2012, 1, 6, 0, 47, 50), csv2kml.parse_datetime('2012-01-06T00:47:50', False))
+
+    def test_compact_datetime_is_not_epoch(self):
+        self.assertFalse(csv2kml.is_epoch_seconds('20140101120000'))
+        self.assertFalse(csv2kml.is_epoch_seconds('20140101'))
+        self.assertTrue(csv2kml.is_epoch_seconds('1325810870'))
+        self.assertEqual(datetime(2014, 1, 1, 12, 0, 0), csv2kml.parse_datetime('20140101120000', True))
+
+    def test_iter_csv_rows_compact_datetime(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tempdir, 'compact.csv')
+            with open(filename, 'w') as f:
+                f.write('mmsi,timestamp,longitude,latitude\n1,20140101,0,0\n1,20140102,0,0\n')
+            self.assertEqual([datetime(2014, 1, 1), datetime(2014, 1, 2)],
+                             [row['datetime'] for mmsi, row in csv2kml.iter_csv_rows(filename)])
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class SuperOverlayTest(unittest2.TestCase):
+
+    def _record(self, lon, lat, gridcode=''):
+        return {'longitude': str(lon), 'latitude': str(lat), 'gridcode': gridcode}
+
+    def test_simplify_track(self):
+        records = [self._record(0, 0), self._record(1, 0.01), self._record(2, 0), self._record(3, 1), self._record(4, 0)]
+        simplified = csv2kml.simplify_track(records, 0.1)
+        self.assertEqual([records[0], records[2], records[3], records[4]], simplified)
+        self.assertEqual(records, csv2kml.simplify_track(records, 0))
+
+    def test_split_track_pieces(self):
+        records = [self._record(0, 0, '00'), self._record(0, 0, '01'), self._record(0, 0, '10'),
+                   self._record(0, 0, '11'), self._record(0, 0, '02')]
+        tiles = csv2kml.split_track_pieces([(records, 'style')], 1)
+        # Each piece keeps the record following it so the pieces join up, and a last lone record isn't a line
+        self.assertEqual([(records[0:3], 'style')], tiles['0'])
+        self.assertEqual([(records[2:5], 'style')], tiles['1'])
+
+    def test_thin_records(self):
+        records = range(10)
+        shown, rest = csv2kml.thin_records(records, 5)
+        self.assertEqual([0, 2, 4, 6, 8], shown)
+        self.assertEqual([1, 3, 5, 7, 9], rest)
+        self.assertEqual((records, []), csv2kml.thin_records(records, 10))